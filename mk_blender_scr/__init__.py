@@ -1,9 +1,17 @@
 from mk_blender_scr import *
 from mk_blender_scr.blender.make_script import create,BallAndStick,Stick,SpaceFilling,Animation
+from mk_blender_scr.blender.region import select_region
+from mk_blender_scr.blender.mesh_export import export_mesh
+from mk_blender_scr.blender.preview import render_preview,render_previews
+from mk_blender_scr.blender.estimate import estimate
+from mk_blender_scr.blender.profiling import Profiler
+from mk_blender_scr.blender.dry_run import dry_run,compare_reports
 from mk_blender_scr.visualize.by_nglview import view_with_coordinate,view_with_index
 from mk_blender_scr.visualize.custum_viewer import View
+from mk_blender_scr.io.memmap_trajectory import MemmapTrajectory
 
 __all__ = [
-    "View","view_with_index","view_with_coordinate"
+    "View","view_with_index","view_with_coordinate","MemmapTrajectory",
     "make_py_script",
-    "BallAndStick","Stick","SpaceFilling","Animation"]
\ No newline at end of file
+    "BallAndStick","Stick","SpaceFilling","Animation","select_region","export_mesh",
+    "render_preview","render_previews","estimate","Profiler","dry_run","compare_reports"]
\ No newline at end of file
@@ -1,6 +1,14 @@
 from mk_blender_scr.blender.make_script import create,BallAndStick,Stick,SpaceFilling,Animation
+from mk_blender_scr.blender.region import select_region
+from mk_blender_scr.blender.mesh_export import export_mesh
+from mk_blender_scr.blender.preview import render_preview,render_previews
+from mk_blender_scr.blender.estimate import estimate
+from mk_blender_scr.blender.profiling import Profiler
+from mk_blender_scr.blender.dry_run import dry_run,compare_reports
 
 __all__ = [
     "create",
-    "BallAndStick","Stick","SpaceFilling","Animation"
+    "BallAndStick","Stick","SpaceFilling","Animation",
+    "select_region","export_mesh","render_preview","render_previews","estimate","Profiler",
+    "dry_run","compare_reports",
 ]
\ No newline at end of file
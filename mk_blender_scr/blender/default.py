@@ -3,17 +3,31 @@ from pathlib import Path
 # Animation
 step=3
 start=1
+playback = "keyframe" # "keyframe"または"handler"(再生時に座標を読み込む)
+interpolate = False # playback="handler"の時,保存したフレーム間を線形補間する
+encoding = {"dtype":"float32","delta":False,"compression":"zlib","level":6,"block_size":100} # Blenderの座標はfloat32
 pyfile="animation.py"
 pklfile="property.pkl"
 # Bonds
 bond_color = (0.5, 0.5, 0.5 ,1.0)
 radius = 0.08
 bicolor=False
+# Mesh (Blenderのprimitive_uv_sphere_add,primitive_cylinder_addのデフォルトと同じ)
+sphere_segments = 32
+sphere_rings = 16
+cylinder_vertices = 32
 # Viewer
 width = 600
 height = 600
+lod_thresholds = {"reduced":20000,"line":200000} # 原子数がこれ以上の場合,Viewで軽量な表示を用いる
+lod_params = {
+    "full":{},
+    "reduced":{"sphereDetail":0,"radialSegments":4,"disableImpostor":False},
+    "line":{},
+    }
 # Atoms
 scale = 0.4
+chunk_size = None # 1チャンクの最大原子数.Noneの場合は分割しない
 space_filling_scale = 1.0
 color = {element:rgba for element,rgba in read_elementsini(Path(__file__).joinpath('../../', 'default_color.ini').resolve()).items()}
 sizes={
@@ -115,6 +129,9 @@ sizes={
     'Zn': 1.37,
     'Zr': 1.6,
     }
+# Estimate (シーンの規模の上限.Noneの項目は確認しない)
+budgets = {"objects":100000,"faces":None,"render_faces":100000000,"keyframes":None,"materials":None,
+           "script_nbytes":None,"sidecar_nbytes":None}
 # Render
 subdivision_surface = {"apply":False,"level":3,"render_levels":3}
 cartoon = {"apply":False,"IOR":0.9,"color":(0,0,0,1)}
\ No newline at end of file
@@ -0,0 +1,460 @@
+import sys
+import time
+import types
+import zipfile
+import tempfile
+from pathlib import Path
+import numpy as np
+
+from mk_blender_scr.blender.tessellation import uv_sphere_size,cylinder_size
+
+# 比較する項目(増えたら回帰とみなす)
+COST_KEYS = ["operator_calls","objects","meshes","materials","keyframes","vertices","faces","python_seconds"]
+
+class Recorder():
+    """dry_runで呼ばれたBlenderの操作を数える"""
+    def __init__(self):
+        self.operators = {}
+        self.keyframes = 0
+
+    def call(self,name):
+        self.operators[name] = self.operators.get(name,0)+1
+
+# mathutils ------------------------------------------------------------
+
+class Matrix():
+    """mathutils.Matrixの代わり(4x4のみ).テンプレートで使う演算のみ"""
+    def __init__(self,rows=None):
+        self.m = np.identity(4) if rows is None else np.array(rows,dtype=float)
+
+    def __matmul__(self,other):
+        return Matrix(self.m@other.m)
+
+    @classmethod
+    def Translation(cls,vector):
+        m = np.identity(4)
+        m[:3,3] = list(vector)[:3]
+        return cls(m)
+
+    @classmethod
+    def Scale(cls,factor,size,axis):
+        m = np.identity(4)
+        axis = np.asarray(axis,dtype=float)
+        m[:3,:3] += (factor-1)*np.outer(axis,axis)
+        return cls(m)
+
+    @classmethod
+    def Rotation(cls,angle,size,axis):
+        axis = np.asarray(axis,dtype=float)
+        norm = np.linalg.norm(axis)
+        m = np.identity(4)
+        if norm > 0:
+            x,y,z = axis/norm
+            K = np.array([[0,-z,y],[z,0,-x],[-y,x,0]])
+            m[:3,:3] = np.identity(3)+np.sin(angle)*K+(1-np.cos(angle))*K@K
+        return cls(m)
+
+    def to_4x4(self):
+        return Matrix(self.m)
+
+    def to_matrix(self):
+        return self
+
+    def decompose(self):
+        scale = np.linalg.norm(self.m[:3,:3],axis=0)
+        rotation = np.identity(4)
+        rotation[:3,:3] = self.m[:3,:3]/np.where(scale == 0,1,scale)
+        return Vector(self.m[:3,3]),Matrix(rotation),Vector(scale)
+
+class Vector(list):
+    def __init__(self,values):
+        super().__init__(float(v) for v in values)
+
+# bpy.data ------------------------------------------------------------
+
+class Collection():
+    """bpy.data.objects等の代わり.名前で取り出せるリスト"""
+    def __init__(self,factory=None):
+        self.items = {}
+        self.factory = factory
+        self.counters = {}
+
+    def _unique_name(self,name):
+        """Blenderと同様に重複する名前には.001等を付ける"""
+        if name not in self.items:
+            return name
+        n = self.counters.get(name,1)
+        while f"{name}.{n:03d}" in self.items:
+            n += 1
+        self.counters[name] = n
+        return f"{name}.{n:03d}"
+
+    def add(self,item):
+        item._name = self._unique_name(item._name)
+        item._owner = self
+        self.items[item._name] = item
+        return item
+
+    def new(self,name,*args,**kwargs):
+        return self.add(self.factory(name,*args,**kwargs))
+
+    def remove(self,item):
+        self.items.pop(item._name,None)
+
+    def get(self,name,default=None):
+        return self.items.get(name,default)
+
+    def rename(self,item,name):
+        self.items.pop(item._name,None)
+        item._name = self._unique_name(name)
+        self.items[item._name] = item
+
+    def __getitem__(self,key):
+        if isinstance(key,int):
+            return list(self.items.values())[key]
+        return self.items[key]
+
+    def __contains__(self,key):
+        return key in self.items
+
+    def __iter__(self):
+        return iter(list(self.items.values()))
+
+    def __len__(self):
+        return len(self.items)
+
+class ID():
+    """名前を持つデータ(Object,Mesh,Material等).名前を変更すると所属するCollectionも更新する"""
+    def __init__(self,name):
+        self._name = name
+        self._owner = None
+
+    @property
+    def name(self):
+        return self._name
+
+    @name.setter
+    def name(self,name):
+        if self._owner is not None:
+            self._owner.rename(self,name)
+        else:
+            self._name = name
+
+class Socket():
+    def __init__(self,name=""):
+        self.name = name
+        self.default_value = None
+
+class Sockets():
+    """ノードの入出力.indexでも名前でも取り出せる"""
+    def __init__(self):
+        self.sockets = {}
+
+    def __getitem__(self,key):
+        if isinstance(key,int):
+            key = f"#{key}"
+        return self.sockets.setdefault(key,Socket(key))
+
+class Node():
+    def __init__(self,type):
+        self.type = type
+        self.inputs = Sockets()
+        self.outputs = Sockets()
+        self.location = (0,0)
+
+class Nodes(dict):
+    def new(self,type):
+        node = Node(type)
+        self[f"{type}.{len(self)}"] = node
+        return node
+
+class NodeTree():
+    def __init__(self):
+        self.nodes = Nodes({"Principled BSDF":Node("ShaderNodeBsdfPrincipled"),
+                            "Material Output":Node("ShaderNodeOutputMaterial")})
+        self.links = types.SimpleNamespace(new=lambda a,b:(a,b))
+
+class Material(ID):
+    def __init__(self,name):
+        super().__init__(name)
+        self.use_nodes = False
+        self.node_tree = NodeTree()
+        self.diffuse_color = (0.8,0.8,0.8,1.0)
+
+class Polygons():
+    """Mesh.polygons.foreach_setで設定された属性"""
+    def __init__(self):
+        self.attributes = {}
+
+    def foreach_set(self,attr,values):
+        self.attributes[attr] = list(values)
+
+class Mesh(ID):
+    def __init__(self,name,n_vertices=0,n_faces=0):
+        super().__init__(name)
+        self.materials = []
+        self.n_vertices = n_vertices
+        self.n_faces = n_faces
+
+        self.polygons = Polygons()
+
+    def from_pydata(self,vertices,edges,faces):
+        self.n_vertices = len(vertices)
+        self.n_faces = len(faces)
+
+    def update(self):
+        pass
+
+class Modifier():
+    def __init__(self,name,type):
+        self.name = name
+        self.type = type
+        self.levels = 1
+        self.render_levels = 2
+
+class Modifiers(dict):
+    def new(self,name,type):
+        self[name] = Modifier(name,type)
+        return self[name]
+
+class Object(ID):
+    def __init__(self,name,data=None,recorder=None):
+        super().__init__(name)
+        self.data = data
+        self.location = Vector((0,0,0))
+        self.matrix_world = Matrix()
+        self.modifiers = Modifiers()
+        self.recorder = recorder
+
+    def keyframe_insert(self,data_path,index=-1,frame=None):
+        # index=-1の場合は全ての成分(locationはx,y,z)にキーを打つ
+        self.recorder.keyframes += 3 if index == -1 else 1
+        return True
+
+class Text(ID):
+    def __init__(self,name):
+        super().__init__(name)
+        self.body = ""
+        self.use_module = False
+
+    def write(self,text):
+        self.body += text
+
+    def as_string(self):
+        return self.body
+
+class Links(list):
+    """コレクションに含まれるオブジェクトや子コレクション(データの所有はしない)"""
+    def link(self,item):
+        self.append(item)
+
+    def unlink(self,item):
+        self.remove(item)
+
+    def __contains__(self,name):
+        return any(item.name == name for item in self)
+
+    def __getitem__(self,key):
+        if isinstance(key,str):
+            return next(item for item in self if item.name == key)
+        return super().__getitem__(key)
+
+    def __iter__(self):
+        # ループ中にunlinkされても良いようにコピーを返す
+        return iter(list.copy(self))
+
+class SceneCollection():
+    def __init__(self,name):
+        self.name = name
+        self.objects = Links()
+        self.children = Links()
+
+class LayerCollection():
+    def __init__(self,collection):
+        self.collection = collection
+        self.name = collection.name
+
+    @property
+    def children(self):
+        return {child.name:LayerCollection(child) for child in self.collection.children}
+
+class CollectionData(ID,SceneCollection):
+    def __init__(self,name):
+        ID.__init__(self,name)
+        self.objects = Links()
+        self.children = Links()
+
+# bpy ------------------------------------------------------------
+
+class _Operators():
+    """bpy.ops.<カテゴリ>.<名前>の代わり.呼び出しを数え,対応する関数があれば実行する"""
+    def __init__(self,bpy,category=None):
+        self._bpy = bpy
+        self._category = category
+
+    def __getattr__(self,name):
+        if self._category is None:
+            return _Operators(self._bpy,name)
+        full_name = f"{self._category}.{name}"
+        implementation = self._bpy._operators.get(full_name)
+        def operator(*args,**kwargs):
+            self._bpy.recorder.call(full_name)
+            if implementation is not None:
+                implementation(*args,**kwargs)
+            return {"FINISHED"}
+        return operator
+
+def make_bpy(recorder,filepath=""):
+    """記録用のbpyモジュール(とbpy.app,bpy.app.handlers)を作る"""
+    bpy = types.ModuleType("bpy")
+    bpy.recorder = recorder
+    data = types.SimpleNamespace(
+        objects=Collection(lambda name,data=None:Object(name,data,recorder)),
+        meshes=Collection(Mesh),
+        materials=Collection(Material),
+        collections=Collection(CollectionData),
+        texts=Collection(Text),
+        filepath=filepath)
+    scene_collection = SceneCollection("Scene Collection")
+    scene = types.SimpleNamespace(collection=scene_collection,frame_current=1,frame_start=1,frame_end=250)
+    scene.frame_set = lambda frame:setattr(scene,"frame_current",frame)
+    view_layer = types.SimpleNamespace(layer_collection=LayerCollection(scene_collection))
+    view_layer.active_layer_collection = view_layer.layer_collection
+    context = types.SimpleNamespace(scene=scene,view_layer=view_layer,active_object=None)
+    handlers = types.ModuleType("bpy.app.handlers")
+    handlers.frame_change_pre = []
+    handlers.frame_change_post = []
+    handlers.persistent = lambda func:func
+    app = types.ModuleType("bpy.app")
+    app.handlers = handlers
+    app.version = (0,0,0)
+    app.version_string = "dry-run"
+    bpy.data,bpy.context,bpy.app = data,context,app
+
+    def add_object(name,n_vertices,n_faces,location=(0,0,0)):
+        mesh = data.meshes.new(name,n_vertices,n_faces)
+        obj = data.objects.new(name,mesh)
+        obj.location = Vector(location)
+        obj.matrix_world = Matrix.Translation(location)
+        view_layer.active_layer_collection.collection.objects.link(obj)
+        context.active_object = obj
+
+    def uv_sphere_add(radius=1.0,location=(0,0,0),segments=32,ring_count=16,**kwargs):
+        n_vertices,faces = uv_sphere_size(segments,ring_count)
+        add_object("Sphere",n_vertices,sum(faces.values()),location)
+
+    def cylinder_add(radius=1.0,depth=2.0,location=(0,0,0),vertices=32,**kwargs):
+        n_vertices,faces = cylinder_size(vertices)
+        add_object("Cylinder",n_vertices,sum(faces.values()),location)
+
+    bpy._operators = {
+        "mesh.primitive_uv_sphere_add":uv_sphere_add,
+        "mesh.primitive_cylinder_add":cylinder_add,
+    }
+    bpy.ops = _Operators(bpy)
+    return bpy
+
+def make_mathutils():
+    mathutils = types.ModuleType("mathutils")
+    mathutils.Matrix = Matrix
+    mathutils.Vector = Vector
+    return mathutils
+
+def _report(bpy,recorder,seconds):
+    meshes = list(bpy.data.meshes)
+    return {"operators":dict(sorted(recorder.operators.items())),
+            "operator_calls":sum(recorder.operators.values()),
+            "objects":len(bpy.data.objects),
+            "meshes":len(meshes),
+            "materials":len(bpy.data.materials),
+            "collections":len(bpy.data.collections),
+            "keyframes":recorder.keyframes,
+            "vertices":sum(mesh.n_vertices for mesh in meshes),
+            "faces":sum(mesh.n_faces for mesh in meshes),
+            "handlers":len(bpy.app.handlers.frame_change_pre),
+            "python_seconds":seconds}
+
+def dry_run(file,argv=None,keep_data=False):
+    """作成したスクリプトをBlenderを使わずに実行し,Blenderの操作の回数とPythonの実行時間を返す
+
+    | bpyとmathutilsを記録用の代わりのモジュールに置き換えて実行する.
+    | オペレーターの呼び出し回数,作成されたオブジェクト,メッシュ,マテリアル,キーフレームの数,
+    | 頂点数と面数(Subdivision Surfaceは含まない),実行時間を数えるので,
+    | テンプレートの変更でスクリプトの結果やコストが変わっていないかをBlenderなしで確認できる(:func:`compare_reports` ).
+
+    Parameters:
+
+    file: str or Path
+        | createで作成したpythonファイル,またはAnimationのzipファイル
+        | zipの場合は一時ディレクトリに展開して実行する.
+    argv: list of str
+        スクリプトに渡す引数("--"の後の引数). ex) ["--chunks","0-3"]
+    keep_data: bool
+        | Trueの場合,返り値の"data"に記録用のbpy.dataを含める.
+        | report["data"].objects["Atom0Na"].locationのようにオブジェクトの位置や名前を確認できる.
+
+    Returns:
+        dict: {"operators":{オペレーター名:回数},"operator_calls","objects","meshes","materials",
+        "collections","keyframes","vertices","faces","handlers","python_seconds"}
+    """
+    file = Path(file)
+    if file.suffix == ".zip":
+        with tempfile.TemporaryDirectory() as tmpdir, zipfile.ZipFile(file) as zf:
+            zf.extractall(tmpdir)
+            scripts = [name for name in zf.namelist() if name.endswith(".py")]
+            if not scripts:
+                raise ValueError(f"{file}にpythonスクリプトがありません")
+            return _run(Path(tmpdir)/scripts[0],argv,keep_data)
+    return _run(file,argv,keep_data)
+
+def _run(script,argv,keep_data):
+    recorder = Recorder()
+    # Animationの座標ファイルは.blendと同じ場所から読み込まれるので,スクリプトの場所の.blendとして実行する
+    bpy = make_bpy(recorder,filepath=str(script.resolve().with_suffix(".blend")))
+    modules = {"bpy":bpy,"bpy.app":bpy.app,"bpy.app.handlers":bpy.app.handlers,"mathutils":make_mathutils()}
+    saved_modules = {name:sys.modules.get(name) for name in modules}
+    saved_argv = sys.argv
+    sys.modules.update(modules)
+    sys.argv = [str(script)]+(["--"]+list(argv) if argv else [])
+    try:
+        code = compile(script.read_text(encoding="utf8"),str(script),"exec")
+        start = time.perf_counter()
+        exec(code,{"__name__":"__main__","__file__":str(script)})
+        seconds = time.perf_counter()-start
+    finally:
+        sys.argv = saved_argv
+        for name,module in saved_modules.items():
+            if module is None:
+                sys.modules.pop(name,None)
+            else:
+                sys.modules[name] = module
+    report = _report(bpy,recorder,seconds)
+    if keep_data:
+        report["data"] = bpy.data
+    return report
+
+def compare_reports(report,baseline,tolerance=0.0,time_tolerance=0.5):
+    """dry_runの結果を基準(以前の結果)と比べ,増えた項目を返す
+
+    Parameters:
+
+    report: dict
+        dry_runの結果
+    baseline: dict
+        基準とするdry_runの結果
+    tolerance: float
+        許容する増加の割合(python_seconds以外)
+    time_tolerance: float
+        python_secondsで許容する増加の割合(実行時間はばらつくので大きめにする)
+
+    Returns:
+        dict: {項目:{"value","baseline"}} 増加が許容範囲を超えた項目.空なら回帰なし
+    """
+    regressions = {}
+    for key in COST_KEYS:
+        if key not in baseline:
+            continue
+        limit = time_tolerance if key == "python_seconds" else tolerance
+        if report[key] > baseline[key]*(1+limit):
+            regressions[key] = {"value":report[key],"baseline":baseline[key]}
+    return regressions
@@ -0,0 +1,259 @@
+import io
+import json
+import zlib
+import lzma
+import struct
+import numpy as np
+
+INT_DTYPES = ["int16","int32"]
+FLOAT_DTYPES = ["float32","float64"]
+# ファイルの構成: MAGIC + ブロック + ヘッダー(JSON) + ヘッダーのバイト数(uint32,リトルエンディアン)
+# ヘッダー(ブロック表)は全てのブロックの後に書くので,フレーム数が分からなくても読み込みながら書き込める
+MAGIC = b"MKBSPOS2"
+
+def compress(data,compression=None,level=None):
+    if compression is None:
+        return data
+    elif compression == "zlib":
+        return zlib.compress(data,-1 if level is None else level)
+    elif compression == "lzma":
+        return lzma.compress(data,preset=level)
+    raise ValueError(f"compressionは'zlib','lzma'またはNoneです: {compression}")
+
+def decompress(data,compression=None):
+    if compression is None:
+        return data
+    elif compression == "zlib":
+        return zlib.decompress(data)
+    elif compression == "lzma":
+        return lzma.decompress(data)
+    raise ValueError(f"compressionは'zlib','lzma'またはNoneです: {compression}")
+
+def quantize(positions,dtype):
+    """座標をバウンディングボックスに対する固定小数点(dtype)に変換する
+
+    Returns:
+        tuple: (量子化した配列, {"origin","scale","offset"})
+    """
+    info = np.iinfo(dtype)
+    origin = positions.min(axis=(0,1))
+    scale = (positions.max(axis=(0,1))-origin)/(2**info.bits-1)
+    scale[scale == 0] = 1.0
+    q = np.round((positions-origin)/scale)+info.min
+    params = {"origin":origin.tolist(),"scale":scale.tolist(),"offset":int(info.min)}
+    return q.astype(dtype),params
+
+def dequantize(q,params):
+    return (q.astype(np.float64)-params["offset"])*np.array(params["scale"])+np.array(params["origin"])
+
+def _encode_block(positions,dtype,delta,compression,level):
+    """1ブロック分の座標をエンコードする.量子化のバウンディングボックスはブロック毎"""
+    positions = np.asarray(positions,dtype=np.float64)
+    block = {}
+    if dtype in INT_DTYPES:
+        q,params = quantize(positions,dtype)
+        block.update(params)
+        max_error = float(np.abs(dequantize(q,params)-positions).max())
+        if delta:
+            q[1:] = np.diff(q,axis=0)
+    else:
+        q = positions.astype(dtype)
+        max_error = float(np.abs(q-positions).max())
+    return compress(q.tobytes(),compression,level),block,max_error
+
+def _decode_block(data,header,block):
+    shape = (block["n_frames"],header["n_atoms"],3)
+    q = np.frombuffer(decompress(data,header["compression"]),dtype=header["dtype"]).reshape(shape)
+    if header["delta"]:
+        q = np.cumsum(q,axis=0,dtype=header["dtype"])
+    if header["dtype"] in INT_DTYPES:
+        return dequantize(q,block)
+    return q.astype(np.float64)
+
+def encode_positions_chunks(positions,dtype="float32",delta=False,compression="zlib",level=None,
+                            block_size=100,start=1,step=1):
+    """encode_positionsと同じだが,連結せずに(ヘッダー部分,各ブロック)のバイト列のリストを返す
+
+    | ファイルやzipに順に書き込めば連結したバイト列のコピーを作らずに済む.
+
+    Returns:
+        tuple: (バイト列のリスト, ヘッダー(dict), 最大量子化誤差(Å))
+    """
+    return _encode(positions,dtype,delta,compression,level,block_size,start,step)
+
+def encode_positions(positions,dtype="float32",delta=False,compression="zlib",level=None,
+                     block_size=100,start=1,step=1):
+    """Animationの座標(フレーム数,原子数,3)をバイト列にエンコードする
+    
+    | block_sizeフレーム毎のブロックに分けて圧縮し,各ブロックの位置をヘッダーに記録するので,
+    | 任意のフレーム範囲を含むブロックのみを読み込める(:func:`decode_positions` ).
+    | deltaの差分もブロック毎に始めから取り直す.
+
+    Parameters:
+
+    positions: numpy.ndarray
+        (フレーム数,原子数,3)の座標
+    dtype: str
+        | 'float64','float32': 浮動小数点のまま保存する
+        | 'int16','int32': バウンディングボックス(ブロック毎)に対する固定小数点に量子化する
+    delta: bool
+        | Trueの場合,ブロックの2フレーム目以降は前フレームとの差分を保存する(int16,int32のみ).
+        | 差分はdtypeの範囲で桁あふれするが,復元時も同じdtypeで累積和をとるので正確に戻る.
+    compression: str
+        'zlib','lzma'またはNone
+    level: int
+        圧縮レベル(zlibは0~9,lzmaは0~9)
+    block_size: int
+        1ブロックのフレーム数
+    start: int
+        Blenderで始めのキーフレームを打つ位置(ヘッダーに記録する)
+    step: int
+        Blenderで何フレーム毎にキーを打つか(ヘッダーに記録する)
+
+    Returns:
+        tuple: (バイト列, ヘッダー(dict), 最大量子化誤差(Å))
+    """
+    chunks,header,max_error = _encode(positions,dtype,delta,compression,level,block_size,start,step)
+    return b"".join(chunks),header,max_error
+
+def _encode(positions,dtype,delta,compression,level,block_size,start,step):
+    # float64への変換はブロック毎に行い,全フレーム分のコピーを作らない
+    positions = np.asarray(positions)
+    encoder = PositionsEncoder(dtype,delta,compression,level,start,step)
+    encoder.header["n_atoms"] = positions.shape[1]
+    chunks = [encoder.begin()]
+    for frame in range(0,len(positions),block_size):
+        chunks.append(encoder.add(encoder.encode(positions[frame:frame+block_size])))
+    chunks.append(encoder.end())
+    return chunks,encoder.header,encoder.max_error
+
+class PositionsEncoder():
+    """座標をブロック毎にエンコードし,encode_positionsと同じ形式のバイト列を順に作る
+
+    | begin,add(ブロック毎),endの返り値を順に書き込むと1つの座標ファイルになる.
+    | フレーム数は事前に分からなくてよく,ブロック表(ヘッダー)はendで最後に作る.
+    | encodeは状態を変えないのでスレッドから並列に呼べる.ブロックの順番はaddを呼んだ順.
+
+    Parameters:
+
+    dtype, delta, compression, level, start, step:
+        :func:`encode_positions` と同じ
+    """
+    def __init__(self,dtype="float32",delta=False,compression="zlib",level=None,start=1,step=1):
+        if dtype not in FLOAT_DTYPES+INT_DTYPES:
+            raise ValueError(f"dtypeは{FLOAT_DTYPES+INT_DTYPES}のいずれかです: {dtype}")
+        if delta and dtype in FLOAT_DTYPES:
+            raise ValueError("deltaはint16,int32でのみ使用できます")
+        self.level = level
+        self.header = {"n_frames":0,"n_atoms":None,"dtype":dtype,"delta":delta,
+                       "compression":compression,"start":start,"step":step,"blocks":[]}
+        self.offset = 0
+        self.nbytes = 0
+        self.max_error = 0.0
+
+    def begin(self):
+        self.nbytes += len(MAGIC)
+        return MAGIC
+
+    def encode(self,positions):
+        """1ブロック分の座標(フレーム数,原子数,3)をエンコードする
+
+        Returns:
+            tuple: (バイト列, ブロックの情報(dict), 最大量子化誤差(Å))
+        """
+        h = self.header
+        chunk,block,error = _encode_block(positions,h["dtype"],h["delta"],h["compression"],self.level)
+        block["n_frames"] = len(positions)
+        block["n_atoms"] = np.shape(positions)[1]
+        return chunk,block,error
+
+    def add(self,encoded):
+        """encodeの結果を次のブロックとしてブロック表に加え,書き込むバイト列を返す"""
+        chunk,block,error = encoded
+        self.header["n_atoms"] = block.pop("n_atoms")
+        block.update({"frame":self.header["n_frames"],"byte_offset":self.offset,"nbytes":len(chunk)})
+        self.header["blocks"].append(block)
+        self.header["n_frames"] += block["n_frames"]
+        self.offset += len(chunk)
+        self.nbytes += len(chunk)
+        self.max_error = max(self.max_error,error)
+        return chunk
+
+    def end(self):
+        header_bytes = json.dumps(self.header).encode()
+        trailer = header_bytes+struct.pack("<I",len(header_bytes))
+        self.nbytes += len(trailer)
+        return trailer
+
+class RawPositionsEncoder():
+    """座標をヘッダーのない非圧縮の配列(C順)としてブロック毎に作る.Blender側でメモリマップする(playback='handler')
+
+    | PositionsEncoderと同じ使い方(begin,encode,add,end).原子数とdtypeが分かれば
+    | np.memmap(file,dtype=dtype,mode="r").reshape(-1,原子数,3)で読み込める.
+    """
+    def __init__(self,dtype="float32"):
+        self.header = {"n_frames":0,"n_atoms":None,"dtype":dtype}
+        self.nbytes = 0
+        self.max_error = 0.0
+
+    def begin(self):
+        return b""
+
+    def encode(self,positions):
+        positions = np.asarray(positions,dtype=np.float64)
+        q = positions.astype(self.header["dtype"])
+        return q.tobytes(),{"n_frames":len(positions),"n_atoms":positions.shape[1]},float(np.abs(q-positions).max())
+
+    def add(self,encoded):
+        chunk,block,error = encoded
+        self.header["n_atoms"] = block["n_atoms"]
+        self.header["n_frames"] += block["n_frames"]
+        self.nbytes += len(chunk)
+        self.max_error = max(self.max_error,error)
+        return chunk
+
+    def end(self):
+        return b""
+
+def read_header(f):
+    """シーク可能なファイルオブジェクトから末尾のヘッダーを読み込む(ブロックは読み込まない)
+    
+    Returns:
+        tuple: (ヘッダー(dict), ブロックの開始位置(バイト))
+    """
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError("Animationの座標ファイルではありません")
+    f.seek(-4,io.SEEK_END)
+    n = struct.unpack("<I",f.read(4))[0]
+    f.seek(-4-n,io.SEEK_END)
+    header = json.loads(f.read(n))
+    return header,len(MAGIC)
+
+def decode_positions(data,frames=None):
+    """encode_positionsでエンコードした座標を(フレーム数,原子数,3)の配列に戻す
+    
+    Parameters:
+    
+    data: bytes or file object
+        エンコードしたバイト列またはシーク可能なファイルオブジェクト
+    frames: tuple or slice
+        | 読み込むフレームの範囲. (500,600)のように(開始,終了)で指定する.
+        | Noneの場合は全フレーム.範囲を含むブロックのみを展開する.
+    """
+    f = io.BytesIO(data) if isinstance(data,(bytes,bytearray)) else data
+    header,data_start = read_header(f)
+    if frames is None:
+        frames = slice(None)
+    elif not isinstance(frames,slice):
+        frames = slice(*frames)
+    first,last,step = frames.indices(header["n_frames"])
+    positions = []
+    for block in header["blocks"]:
+        if block["frame"]+block["n_frames"] <= first or block["frame"] >= last:
+            continue
+        f.seek(data_start+block["byte_offset"])
+        decoded = _decode_block(f.read(block["nbytes"]),header,block)
+        positions.append(decoded[max(first-block["frame"],0):last-block["frame"]])
+    if not positions:
+        return np.empty((0,header["n_atoms"],3))
+    return np.concatenate(positions)[::step]
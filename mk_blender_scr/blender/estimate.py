@@ -0,0 +1,115 @@
+import json
+import warnings
+import numpy as np
+from pathlib import Path
+from ase.io.trajectory import TrajectoryReader
+
+from mk_blender_scr.blender import default
+from mk_blender_scr.blender.make_script import get_data_list,get_materials,render_script,encode_animation
+from mk_blender_scr.blender.tessellation import style_size
+from mk_blender_scr.io.fast_reader import count_frames,parse_frames
+
+TOTAL_KEYS = ["objects","vertices","faces","render_vertices","render_faces","keyframes","materials",
+              "sidecar_nbytes"]
+
+def count_animation_frames(animation):
+    """Animationで読み込まれるフレーム数(time_budgetによる打ち切りは考慮しない)"""
+    if isinstance(animation.atoms,(str,Path)):
+        n_frames = count_frames(animation.atoms,animation.format)
+    elif type(animation.atoms) == TrajectoryReader and isinstance(animation.atoms.filename,(str,Path)):
+        n_frames = count_frames(animation.atoms.filename,"traj")
+    else:
+        n_frames = len(animation.atoms)
+    n_frames = len(range(n_frames)[parse_frames(animation.frames)])
+    if animation.max_frames is not None:
+        n_frames = min(n_frames,animation.max_frames)
+    return n_frames
+
+def estimate_sidecar_nbytes(animation,n_frames):
+    """座標ファイルのバイト数を見積もる
+
+    | 先頭の1ブロック分のフレームのみを読み込んでエンコードし,1フレーム当たりのバイト数から外挿する.
+    | playback='handler'(非圧縮の配列)の場合はほぼ正確.
+    """
+    block_size = animation.encoding.get("block_size",default.encoding["block_size"])
+    sample = animation.get_positions(max_frames=block_size)
+    chunks,header,_ = encode_animation(animation,sample)
+    per_frame = sum(len(chunk) for chunk in chunks[1:-1])/max(len(sample),1)
+    nbytes = len(chunks[0])+len(chunks[-1])+per_frame*n_frames
+    if "blocks" in header and header["blocks"]:
+        # ヘッダーのブロック表はブロック数に比例して大きくなる
+        n_blocks = -(-n_frames//block_size)
+        nbytes += (n_blocks-len(header["blocks"]))*len(json.dumps(header["blocks"][0]))
+    return int(nbytes)
+
+def estimate_style(style,data):
+    """1つのstyleのオブジェクト数,頂点数,面数,キーフレーム数,マテリアル数等を見積もる"""
+    n_atoms = 0 if data["style"] == "stick" else len(data["chemical_symbols"])
+    n_bonds = len(data.get("bonds",[])) if data["style"] in ["stick","ball_and_stick"] else 0
+    # repeatの場合,ユニットセル以外はコレクションインスタンス(1つのオブジェクト)
+    n_instances = int(np.prod(data.get("repeat",[1,1,1])))-1
+    # bicolorの結合も1つのオブジェクト(側面を分割した円柱)
+    report = {"style":data["style"],"atoms":n_atoms,"bonds":n_bonds,"objects":n_atoms+n_bonds+n_instances,
+              **style_size(data),
+              "frames":0,"keyframes":0,
+              "materials":len(get_materials([dict(data)])),
+              "sidecar_nbytes":0}
+    if data["style"] == "animation":
+        n_frames = count_animation_frames(style)
+        report["frames"] = n_frames
+        if style.playback == "keyframe":
+            # keyframe_insert(index=-1)はx,y,zの3つのFカーブにキーを打つ
+            report["keyframes"] = 3*n_frames*n_atoms
+        report["sidecar_nbytes"] = estimate_sidecar_nbytes(style,n_frames)
+    return report
+
+def estimate(Styles,budgets=None,action="warn",polygon_budget=None):
+    """createで作成するシーンの規模を,ファイルを書き込まずに見積もる
+
+    | オブジェクト数,頂点数と面数(Subdivision Surfaceのlevel,render_levelsを含む),
+    | キーフレーム数,マテリアル数,スクリプトと座標ファイルのバイト数を見積もる.
+    | 座標ファイルのバイト数は先頭の1ブロックをエンコードして外挿する.
+
+    Parameters:
+
+    Styles: BaseStyle object or list of BaseStyle object
+        BallAndStick,Stick,SpaceFilling,Animationのオブジェクト
+    budgets: dict
+        | 各項目の上限. {"objects":100000,"render_faces":10**8}のように指定する.
+        | 項目は'objects','vertices','faces','render_vertices','render_faces','keyframes',
+        | 'materials','script_nbytes','sidecar_nbytes'.Noneの場合はdefault.budgets
+    action: str
+        | 上限を超えた場合の動作.
+        | 'warn': 警告を出す
+        | 'raise': ValueErrorを送出する
+        | 'ignore': 何もしない(返り値の'exceeded'のみ)
+    polygon_budget: int
+        createのpolygon_budget.与えた場合,選ばれる分割数で見積もる
+
+    Returns:
+        dict: {"styles":[styleごとの見積もり],"total":{合計},"exceeded":{項目:{"value","budget"}}}
+    """
+    if type(Styles) != list:
+        Styles = [Styles]
+    if action not in ["warn","raise","ignore"]:
+        raise ValueError(f"actionは'warn','raise'または'ignore'です: {action}")
+    if budgets is None:
+        budgets = default.budgets
+    unknown = set(budgets)-set(TOTAL_KEYS+["script_nbytes"])
+    if unknown:
+        raise ValueError(f"budgetsの項目は{TOTAL_KEYS+['script_nbytes']}のいずれかです: {sorted(unknown)}")
+    data_list,_ = get_data_list(Styles,polygon_budget=polygon_budget)
+    styles = [estimate_style(style,data) for style,data in zip(Styles,data_list)]
+    total = {key:sum(report[key] for report in styles) for key in TOTAL_KEYS}
+    # マテリアルはstyle間で共有されるので,合計は設定の異なるマテリアルの数
+    total["materials"] = len(get_materials(data_list))
+    total["script_nbytes"] = len(render_script({"data_list":data_list}).encode())
+    exceeded = {key:{"value":total[key],"budget":budget} for key,budget in budgets.items()
+                if budget is not None and total[key] > budget}
+    if exceeded:
+        message = ", ".join(f"{key}={v['value']} (上限{v['budget']})" for key,v in exceeded.items())
+        if action == "raise":
+            raise ValueError(f"シーンの規模が上限を超えています: {message}")
+        elif action == "warn":
+            warnings.warn(f"シーンの規模が上限を超えています: {message}")
+    return {"styles":styles,"total":total,"exceeded":exceeded}
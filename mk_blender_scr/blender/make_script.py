@@ -1,28 +1,80 @@
 from ase import Atoms
+from ase.io import read
 from ase.io.trajectory import TrajectoryReader,SlicedTrajectory
 from ase.geometry.analysis import Analysis
 from ase.neighborlist import build_neighbor_list,natural_cutoffs
 from jinja2 import Environment ,FileSystemLoader
 from jinja2.ext import loopcontrols
+import io
+import os
 import json 
 import zipfile
-import pickle
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 from pathlib import Path
 
 from mk_blender_scr.blender import default 
+from mk_blender_scr.blender.encoding import PositionsEncoder,RawPositionsEncoder
+from mk_blender_scr.blender.profiling import Profiler,stage
+from mk_blender_scr.blender.tessellation import set_tessellation
+from mk_blender_scr.io.fast_reader import read_positions,read_positions_from_images,iter_positions,iter_positions_from_images
+from mk_blender_scr.io.memmap_trajectory import MemmapTrajectory
 
-def create(file,Styles):
+def get_template():
+    p = Path(__file__).parent
+    env = Environment(loader=FileSystemLoader(p/'template/', encoding='utf8'),extensions=['jinja2.ext.loopcontrols'])
+    return env.get_template("template.py")
+
+def create(file,Styles,max_workers=None,budgets=None,profile=None,progress=None,polygon_budget=None):
     """Belnder用のPythonスクリプトを作成する
 
     Parameters:
     
-    file: str(.py or .zip)
-        pythonファイル名, Animationが含まれる場合はzip名
-        ファイル名がハイフン'-'の場合,標準出力する.(Animationがある場合は無効)
+    file: str(.py or .zip) or file object
+        | pythonファイル名, Animationが含まれる場合はzip名
+        | ファイル名がハイフン'-'の場合,ファイルに書き込まずにスクリプトを返す(Animationが含まれない場合のみ).
+        | Animationが含まれる場合,バイナリのファイルオブジェクト(BytesIO,sys.stdout.buffer等)も与えられる.
     Styles: BaseStyle object
         | BallAndStick,Stick,SpaceFilling,Animationのオブジェクト
         | 複数のstyleを組み合わせる場合,リストで与える.
+    max_workers: int
+        | 複数のAnimationの座標をエンコード(圧縮)するスレッド数.Noneの場合はCPU数に応じて決まる.
+    budgets: dict
+        | 与えた場合,作成前にシーンの規模を見積もり(:func:`estimate` ),
+        | {"objects":100000,"render_faces":10**8}のような上限を超える場合はValueErrorを送出する.
+    profile: bool or str or Profiler
+        | 段階(todict,テンプレートの描写,座標の読み込み,エンコード,書き込み等)ごとの時間,ピークメモリ,件数を計測する.
+        | True: 標準エラーに表を表示する
+        | str: JSONファイル名.1行のJSONとして追記する
+        | Profiler: そのProfilerに記録する(with Profiler() as prof:でstyleの作成から計測する場合等)
+        | Noneの場合は計測しない.
+    progress: float
+        | 与えた場合,作成したスクリプトはBlenderでの実行中にprogress秒ごとに進捗(%,1秒当たりのオブジェクト数)と
+        | 段階(マテリアル,原子,結合,キーフレーム,保存)ごとの時間を表示し,
+        | 最後に.blendと同じ場所に{.blendの名前}_timing.jsonを書き込む.
+    polygon_budget: int
+        | 全てのstyleの合計の面数の目安.与えた場合,球と円柱の分割数とSubdivision Surfaceのlevelを
+        | 元素,styleごとに面数がpolygon_budget以下になるように選び,スクリプトに記録する.
+        | 原子数が多い場合は粗く,少ない場合は細かく(最大で球64分割)なる.Noneの場合はBlenderのデフォルトの分割数.
+        
+    Returns:
+        | Animationが含まれない場合,fileが'-'ならpythonスクリプト(str),それ以外はNone
+        | Animationが含まれる場合,座標ファイル毎の{"ファイル名":{"nbytes","raw_nbytes","max_error"}}の辞書
+        | (エンコード後のサイズ,float64でのサイズ,最大量子化誤差(Å))
     """
+    if not profile:
+        return _create(file,Styles,max_workers,budgets,progress,polygon_budget)
+    profiler = profile if isinstance(profile,Profiler) else Profiler()
+    with profiler:
+        result = _create(file,Styles,max_workers,budgets,progress,polygon_budget)
+    if profile is True:
+        profiler.print_summary()
+    elif isinstance(profile,(str,Path)):
+        profiler.dump(profile)
+    return result
+
+def _create(file,Styles,max_workers,budgets,progress,polygon_budget):
     if type(Styles) != list:
         Styles = [Styles]
     for style in Styles:
@@ -30,35 +82,272 @@ def create(file,Styles):
         if style.style == "animation":
             into_one_file = False
             break
-    p = Path(__file__).parent
-    env = Environment(loader=FileSystemLoader(p/'template/', encoding='utf8'),extensions=['jinja2.ext.loopcontrols'])
-    tmpl = env.get_template("template.py")
+    if budgets is not None:
+        from mk_blender_scr.blender.estimate import estimate
+        with stage("estimate"):
+            estimate(Styles,budgets=budgets,action="raise",polygon_budget=polygon_budget)
     if into_one_file:
-        data_list = [style.todict() for style in Styles]
+        data_list,_ = get_data_list(Styles,polygon_budget=polygon_budget)
         data = {
-            "data_list":data_list
+            "data_list":data_list,
+            "progress":progress,
         } 
-        pyscript = tmpl.render(data)
+        pyscript = render_script(data)
         if file == "-":
             return pyscript
         else:
-            with open(file,"w") as f:
-                f.write(pyscript)
+            with stage("write",items=len(pyscript)):
+                with open(file,"w") as f:
+                    f.write(pyscript)
     else:
-        data_list = []
-        pkl_dict = {}
-        for i,style in enumerate(Styles):
+        if file == "-":
+            raise ValueError("Animationを含む場合,fileはzipのファイル名またはバイナリのファイルオブジェクトです")
+        if not hasattr(file,"write"):
+            p = Path(file)
+            if p.suffix != ".zip":
+                raise Exception("fileの拡張子は.zipです")
+            if p.exists():
+                raise FileExistsError(f"{file}は既に存在します")
+            with open(p,"wb") as f:
+                return create_zip(f,Styles,script_name=p.with_suffix(".py").name,max_workers=max_workers,
+                                  progress=progress,polygon_budget=polygon_budget)
+        return create_zip(file,Styles,max_workers=max_workers,progress=progress,polygon_budget=polygon_budget)
+
+def create_zip(fileobj,Styles,script_name=default.pyfile,max_workers=None,progress=None,polygon_budget=None):
+    """Animationを含むstyleのスクリプトと座標ファイルをzipとしてファイルオブジェクトに書き込む
+    
+    | fileobjはバイナリで書き込めれば良く,シークできなくてもよい(BytesIO,標準出力,HTTPレスポンス等).
+    | 一時ファイルは作らない.座標はblock_sizeフレームずつ読み込み,エンコードしてzipに書き込んでから破棄するので,
+    | メモリに保持する座標は最大でmax_workersブロック程度(フレーム数によらない).
+    | 同じトラジェクトリ,フレーム選択,playback,encodingのAnimationは1つの座標ファイルを共有し,
+    | 全てのindicesを含む座標を1度だけ読み込む(各Animationはスクリプト内で自分の列を取り出す).
+    
+    Parameters:
+    
+    fileobj: file object
+        バイナリのファイルオブジェクト
+    Styles: BaseStyle object or list of BaseStyle object
+        BallAndStick,Stick,SpaceFilling,Animationのオブジェクト
+    script_name: str
+        zip内のpythonスクリプトの名前
+    max_workers: int
+        座標をエンコード(圧縮)するスレッド数.Noneの場合はCPU数に応じて決まる.
+    progress: float
+        Blenderでの実行中に進捗を表示する間隔(秒).Noneの場合は表示しない(:func:`create` )
+    polygon_budget: int
+        全てのstyleの合計の面数の目安(:func:`create` )
+        
+    Returns:
+        dict: {"ファイル名":{"nbytes","raw_nbytes","max_error"}}
+    """
+    if type(Styles) != list:
+        Styles = [Styles]
+    if max_workers is None:
+        max_workers = min(32,(os.cpu_count() or 1)+4) # ThreadPoolExecutorのデフォルト
+    data_list,sidecars = get_data_list(Styles,polygon_budget=polygon_budget)
+    pyscript = render_script({"data_list":data_list,"progress":progress})
+    report = {}
+    # zlib,lzmaの圧縮はGILを解放するのでスレッドで並列に実行できる
+    with ThreadPoolExecutor(max_workers=max_workers) as executor, zipfile.ZipFile(fileobj,"w") as zf:
+        for filename,(animation,indices) in sidecars.items():
+            report[filename] = write_positions(zf,filename,animation,indices,executor,max_workers)
+        with stage("zip_write",items=len(pyscript)):
+            with zf.open(script_name,"w") as f:
+                f.write(pyscript.encode())
+    return report
+
+def material_key(rgba,cartoon):
+    """マテリアルを同一とみなすためのキー(色とcartoonの設定).cartoonを適用しない場合はcartoonの他の設定は無視する"""
+    rgba = tuple(float(v) for v in rgba)
+    if not cartoon["apply"]:
+        return (rgba,None)
+    return (rgba,float(cartoon["IOR"]),tuple(float(v) for v in cartoon["color"]))
+
+def get_materials(data_list):
+    """全てのstyleで共有するマテリアルの表を作成する
+
+    | 色とcartoonの設定が同じマテリアルは1つにまとめる.
+    | 各styleの辞書に{元素記号(結合は'bond'):マテリアル名}を'materials'として追加する.
+    | マテリアル名は最初に使われた元素記号(または'bond').設定が異なり名前が重なる場合は'C_1'のように番号を付ける.
+
+    Returns:
+        dict: {マテリアル名:{"rgba","cartoon"}}
+    """
+    materials = {}
+    names = {}
+    for data in data_list:
+        colors = dict(data["colors"])
+        if "stick_color" in data:
+            colors["bond"] = data["stick_color"]
+        data["materials"] = {}
+        for symb,rgba in colors.items():
+            key = material_key(rgba,data["cartoon"])
+            if key not in names:
+                name,n = symb,0
+                while name in materials:
+                    n += 1
+                    name = f"{symb}_{n}"
+                names[key] = name
+                materials[name] = {"rgba":list(key[0]),"cartoon":data["cartoon"]}
+            data["materials"][symb] = names[key]
+    return materials
+
+def render_script(data):
+    """テンプレートからBlender用のスクリプトを作成する"""
+    with stage("render") as s:
+        data = {**data,"materials":get_materials(data["data_list"])}
+        pyscript = get_template().render(data)
+        s.add_items(len(pyscript))
+    return pyscript
+
+def get_data_list(Styles,polygon_budget=None):
+    """テンプレートに渡すstyleの辞書のリストと,Animationの座標ファイルの表を返す
+
+    | 球と円柱の分割数(polygon_budgetに応じて選ぶ, :func:`set_tessellation` )も各styleの辞書に含める.
+    | 同じトラジェクトリ,フレーム選択,playback,encodingのAnimationは座標ファイルを共有し,
+    | 各Animationの辞書の'columns'に座標ファイル内の自分の原子の列を記録する(全ての列の場合はNone).
+
+    Returns:
+        tuple: (styleの辞書のリスト, {"座標ファイル名":(Animation,読み込む原子のindexのリスト)})
+    """
+    data_list = []
+    groups = {}
+    for i,style in enumerate(Styles):
+        with stage("todict",style=style.style,items=len(style.chemical_symbols)):
             d_dict = style.todict()
-            if style.style == "animation":
-                filename = f"positions{i}.pkl"
-                d_dict["file"] = filename
-                pkl_dict[filename] = style
-            data_list.append(d_dict) 
-        data = {
-            "data_list":data_list,
-        }
-        pyscript = tmpl.render(data)
-        write_position_zipfile(file,pyscript,pkl_dict)
+        if style.style == "animation":
+            key = (style.get_source_key(),style.playback,json.dumps(style.encoding,sort_keys=True))
+            if key not in groups:
+                suffix = "raw" if style.playback == "handler" else "bin"
+                groups[key] = (f"positions{i}.{suffix}",[])
+            d_dict["file"] = groups[key][0]
+            if style.playback == "handler":
+                d_dict["dtype"] = get_encoder(style).header["dtype"]
+            groups[key][1].append((style,d_dict))
+        data_list.append(d_dict)
+    sidecars = {}
+    for filename,members in groups.values():
+        union = sorted(set().union(*[style.indices for style,_ in members]))
+        column = {index:k for k,index in enumerate(union)}
+        for style,d_dict in members:
+            d_dict["columns"] = None if list(style.indices) == union else [column[index] for index in style.indices]
+            d_dict["n_file_atoms"] = len(union)
+        sidecars[filename] = (members[0][0],union)
+    set_tessellation(data_list,polygon_budget)
+    return data_list,sidecars
+
+def write_chunks(zf,filename,chunks):
+    """バイト列のリストをzipの1つのファイルとして順に書き込む
+    
+    | 圧縮はエンコード時に行っているのでZIP_STOREDのまま書き込む.
+    | (ZIP_STOREDなのでzipを開いたままシークしてフレームを読み込める)
+    """
+    with zf.open(filename,"w",force_zip64=True) as f:
+        for chunk in chunks:
+            f.write(chunk)
+
+def get_encoder(animation):
+    """Animationのplaybackに応じた座標のエンコーダー
+    
+    | 'keyframe': ブロック毎に圧縮した座標(PositionsEncoder)
+    | 'handler': Blenderでメモリマップする非圧縮の配列(RawPositionsEncoder)
+    """
+    if animation.playback == "handler":
+        return RawPositionsEncoder(dtype="float64" if animation.encoding["dtype"] == "float64" else "float32")
+    encoding = {key:value for key,value in animation.encoding.items() if key != "block_size"}
+    return PositionsEncoder(start=animation.start,step=animation.step,**encoding)
+
+def _encode_block(encoder,block):
+    with stage("encode",style="animation",items=len(block)):
+        return encoder.encode(block)
+
+def _staged(blocks,name):
+    """イテレーターの各要素を作る時間(読み込み)をstageとして計測する"""
+    blocks = iter(blocks)
+    while True:
+        with stage(name,style="animation") as s:
+            block = next(blocks,None)
+            if block is not None:
+                s.add_items(len(block))
+        if block is None:
+            return
+        yield block
+
+def write_positions(zf,filename,animation,indices,executor,max_in_flight):
+    """Animationの座標をブロック毎に読み込み,エンコードしてzipの1つのファイルとして書き込む
+    
+    | ブロックのエンコードはexecutorで並列に実行し,読み込んだ順にzipへ書き込んで破棄する.
+    | エンコード中または書き込み待ちのブロックは最大でmax_in_flight個.
+    | 圧縮はエンコード時に行っているのでZIP_STOREDのまま書き込む.
+    | (ZIP_STOREDなのでzipを開いたままシークしてフレームを読み込める)
+    
+    Returns:
+        dict: {"nbytes","raw_nbytes","max_error"} (エンコード後のサイズ,float64でのサイズ,最大量子化誤差(Å))
+    """
+    encoder = get_encoder(animation)
+    in_flight = deque()
+    raw_nbytes = 0
+    def write_next():
+        chunk = encoder.add(in_flight.popleft().result())
+        with stage("zip_write",style="animation",items=len(chunk)):
+            f.write(chunk)
+    with zf.open(filename,"w",force_zip64=True) as f:
+        f.write(encoder.begin())
+        for block in _staged(animation.iter_positions(indices=indices),"read_positions"):
+            raw_nbytes += block.size*8
+            in_flight.append(executor.submit(_encode_block,encoder,block))
+            del block
+            if len(in_flight) >= max_in_flight:
+                write_next()
+        while in_flight:
+            write_next()
+        f.write(encoder.end())
+    return {"nbytes":encoder.nbytes,"raw_nbytes":raw_nbytes,"max_error":encoder.max_error}
+
+def encode_animation(animation,positions):
+    """Animationのplaybackに応じて(フレーム数,原子数,3)の座標をエンコードする(見積もり用)
+    
+    Returns:
+        tuple: (バイト列のリスト(先頭,各ブロック,末尾のヘッダー), ヘッダー(dict), 最大誤差(Å))
+    """
+    block_size = animation.encoding.get("block_size",default.encoding["block_size"])
+    encoder = get_encoder(animation)
+    with stage("encode",style="animation",items=len(positions)):
+        chunks = [encoder.begin()]
+        for frame in range(0,len(positions),block_size):
+            chunks.append(encoder.add(encoder.encode(positions[frame:frame+block_size])))
+        chunks.append(encoder.end())
+    return chunks,encoder.header,encoder.max_error
+
+def get_octree_chunks(positions,chunk_size):
+    """原子を八分木で空間的に分割し,各原子のチャンク番号を返す
+    
+    | セル内の原子数がchunk_size以下になるまで8分割する.
+    | チャンク番号は深さ優先の順なので,番号が近いチャンクは空間的にも近い.
+    
+    Returns:
+        numpy.ndarray: 各原子のチャンク番号
+    """
+    positions = np.asarray(positions,dtype=float).reshape(-1,3)
+    chunks = np.zeros(len(positions),dtype=int)
+    n_chunks = 0
+    stack = [(np.arange(len(positions)),positions.min(axis=0),positions.max(axis=0))] if len(positions) else []
+    while stack:
+        idx,lower,upper = stack.pop()
+        if len(idx) <= chunk_size or np.all(upper-lower < 1e-6):
+            chunks[idx] = n_chunks
+            n_chunks += 1
+            continue
+        center = (lower+upper)/2
+        octant = ((positions[idx] >= center)*[1,2,4]).sum(axis=1)
+        # 逆順に積んで0番目の八分木から処理する
+        for o in reversed(range(8)):
+            sub = idx[octant == o]
+            if len(sub) == 0:
+                continue
+            bits = np.array([(o >> k) & 1 for k in range(3)],dtype=bool)
+            stack.append((sub,np.where(bits,center,lower),np.where(bits,upper,center)))
+    return chunks
 
 def get_unique_bonds(atoms):
     cutoff = natural_cutoffs(atoms, mult=1)
@@ -71,8 +360,47 @@ def get_unique_bonds(atoms):
             bonds.append((idx_a,idx_b))
     return bonds
 
+def get_periodic_bonds(atoms,pbc):
+    """周期境界条件での結合(get_unique_bondsと同じ基準)
+
+    | 隣のセルの原子との結合は,その原子の位置に結合の端点用の原子(球は作らない)を追加し,
+    | 追加した原子のindexをlen(atoms)からの通し番号として表す.
+    | 1つの結合はどちらか一方の原子のセルで1回だけ作成されるので,ユニットセルを並べると全ての結合が揃う.
+
+    Parameters:
+
+    atoms: Atoms
+        セルを持つAtoms
+    pbc: list of bool
+        周期境界とする方向
+
+    Returns:
+        tuple: (結合のリスト[(i,j)], 追加した原子の元のindexのリスト, 追加した原子の位置のリスト)
+    """
+    atoms = atoms.copy()
+    atoms.set_pbc(pbc)
+    cutoff = natural_cutoffs(atoms, mult=1)
+    nl = build_neighbor_list(atoms,cutoff,self_interaction=False)
+    positions = atoms.get_positions()
+    cell = atoms.cell[:]
+    bonds = []
+    images = {}
+    for i in range(len(atoms)):
+        neighbors,offsets = nl.get_neighbors(i)
+        for j,offset in zip(neighbors,offsets):
+            if not offset.any():
+                bonds.append((i,int(j)))
+                continue
+            key = (int(j),tuple(int(o) for o in offset))
+            if key not in images:
+                images[key] = len(atoms)+len(images)
+            bonds.append((i,images[key]))
+    image_atoms = [j for j,_ in images]
+    image_positions = [(positions[j]+np.dot(offset,cell)).tolist() for j,offset in images]
+    return bonds,image_atoms,image_positions
+
 class BaseStyle():
-    def __init__(self,atoms:Atoms,indices=None):
+    def __init__(self,atoms:Atoms,indices=None,repeat=None):
         """
         
         Parameters:
@@ -81,24 +409,45 @@ class BaseStyle():
             AtomsまたはAtomsのリスト
         indices: list of int
             一部の原子のみを表示する場合,index番号をリストで与える
+        repeat: tuple
+            ユニットセルを並べる数(a,b,c).Noneの場合は並べない
         
         """
         self.atoms = atoms
+        self.repeat = [1,1,1] if repeat is None else [int(n) for n in repeat]
+        if len(self.repeat) != 3 or min(self.repeat) < 1:
+            raise ValueError(f"repeatは(a,b,c)のように3つの1以上の整数で指定します: {repeat}")
         if type(atoms) == Atoms:
             if indices is None:
                 indices = [i for i in range(len(atoms))]
             self.indices = indices
             atoms.set_pbc(False)
-            self.chemical_symbols = atoms[self.indices].get_chemical_symbols()
-            self.positions = atoms[self.indices].get_positions().tolist()
-            self.bonds = get_unique_bonds(atoms[self.indices])
+            with stage("slice",style=self.style,items=len(indices)):
+                self.chemical_symbols = atoms[self.indices].get_chemical_symbols()
+                self.positions = atoms[self.indices].get_positions().tolist()
+            with stage("bonds",style=self.style) as s:
+                if self.repeat == [1,1,1]:
+                    self.bonds = get_unique_bonds(atoms[self.indices])
+                else:
+                    if atoms.cell.rank < 3:
+                        raise ValueError("repeatを指定する場合,atomsにセルが必要です")
+                    self.cell = atoms.cell[:].tolist()
+                    pbc = [n > 1 for n in self.repeat]
+                    self.bonds,self.image_atoms,self.image_positions = get_periodic_bonds(atoms[self.indices],pbc)
+                s.add_items(len(self.bonds))
         else:
+            with stage("read_first_frame",style=self.style):
+                first_atoms = self.get_first_atoms()
             if indices is None:
-                indices = [i for i in range(len(atoms[0]))]
+                indices = [i for i in range(len(first_atoms))]
             self.indices = indices
-            self.chemical_symbols = atoms[0][self.indices].get_chemical_symbols()
+            symbols = first_atoms.get_chemical_symbols()
+            self.chemical_symbols = [symbols[i] for i in self.indices]
         self.unique_symbols = list(set(self.chemical_symbols)) 
         
+    def get_first_atoms(self):
+        return self.atoms[0]
+        
     def set_param(self,permited_param,kwargs):
         for attr,default_value in permited_param.items():
             if type(default_value) == dict:
@@ -123,6 +472,14 @@ class BaseStyle():
                 data_dict[attr] = getattr(self, attr)
         if bonds:
             data_dict["bonds"] = getattr(self, "bonds")
+        if getattr(self,"repeat",[1,1,1]) != [1,1,1]:
+            if getattr(self,"chunk_size",None):
+                raise ValueError("repeatとchunk_sizeは同時に指定できません")
+            for attr in ["repeat","cell","image_atoms","image_positions"]:
+                data_dict[attr] = getattr(self, attr)
+        if getattr(self,"chunk_size",None):
+            with stage("chunks",style=self.style,items=len(self.positions)):
+                data_dict["chunks"] = get_octree_chunks(self.positions,self.chunk_size).tolist()
         return data_dict
             
     def write(self,file,bonds=False):
@@ -133,7 +490,7 @@ class BaseStyle():
 class BallAndStick(BaseStyle):
     """Ball and Stickのスタイル
     
-    bicolor=Trueにすると,Blender上での操作が重くなるので注意(オブジェクト数が多い)
+    bicolor=Trueの場合も結合は1つのオブジェクト(2つのマテリアルを持つ円柱)なので,オブジェクト数は変わらない
     
     Parameters:
     
@@ -152,6 +509,13 @@ class BallAndStick(BaseStyle):
             color: tuple
                 | ミックスのColor2(枠線の色に相当する)
                 | 1で規格化されたRGBAで指定する
+        chunk_size: int
+            | 1チャンクの最大原子数.指定した場合,原子を八分木で空間的に分割し,
+            | チャンク毎のコレクションに作成する(チャンク毎に進捗を表示する).
+        repeat: tuple
+            | (a,b,c)のように与えると,ユニットセルをa×b×c個並べた構造を作成する.
+            | 原子と結合はユニットセルの分のみ1つのコレクションに作成し,他はセルベクトルずつずらしたコレクションインスタンスにする.
+            | 結合はrepeatが2以上の方向を周期境界として求める.chunk_sizeとは同時に指定できない.
         colors : dict
             1で規格化したRGBA.
             ex) {'O':(1,0,0,1)}
@@ -178,7 +542,7 @@ class BallAndStick(BaseStyle):
     def __init__(self,atoms,indices=None,**kwargs):
         """Ball and Stickのスタイル
         
-        bicolor=Trueにすると,Blender上での操作が重くなるので注意(オブジェクト数が多い)
+        bicolor=Trueの場合も結合は1つのオブジェクト(2つのマテリアルを持つ円柱)なので,オブジェクト数は変わらない
         
         Parameters:
         
@@ -197,6 +561,13 @@ class BallAndStick(BaseStyle):
                 color: tuple
                     | ミックスのColor2(枠線の色に相当する)
                     | 1で規格化されたRGBAで指定する
+            chunk_size: int
+                | 1チャンクの最大原子数.指定した場合,原子を八分木で空間的に分割し,
+                | チャンク毎のコレクションに作成する(チャンク毎に進捗を表示する).
+            repeat: tuple
+                | (a,b,c)のように与えると,ユニットセルをa×b×c個並べた構造を作成する.
+                | 原子と結合はユニットセルの分のみ1つのコレクションに作成し,他はセルベクトルずつずらしたコレクションインスタンスにする.
+                | 結合はrepeatが2以上の方向を周期境界として求める.chunk_sizeとは同時に指定できない.
             colors : dict
                 1で規格化したRGBA.
                 ex) {'O':(1,0,0,1)}
@@ -216,11 +587,12 @@ class BallAndStick(BaseStyle):
                 | - level : int
                 | - render_levels: int
         """
-        super().__init__(atoms,indices)
+        super().__init__(atoms,indices,repeat=kwargs.get("repeat"))
         self.check_param()
         self.permited_param = {
             "bicolor":default.bicolor,
             "cartoon":default.cartoon,
+            "chunk_size":default.chunk_size,
             "colors":{symb:colors for symb,colors in default.color.items() if symb in self.unique_symbols},
             "radius":default.radius,
             "scale":default.scale,
@@ -243,7 +615,7 @@ class BallAndStick(BaseStyle):
 class Stick(BaseStyle):
     """Stickのスタイル
     
-    bicolor=Trueにすると,Blender上での操作が重くなるので注意(オブジェクト数が多い)
+    bicolor=Trueの場合も結合は1つのオブジェクト(2つのマテリアルを持つ円柱)なので,オブジェクト数は変わらない
     
     Parameters:
     
@@ -262,6 +634,13 @@ class Stick(BaseStyle):
             color: tuple
                 | ミックスのColor2(枠線の色に相当する)
                 | 1で規格化されたRGBAで指定する
+        chunk_size: int
+            | 1チャンクの最大原子数.指定した場合,原子を八分木で空間的に分割し,
+            | チャンク毎のコレクションに作成する(チャンク毎に進捗を表示する).
+        repeat: tuple
+            | (a,b,c)のように与えると,ユニットセルをa×b×c個並べた構造を作成する.
+            | 原子と結合はユニットセルの分のみ1つのコレクションに作成し,他はセルベクトルずつずらしたコレクションインスタンスにする.
+            | 結合はrepeatが2以上の方向を周期境界として求める.chunk_sizeとは同時に指定できない.
         colors : dict
             1で規格化したRGBA.
             ex) {'O':(1,0,0,1)} 
@@ -282,7 +661,7 @@ class Stick(BaseStyle):
     def __init__(self,atoms,indices=None,**kwargs):
         """Stickのスタイル
         
-        bicolor=Trueにすると,Blender上での操作が重くなるので注意(オブジェクト数が多い)
+        bicolor=Trueの場合も結合は1つのオブジェクト(2つのマテリアルを持つ円柱)なので,オブジェクト数は変わらない
         
         Parameters:
         
@@ -301,6 +680,13 @@ class Stick(BaseStyle):
                 - color: tuple
                     | ミックスのColor2(枠線の色に相当する)
                     | 1で規格化されたRGBAで指定する
+            chunk_size: int
+                | 1チャンクの最大原子数.指定した場合,原子を八分木で空間的に分割し,
+                | チャンク毎のコレクションに作成する(チャンク毎に進捗を表示する).
+            repeat: tuple
+                | (a,b,c)のように与えると,ユニットセルをa×b×c個並べた構造を作成する.
+                | 原子と結合はユニットセルの分のみ1つのコレクションに作成し,他はセルベクトルずつずらしたコレクションインスタンスにする.
+                | 結合はrepeatが2以上の方向を周期境界として求める.chunk_sizeとは同時に指定できない.
             colors : dict
                 1で規格化したRGBA.
                 ex) {'O':(1,0,0,1)} 
@@ -310,11 +696,12 @@ class Stick(BaseStyle):
                 | 1で規格化されたRGBA.
                 | bicolor=Falseの時のみ有効
         """
-        super().__init__(atoms,indices)
+        super().__init__(atoms,indices,repeat=kwargs.get("repeat"))
         self.check_param()
         self.permited_param = {
             "bicolor":default.bicolor,
             "cartoon":default.cartoon,
+            "chunk_size":default.chunk_size,
             "colors":{symb:color for symb,color in default.color.items() if symb in self.unique_symbols},
             "radius":default.radius,
             "stick_color":default.bond_color,
@@ -334,8 +721,6 @@ class Stick(BaseStyle):
 class SpaceFilling(BaseStyle):
     """SpaceFillingのスタイル
     
-    bicolor=Trueにすると,Blender上での操作が重くなるので注意(オブジェクト数が多い)
-    
     Parameters:
     
     atoms: Atoms
@@ -351,6 +736,13 @@ class SpaceFilling(BaseStyle):
             color: tuple
                 | ミックスのColor2(枠線の色に相当する)
                 | 1で規格化されたRGBAで指定する
+        chunk_size: int
+            | 1チャンクの最大原子数.指定した場合,原子を八分木で空間的に分割し,
+            | チャンク毎のコレクションに作成する(チャンク毎に進捗を表示する).
+        repeat: tuple
+            | (a,b,c)のように与えると,ユニットセルをa×b×c個並べた構造を作成する.
+            | 原子と結合はユニットセルの分のみ1つのコレクションに作成し,他はセルベクトルずつずらしたコレクションインスタンスにする.
+            | 結合はrepeatが2以上の方向を周期境界として求める.chunk_sizeとは同時に指定できない.
         colors : dict
             1で規格化したRGBA.
             ex) {'O':(1,0,0,1)}
@@ -387,6 +779,13 @@ class SpaceFilling(BaseStyle):
                 - color: tuple
                     | ミックスのColor2(枠線の色に相当する)
                     | 1で規格化されたRGBAで指定する
+            chunk_size: int
+                | 1チャンクの最大原子数.指定した場合,原子を八分木で空間的に分割し,
+                | チャンク毎のコレクションに作成する(チャンク毎に進捗を表示する).
+            repeat: tuple
+                | (a,b,c)のように与えると,ユニットセルをa×b×c個並べた構造を作成する.
+                | 原子と結合はユニットセルの分のみ1つのコレクションに作成し,他はセルベクトルずつずらしたコレクションインスタンスにする.
+                | 結合はrepeatが2以上の方向を周期境界として求める.chunk_sizeとは同時に指定できない.
             colors : dict
                 1で規格化したRGBA.
                 ex) {'O':(1,0,0,1)}
@@ -404,10 +803,11 @@ class SpaceFilling(BaseStyle):
                 | - render_levels: int
                 |   Renderレベル
         """
-        super().__init__(atoms,indices)
+        super().__init__(atoms,indices,repeat=kwargs.get("repeat"))
         self.check_param()
         self.permited_param = {
             "cartoon":default.cartoon,
+            "chunk_size":default.chunk_size,
             "colors":{symb:color for symb,color in default.color.items() if symb in self.unique_symbols},
             "scale":default.space_filling_scale,
             "sizes":{symb:size for symb,size in default.sizes.items() if symb in self.unique_symbols},
@@ -433,10 +833,20 @@ class Animation(BaseStyle):
     
     Parameters:
     
-    images: Trajectory or list of Atoms
-        TrajectoryまたはAtomsのリスト
+    images: Trajectory or list of Atoms or MemmapTrajectory or str
+        | TrajectoryまたはAtomsのリストまたはMemmapTrajectory
+        | ファイル名を与えた場合,xyz(extxyz),trajはAtomsを作らずに座標のみを読み込む.
     indices: list of int
         一部の原子のみを表示する場合,index番号をリストで与える
+    format: str
+        imagesがファイル名の場合のフォーマット(ase.io.readのformat)
+    frames: str
+        | 読み込むフレーム.'::10','1000:5000'のようにASE形式の文字列で指定する.
+        | 選択されなかったフレームは読み込まれない.
+    max_frames: int
+        読み込む最大フレーム数
+    time_budget: float
+        座標の読み込みにかける最大時間(秒).超えた場合はそれまでのフレームのみを使う.
     kwargs:
         cartoon:dict
             apply: bool
@@ -449,6 +859,19 @@ class Animation(BaseStyle):
         colors : dict
             1で規格化したRGBA.
             ex) {'O':(1,0,0,1)}
+        encoding: dict
+            | 座標の保存形式. {"dtype":"int16","delta":True,"compression":"lzma","level":9}のように指定
+            | dtype: 'float64','float32'または'int16','int32'(バウンディングボックスに対する固定小数点)
+            | delta: Trueの場合前フレームとの差分を保存する(int16,int32のみ)
+            | compression: 'zlib','lzma'またはNone
+            | level: 圧縮レベル
+            | block_size: 1ブロックのフレーム数(ブロック単位でフレームを読み込める)
+        interpolate: bool
+            playback='handler'の場合,保存したフレーム間を線形補間する
+        playback: str
+            | 'keyframe': 全フレームをキーフレームとして.blendに保存する(デフォルト)
+            | 'handler': frame_change_preのハンドラーで再生時にメモリマップした座標(非圧縮の配列)を読み込む.
+            | 読み込みの時間と.blendのサイズはフレーム数によらない.
         scale: flaot
             | Ballの大きさ.デフォルトは1.
             | 元素毎に大きさを変更したい場合はscaleでなくsizesで指定する.
@@ -468,19 +891,28 @@ class Animation(BaseStyle):
                 | Renderレベル
     """
     style = "animation"
-    def __init__(self, images,indices=None,**kwargs):
+    def __init__(self, images,indices=None,format=None,frames=None,max_frames=None,time_budget=None,**kwargs):
         """Animationのスタイル
         
         | 結合の描写が複雑なのでAnimationはSpaceFillingのみしかサポートしていない
         | Animationと他のスタイルを組み合わせることはできるがAnimationで指定した原子のみが動く.
-        | bicolor=Trueにすると,Blender上での操作が重くなるので注意(オブジェクト数が多い)
         
         Parameters:
         
-        images: Trajectory or list of Atoms
-            TrajectoryまたはAtomsのリスト
+        images: Trajectory or list of Atoms or MemmapTrajectory or str
+            | TrajectoryまたはAtomsのリストまたはMemmapTrajectory
+            | ファイル名を与えた場合,xyz(extxyz),trajはAtomsを作らずに座標のみを読み込む.
         indices: list of int
             一部の原子のみを表示する場合,index番号をリストで与える
+        format: str
+            imagesがファイル名の場合のフォーマット(ase.io.readのformat)
+        frames: str
+            | 読み込むフレーム.'::10','1000:5000'のようにASE形式の文字列で指定する.
+            | 選択されなかったフレームは読み込まれない.
+        max_frames: int
+            読み込む最大フレーム数
+        time_budget: float
+            座標の読み込みにかける最大時間(秒).超えた場合はそれまでのフレームのみを使う.
         kwargs:
             cartoon:dict
                 - apply: bool
@@ -493,6 +925,19 @@ class Animation(BaseStyle):
             colors : dict
                 1で規格化したRGBA.
                 ex) {'O':(1,0,0,1)}
+            encoding: dict
+                | 座標の保存形式. {"dtype":"int16","delta":True,"compression":"lzma","level":9}のように指定
+                | - dtype: 'float64','float32'または'int16','int32'(バウンディングボックスに対する固定小数点)
+                | - delta: Trueの場合前フレームとの差分を保存する(int16,int32のみ)
+                | - compression: 'zlib','lzma'またはNone
+                | - level: 圧縮レベル
+                | - block_size: 1ブロックのフレーム数(ブロック単位でフレームを読み込める)
+            interpolate: bool
+                playback='handler'の場合,保存したフレーム間を線形補間する
+            playback: str
+                | 'keyframe': 全フレームをキーフレームとして.blendに保存する(デフォルト)
+                | 'handler': frame_change_preのハンドラーで再生時にメモリマップした座標(非圧縮の配列)を読み込む.
+                | 読み込みの時間と.blendのサイズはフレーム数によらない.
             scale: flaot
                 | Ballの大きさ.デフォルトは1.
                 | 元素毎に大きさを変更したい場合はscaleでなくsizesで指定する.
@@ -508,6 +953,10 @@ class Animation(BaseStyle):
                 | - level : int
                 | - render_levels: int
         """
+        self.format = format
+        self.frames = frames
+        self.max_frames = max_frames
+        self.time_budget = time_budget
         super().__init__(images,indices)
         self.check_param()
         self.permited_param = {
@@ -515,23 +964,85 @@ class Animation(BaseStyle):
             "colors":{symb:color for symb,color in default.color.items() if symb in self.unique_symbols},
             "scale":default.space_filling_scale,
             "sizes":{symb:size for symb,size in default.sizes.items() if symb in self.unique_symbols},
+            "encoding":default.encoding,
+            "interpolate":default.interpolate,
+            "playback":default.playback,
             "start":default.start,
             "step":default.step,
             "subdivision_surface":default.subdivision_surface
             }
         self.set_param(self.permited_param,kwargs)
+        if self.playback not in ["keyframe","handler"]:
+            raise ValueError(f"playbackは'keyframe'または'handler'です: {self.playback}")
         
     def check_param(self):
-        if type(self.atoms) == TrajectoryReader or type(self.atoms) == SlicedTrajectory:
+        if type(self.atoms) in [TrajectoryReader,SlicedTrajectory,MemmapTrajectory,str] or isinstance(self.atoms,Path):
             return
         if type(self.atoms) == list:
             if type(self.atoms[0]) == Atoms:
                 return
-        raise TypeError(f"{self.__class__.__name__}のimagesはTrajectory(TrajectoryReader)またはAtomsのリストです.")
+        raise TypeError(f"{self.__class__.__name__}のimagesはTrajectory(TrajectoryReader),Atomsのリスト,MemmapTrajectoryまたはファイル名です.")
+        
+    def get_first_atoms(self):
+        if isinstance(self.atoms,(str,Path)):
+            return read(self.atoms,index=0,format=self.format)
+        return self.atoms[0]
+    
+    def get_source_key(self):
+        """読み込むトラジェクトリとフレーム選択を表すキー.キーが同じAnimationは同じ座標を読み込む"""
+        if isinstance(self.atoms,(str,Path)):
+            source = (str(Path(self.atoms).resolve()),self.format)
+        elif type(self.atoms) == TrajectoryReader and isinstance(self.atoms.filename,(str,Path)):
+            source = (str(Path(self.atoms.filename).resolve()),"traj")
+        else:
+            source = id(self.atoms)
+        return (source,str(self.frames),self.max_frames,self.time_budget)
+    
+    def get_positions(self,indices=None,max_frames=None):
+        """indicesの原子の座標を(フレーム数,原子数,3)の配列で返す
+        
+        | Atomsのスライスは行わず,座標の配列のみをスライスする.
+        | frames,max_frames,time_budgetは読み込み時に適用される.
+        | indicesを与えた場合,self.indicesの代わりにその原子の座標を返す.
+        | max_framesを与えた場合,さらに先頭のmax_framesフレームのみを読み込む(見積もり用).
+        """
+        if indices is None:
+            indices = self.indices
+        if max_frames is not None and self.max_frames is not None:
+            max_frames = min(max_frames,self.max_frames)
+        elif max_frames is None:
+            max_frames = self.max_frames
+        read_param = {"frames":self.frames,"max_frames":max_frames,"time_budget":self.time_budget}
+        if isinstance(self.atoms,(str,Path)):
+            return read_positions(self.atoms,indices=indices,format=self.format,**read_param)[0]
+        elif type(self.atoms) == TrajectoryReader and isinstance(self.atoms.filename,(str,Path)):
+            return read_positions(self.atoms.filename,indices=indices,format="traj",**read_param)[0]
+        elif type(self.atoms) == MemmapTrajectory and self.frames is None and self.time_budget is None:
+            return self.atoms.get_positions()[:max_frames][:,indices]
+        return read_positions_from_images(self.atoms,indices=indices,**read_param)
+    
+    def iter_positions(self,indices=None,block_size=None):
+        """get_positionsと同じだが,block_sizeフレームずつの配列を順に返す(全フレームを保持しない)
+        
+        | block_sizeがNoneの場合はencodingのblock_size.
+        """
+        if indices is None:
+            indices = self.indices
+        if block_size is None:
+            block_size = self.encoding.get("block_size",default.encoding["block_size"])
+        read_param = {"frames":self.frames,"max_frames":self.max_frames,"time_budget":self.time_budget,
+                      "block_size":block_size}
+        if isinstance(self.atoms,(str,Path)):
+            return iter_positions(self.atoms,indices=indices,format=self.format,**read_param)
+        elif type(self.atoms) == TrajectoryReader and isinstance(self.atoms.filename,(str,Path)):
+            return iter_positions(self.atoms.filename,indices=indices,format="traj",**read_param)
+        elif type(self.atoms) == MemmapTrajectory and self.frames is None and self.time_budget is None:
+            return self.atoms[:self.max_frames].iter_positions(indices=indices,block_size=block_size)
+        return iter_positions_from_images(self.atoms,indices=indices,**read_param)
     
     def todict(self):
         # 親クラスを上書き
-        attr_list = ["colors","scale","sizes","start","step","subdivision_surface","cartoon"]
+        attr_list = ["colors","scale","sizes","start","step","subdivision_surface","cartoon","playback","interpolate"]
         attr_list2 = ["style","chemical_symbols","unique_symbols"]
         data_dict = {}
         for attr in attr_list:
@@ -546,34 +1057,35 @@ class Animation(BaseStyle):
         
 def write_position_zipfile(zipname,pyscript:str,data:dict):
     """zipファイルにpositions(Animation)を書きこむ
-    dataは{"ファイル名(pkl)":Animation}の辞書
+    
+    | zipnameはファイル名またはバイナリのファイルオブジェクト
+    | dataは{"ファイル名(bin)":エンコードした座標(bytesまたはbytesのリスト)}の辞書
     """
-    p = Path(zipname)
-    if p.suffix != ".zip":
-        raise Exception("fileの拡張子は.zipです")
-    if p.exists():
-        raise FileExistsError(f"{zipname}は既に存在します")
-    with zipfile.ZipFile(zipname,"a") as zf:
-        for file,animation in data.items():
-            with zf.open(file,"w") as f:
-                for atoms in animation.atoms:
-                    pickle.dump(atoms[animation.indices].get_positions(),f)
-        with zf.open(str(p.with_suffix(".py")),"w") as f:
+    if hasattr(zipname,"write"):
+        script_name = default.pyfile
+    else:
+        p = Path(zipname)
+        if p.suffix != ".zip":
+            raise Exception("fileの拡張子は.zipです")
+        if p.exists():
+            raise FileExistsError(f"{zipname}は既に存在します")
+        script_name = p.with_suffix(".py").name
+    with zipfile.ZipFile(zipname,"w") as zf:
+        for file,payload in data.items():
+            write_chunks(zf,file,[payload] if isinstance(payload,(bytes,bytearray)) else payload)
+        with zf.open(script_name,"w") as f:
             f.write(pyscript.encode())
         
-                    
-def write_position_zipfile_for_app(zipname,data:dict,interzip="position"):
-    """zipファイルにpositions(Animation)を書きこむ
-    dataは{"ファイル名(pkl)":Trajectory}の辞書
+def write_position_zipfile_for_app(Styles,script_name=default.pyfile,max_workers=None):
+    """Webアプリ用にスクリプトと座標ファイルのzipをメモリ上(BytesIO)に作成する
+    
+    | 一時ファイルは作らない.返り値はそのままダウンロード用のデータとして使える.
+    | ex) st.download_button(label="Download ZIP",data=write_position_zipfile_for_app(styles),file_name="animation.zip")
+    
+    Returns:
+        io.BytesIO: 先頭にシークしたzipのデータ
     """
-    with zipfile.ZipFile(interzip,"a") as zf:
-        for file,traj in data.items():
-            with zf.open(file,"w") as f:
-                for atoms in traj:
-                    pickle.dump(atoms.get_positions(),f)
-        btn = st.download_button(
-            label="Download ZIP",
-            data=zf,
-            file_name="myfile.zip",
-            mime="application/zip"
-        )
\ No newline at end of file
+    buffer = io.BytesIO()
+    create_zip(buffer,Styles,script_name=script_name,max_workers=max_workers)
+    buffer.seek(0)
+    return buffer
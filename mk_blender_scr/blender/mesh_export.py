@@ -0,0 +1,429 @@
+import json
+import struct
+import time
+from pathlib import Path
+import numpy as np
+
+from mk_blender_scr.blender import default
+
+# glTFはY軸が上なので,ルートノードでZ軸が上の座標(Blender)から変換する(x,y,z)->(x,z,-y)
+Z_UP_TO_Y_UP = [-np.sqrt(0.5),0.0,0.0,np.sqrt(0.5)]
+
+def uv_sphere(segments=default.sphere_segments,rings=default.sphere_rings):
+    """半径1のUV球(primitive_uv_sphere_addと同じ分割)
+
+    Returns:
+        tuple: (頂点(n,3), 法線(n,3), 三角形(m,3))
+    """
+    theta = np.linspace(0,np.pi,rings+1)[1:-1]
+    phi = np.linspace(0,2*np.pi,segments,endpoint=False)
+    t,p = np.meshgrid(theta,phi,indexing="ij")
+    ring_verts = np.stack([np.sin(t)*np.cos(p),np.sin(t)*np.sin(p),np.cos(t)],axis=-1).reshape(-1,3)
+    verts = np.concatenate([[[0,0,1]],ring_verts,[[0,0,-1]]])
+    top,bottom = 0,len(verts)-1
+    ring = lambda r,s: 1+r*segments+s % segments
+    faces = []
+    for s in range(segments):
+        faces.append((top,ring(0,s),ring(0,s+1)))
+        faces.append((bottom,ring(rings-2,s+1),ring(rings-2,s)))
+        for r in range(rings-2):
+            faces.append((ring(r,s),ring(r+1,s),ring(r+1,s+1)))
+            faces.append((ring(r,s),ring(r+1,s+1),ring(r,s+1)))
+    return verts,verts.copy(),np.array(faces,dtype=np.uint32)
+
+def cylinder(vertices=default.cylinder_vertices):
+    """半径1,z方向に-0.5~0.5の蓋付き円柱(primitive_cylinder_addと同じ分割)
+
+    Returns:
+        tuple: (頂点(n,3), 法線(n,3), 三角形(m,3))
+    """
+    phi = np.linspace(0,2*np.pi,vertices,endpoint=False)
+    circle = np.stack([np.cos(phi),np.sin(phi),np.zeros(vertices)],axis=1)
+    side_normals = circle.copy()
+    top,bottom = circle+[0,0,0.5],circle-[0,0,0.5]
+    # 側面と蓋で法線が異なるので頂点を分ける
+    verts = np.concatenate([top,bottom,top,bottom,[[0,0,0.5],[0,0,-0.5]]])
+    normals = np.concatenate([side_normals,side_normals,
+                              np.tile([0,0,1.0],(vertices,1)),np.tile([0,0,-1.0],(vertices,1)),
+                              [[0,0,1.0],[0,0,-1.0]]])
+    n = vertices
+    faces = []
+    for i in range(n):
+        j = (i+1) % n
+        faces.append((i,n+i,n+j))
+        faces.append((i,n+j,j))
+        faces.append((4*n,2*n+i,2*n+j))
+        faces.append((4*n+1,3*n+j,3*n+i))
+    return verts,normals,np.array(faces,dtype=np.uint32)
+
+def _rotation_from_z(directions):
+    """z軸を各directionsに回す回転行列(n,3,3)とクォータニオン(n,4)(x,y,z,w)"""
+    d = directions/np.linalg.norm(directions,axis=1,keepdims=True)
+    # z軸とdの中間のベクトルを軸に180°回すと,zがdに移る
+    h = d+[0,0,1]
+    norm = np.linalg.norm(h,axis=1,keepdims=True)
+    antiparallel = norm[:,0] < 1e-9
+    h[antiparallel] = [1,0,0]
+    h = h/np.linalg.norm(h,axis=1,keepdims=True)
+    quat = np.concatenate([h,np.zeros((len(h),1))],axis=1)
+    rot = 2*np.einsum("ni,nj->nij",h,h)-np.eye(3)
+    return rot,quat
+
+def _style_geometry(data):
+    """styleのtodict()から球(位置,半径,材質)と円柱(始点,終点,半径,材質)を作る"""
+    if data["style"] == "animation":
+        raise TypeError("Animationはメッシュとして出力できません")
+    positions = np.array(data["positions"],dtype=float).reshape(-1,3)
+    symbols = np.array(data["chemical_symbols"])
+    n_atoms = len(positions)
+    if data.get("repeat"):
+        # 周期境界をまたぐ結合の相手(隣のセルの原子)は結合の端点にのみ使う
+        positions = np.concatenate([positions,np.array(data["image_positions"],dtype=float).reshape(-1,3)])
+        symbols = np.concatenate([symbols,symbols[np.array(data["image_atoms"],dtype=int)]])
+    materials = {symb:tuple(rgba) for symb,rgba in data["colors"].items()}
+    spheres = []
+    if data["style"] in ["ball_and_stick","space_filling"]:
+        for symb in np.unique(symbols):
+            mask = symbols[:n_atoms] == symb
+            radius = data["scale"]*data["sizes"][symb]
+            spheres.append((symb,positions[:n_atoms][mask],np.full(mask.sum(),radius)))
+    cylinders = []
+    bonds = np.array(data.get("bonds",[]),dtype=int).reshape(-1,2)
+    if data["style"] in ["stick","ball_and_stick"] and len(bonds):
+        p1,p2 = positions[bonds[:,0]],positions[bonds[:,1]]
+        if data["bicolor"]:
+            if data["style"] == "stick":
+                ratio = np.full(len(bonds),0.5)
+            else:
+                # テンプレート(draw_bicolor_bonds)と同じく,球の表面間の中点で色を分ける
+                size_1 = np.array([data["scale"]*data["sizes"][s] for s in symbols[bonds[:,0]]])
+                size_2 = np.array([data["scale"]*data["sizes"][s] for s in symbols[bonds[:,1]]])
+                d = np.linalg.norm(p2-p1,axis=1)
+                ratio = (size_1+(d-size_1-size_2)/2)/d
+            middle = p1+(p2-p1)*ratio[:,None]
+            for (start,end),atom_symbols in [((p1,middle),symbols[bonds[:,0]]),((p2,middle),symbols[bonds[:,1]])]:
+                for symb in np.unique(atom_symbols):
+                    mask = atom_symbols == symb
+                    cylinders.append((symb,start[mask],end[mask],data["radius"]))
+        else:
+            materials["bond"] = tuple(data["stick_color"])
+            cylinders.append(("bond",p1,p2,data["radius"]))
+    if data.get("repeat"):
+        # ユニットセルをセルベクトルずつずらして並べる
+        shifts = np.array(list(np.ndindex(*data["repeat"])))@np.array(data["cell"])
+        tile = lambda p: (p[None,:,:]+shifts[:,None,:]).reshape(-1,3)
+        spheres = [(symb,tile(p),np.tile(r,len(shifts))) for symb,p,r in spheres]
+        cylinders = [(symb,tile(start),tile(end),radius) for symb,start,end,radius in cylinders]
+    return spheres,cylinders,materials
+
+def _instances(spheres,cylinders):
+    """(材質,形状,平行移動(n,3),回転行列(n,3,3),クォータニオン(n,4),スケール(n,3))のリスト"""
+    instances = []
+    for material,centers,radii in spheres:
+        n = len(centers)
+        instances.append((material,"sphere",centers,np.tile(np.eye(3),(n,1,1)),
+                          np.tile([0,0,0,1.0],(n,1)),np.repeat(radii[:,None],3,axis=1)))
+    for material,start,end,radius in cylinders:
+        rot,quat = _rotation_from_z(end-start)
+        length = np.linalg.norm(end-start,axis=1)
+        scale = np.stack([np.full(len(length),radius),np.full(len(length),radius),length],axis=1)
+        instances.append((material,"cylinder",(start+end)/2,rot,quat,scale))
+    return instances
+
+def _merge(shape,translation,rotation,scale):
+    """形状をインスタンス毎に変換して1つのメッシュにまとめる(ベクトル化,float32)"""
+    verts,normals,faces = shape
+    rotation = rotation.astype(np.float32)
+    v = np.matmul(verts.astype(np.float32)[None]*scale.astype(np.float32)[:,None,:],rotation.transpose(0,2,1))
+    v += translation.astype(np.float32)[:,None,:]
+    # 半径方向のスケールは等方なので,法線は回転のみでよい
+    nrm = np.matmul(normals.astype(np.float32),rotation.transpose(0,2,1))
+    f = faces[None]+(np.arange(len(translation),dtype=np.uint32)*len(verts))[:,None,None]
+    return v.reshape(-1,3),nrm.reshape(-1,3),f.reshape(-1,3)
+
+def _concatenate(part):
+    """(頂点,法線,三角形)のリストを1つのメッシュにまとめる"""
+    if len(part) == 1:
+        return part[0]
+    offsets = np.cumsum([0]+[len(v) for v,_,_ in part[:-1]]).astype(np.uint32)
+    return (np.concatenate([v for v,_,_ in part]),
+            np.concatenate([n for _,n,_ in part]),
+            np.concatenate([f+o for (_,_,f),o in zip(part,offsets)]))
+
+def build_meshes(Styles,segments=default.sphere_segments,rings=default.sphere_rings,
+                 cylinder_vertices=default.cylinder_vertices):
+    """styleから材質毎のメッシュを作る
+
+    Returns:
+        tuple: ({材質名:(頂点,法線,三角形)}, {材質名:RGBA})
+    """
+    if type(Styles) != list:
+        Styles = [Styles]
+    shapes = {"sphere":uv_sphere(segments,rings),"cylinder":cylinder(cylinder_vertices)}
+    parts = {}
+    materials = {}
+    for i,style in enumerate(Styles):
+        name = "" if len(Styles) == 1 else f"{i}_"
+        spheres,cylinders,style_materials = _style_geometry(style.todict())
+        materials.update({f"{name}{k}":v for k,v in style_materials.items()})
+        for material,shape,translation,rotation,_,scale in _instances(spheres,cylinders):
+            parts.setdefault(f"{name}{material}",[]).append(_merge(shapes[shape],translation,rotation,scale))
+    meshes = {material:_concatenate(part) for material,part in parts.items()}
+    return meshes,materials
+
+class _GLBBuilder():
+    def __init__(self):
+        self.gltf = {"asset":{"version":"2.0","generator":"mk_blender_scr"},"scene":0,"scenes":[{"nodes":[0]}],
+                     "nodes":[{"name":"root","rotation":Z_UP_TO_Y_UP,"children":[]}],
+                     "meshes":[],"materials":[],"accessors":[],"bufferViews":[],"buffers":[]}
+        self.binary = bytearray()
+
+    def add_accessor(self,array,component_type,type_,target):
+        data = np.ascontiguousarray(array).tobytes()
+        self.binary.extend(b"\0"*(-len(self.binary) % 4))
+        self.gltf["bufferViews"].append({"buffer":0,"byteOffset":len(self.binary),"byteLength":len(data),"target":target})
+        self.binary.extend(data)
+        accessor = {"bufferView":len(self.gltf["bufferViews"])-1,"componentType":component_type,
+                    "count":len(array),"type":type_}
+        if type_ == "VEC3":
+            accessor["min"] = array.min(axis=0).tolist()
+            accessor["max"] = array.max(axis=0).tolist()
+        self.gltf["accessors"].append(accessor)
+        return len(self.gltf["accessors"])-1
+
+    def add_material(self,name,rgba):
+        self.gltf["materials"].append({"name":name,"pbrMetallicRoughness":{
+            "baseColorFactor":[float(c) for c in rgba],"metallicFactor":0.0,"roughnessFactor":0.5}})
+        return len(self.gltf["materials"])-1
+
+    def add_mesh(self,name,verts,normals,faces,material):
+        position = self.add_accessor(verts.astype(np.float32),5126,"VEC3",34962)
+        normal = self.add_accessor(normals.astype(np.float32),5126,"VEC3",34962)
+        indices = self.add_accessor(faces.astype(np.uint32).ravel(),5125,"SCALAR",34963)
+        self.gltf["meshes"].append({"name":name,"primitives":[{"attributes":{"POSITION":position,"NORMAL":normal},
+                                                               "indices":indices,"material":material}]})
+        return len(self.gltf["meshes"])-1
+
+    def add_node(self,node):
+        self.gltf["nodes"].append(node)
+        self.gltf["nodes"][0]["children"].append(len(self.gltf["nodes"])-1)
+
+    def tobytes(self):
+        self.binary.extend(b"\0"*(-len(self.binary) % 4))
+        self.gltf["buffers"] = [{"byteLength":len(self.binary)}]
+        js = json.dumps(self.gltf,separators=(",",":")).encode()
+        js += b" "*(-len(js) % 4)
+        length = 12+8+len(js)+8+len(self.binary)
+        return (struct.pack("<III",0x46546C67,2,length)+struct.pack("<II",len(js),0x4E4F534A)+js
+                +struct.pack("<II",len(self.binary),0x004E4942)+bytes(self.binary))
+
+def _write_glb(file,Styles,segments,rings,cylinder_vertices,instancing):
+    builder = _GLBBuilder()
+    shapes = {"sphere":uv_sphere(segments,rings),"cylinder":cylinder(cylinder_vertices)}
+    n_nodes = 0
+    if instancing:
+        # 形状×材質毎に1つのメッシュを作り,原子・結合はそのメッシュを参照するノードにする
+        meshes = {}
+        for i,style in enumerate(Styles):
+            name = "" if len(Styles) == 1 else f"{i}_"
+            spheres,cylinders,style_materials = _style_geometry(style.todict())
+            for material,shape,translation,_,quat,scale in _instances(spheres,cylinders):
+                key = (f"{name}{material}",shape)
+                if key not in meshes:
+                    m = builder.add_material(key[0],style_materials[material])
+                    meshes[key] = builder.add_mesh(f"{key[0]}_{shape}",*shapes[shape],m)
+                for k,(t,q,s) in enumerate(zip(translation.tolist(),quat.tolist(),scale.tolist())):
+                    builder.add_node({"name":f"{key[0]}_{shape}{k}","mesh":meshes[key],
+                                      "translation":t,"rotation":q,"scale":s})
+                    n_nodes += 1
+    else:
+        meshes,materials = build_meshes(Styles,segments,rings,cylinder_vertices)
+        for material,(verts,normals,faces) in meshes.items():
+            m = builder.add_material(material,materials[material])
+            builder.add_node({"name":material,"mesh":builder.add_mesh(material,verts,normals,faces,m)})
+            n_nodes += 1
+    data = builder.tobytes()
+    with open(file,"wb") as f:
+        f.write(data)
+    return {"format":"glb","nbytes":len(data),"meshes":len(builder.gltf["meshes"]),"nodes":n_nodes}
+
+def _write_ply(file,Styles,segments,rings,cylinder_vertices):
+    meshes,materials = build_meshes(Styles,segments,rings,cylinder_vertices)
+    # PLYには材質が無いので,材質の色を頂点色として書き込む
+    if not meshes:
+        raise ValueError("出力するメッシュがありません")
+    verts,normals,faces = _concatenate(list(meshes.values()))
+    colors = np.concatenate([np.tile(np.round(np.array(materials[m][:3])*255).astype(np.uint8),(len(v),1))
+                             for m,(v,_,_) in meshes.items()])
+    vertex = np.empty(len(verts),dtype=[("x","<f4"),("y","<f4"),("z","<f4"),("nx","<f4"),("ny","<f4"),("nz","<f4"),
+                                        ("red","u1"),("green","u1"),("blue","u1")])
+    for k,key in enumerate(["x","y","z"]):
+        vertex[key] = verts[:,k]
+        vertex["n"+key] = normals[:,k]
+    for k,key in enumerate(["red","green","blue"]):
+        vertex[key] = colors[:,k]
+    face = np.empty(len(faces),dtype=[("n","u1"),("v","<i4",(3,))])
+    face["n"] = 3
+    face["v"] = faces
+    header = ("ply\nformat binary_little_endian 1.0\ncomment mk_blender_scr\n"
+              f"element vertex {len(vertex)}\n"
+              "property float x\nproperty float y\nproperty float z\n"
+              "property float nx\nproperty float ny\nproperty float nz\n"
+              "property uchar red\nproperty uchar green\nproperty uchar blue\n"
+              f"element face {len(face)}\nproperty list uchar int vertex_indices\nend_header\n")
+    with open(file,"wb") as f:
+        f.write(header.encode())
+        f.write(vertex.tobytes())
+        f.write(face.tobytes())
+    return {"format":"ply","nbytes":Path(file).stat().st_size,"vertices":len(vertex),"faces":len(face)}
+
+def export_mesh(file,Styles,format=None,segments=default.sphere_segments,rings=default.sphere_rings,
+                cylinder_vertices=default.cylinder_vertices,instancing=True):
+    """styleをBlenderのスクリプトを介さずにメッシュファイル(glTF(.glb)またはPLY)として出力する
+
+    | 球と円柱の頂点はNumPyでまとめて作成する.Blenderでは1回のインポートで読み込める.
+    | (ファイル > インポート > glTF 2.0 または Stanford(.ply))
+
+    Parameters:
+
+    file: str or Path
+        出力ファイル名(.glbまたは.ply)
+    Styles: BaseStyle object or list of BaseStyle object
+        BallAndStick,Stick,SpaceFillingのオブジェクト(Animationは不可)
+    format: str
+        'glb'または'ply'.Noneの場合は拡張子から判断する
+    segments: int
+        球の経度方向の分割数
+    rings: int
+        球の緯度方向の分割数
+    cylinder_vertices: int
+        円柱の円周の頂点数
+    instancing: bool
+        | glbの場合のみ有効.Trueの場合,元素毎の球と円柱のメッシュを1つずつ作り,
+        | 各原子・結合はそのメッシュを参照するノード(インスタンス)にする.
+        | Falseの場合,材質毎に1つのメッシュにまとめる.
+        | PLYは材質を持てないので,材質の色を頂点色として書き込む.
+
+    Returns:
+        dict: 出力したファイルの情報(サイズ,メッシュ数等)
+    """
+    if type(Styles) != list:
+        Styles = [Styles]
+    if format is None:
+        format = Path(file).suffix.lstrip(".").lower()
+    if format == "glb":
+        return _write_glb(file,Styles,segments,rings,cylinder_vertices,instancing)
+    elif format == "ply":
+        return _write_ply(file,Styles,segments,rings,cylinder_vertices)
+    raise ValueError(f"formatは'glb'または'ply'です: {format}")
+
+def validate_glb(file):
+    """glbファイルの構造を検証する(Blenderを使わずに確認するため)
+
+    | ヘッダー,チャンク,bufferView/accessorの範囲,インデックスが頂点数未満であること,
+    | ノードとメッシュの参照を確認する.問題があればValueErrorを送出する.
+
+    Returns:
+        dict: メッシュ数,ノード数,頂点数,三角形数
+    """
+    data = Path(file).read_bytes()
+    magic,version,length = struct.unpack_from("<III",data,0)
+    if magic != 0x46546C67 or version != 2:
+        raise ValueError("glTF 2.0のバイナリではありません")
+    if length != len(data):
+        raise ValueError(f"ヘッダーの長さ({length})とファイルサイズ({len(data)})が一致しません")
+    json_length,json_type = struct.unpack_from("<II",data,12)
+    if json_type != 0x4E4F534A:
+        raise ValueError("1つ目のチャンクがJSONではありません")
+    gltf = json.loads(data[20:20+json_length])
+    bin_length,bin_type = struct.unpack_from("<II",data,20+json_length)
+    if bin_type != 0x004E4942:
+        raise ValueError("2つ目のチャンクがBINではありません")
+    binary = data[28+json_length:28+json_length+bin_length]
+    if gltf["buffers"][0]["byteLength"] != len(binary):
+        raise ValueError("bufferのbyteLengthとBINチャンクの長さが一致しません")
+    sizes = {5126:4,5125:4,5123:2}
+    ncomp = {"SCALAR":1,"VEC3":3,"VEC4":4}
+    arrays = []
+    for accessor in gltf["accessors"]:
+        view = gltf["bufferViews"][accessor["bufferView"]]
+        if view["byteOffset"]+view["byteLength"] > len(binary):
+            raise ValueError("bufferViewがbufferの範囲外です")
+        nbytes = accessor["count"]*ncomp[accessor["type"]]*sizes[accessor["componentType"]]
+        if nbytes > view["byteLength"]:
+            raise ValueError("accessorがbufferViewの範囲外です")
+        dtype = {5126:np.float32,5125:np.uint32,5123:np.uint16}[accessor["componentType"]]
+        arrays.append(np.frombuffer(binary,dtype=dtype,count=accessor["count"]*ncomp[accessor["type"]],
+                                    offset=view["byteOffset"]))
+    n_verts = n_tris = 0
+    for mesh in gltf["meshes"]:
+        for primitive in mesh["primitives"]:
+            count = gltf["accessors"][primitive["attributes"]["POSITION"]]["count"]
+            indices = arrays[primitive["indices"]]
+            if len(indices) % 3 != 0 or (len(indices) and indices.max() >= count):
+                raise ValueError(f"{mesh['name']}のインデックスが不正です")
+            if primitive.get("material",0) >= len(gltf["materials"]):
+                raise ValueError(f"{mesh['name']}の材質が存在しません")
+            n_verts += count
+            n_tris += len(indices)//3
+    for node in gltf["nodes"]:
+        if "mesh" in node and node["mesh"] >= len(gltf["meshes"]):
+            raise ValueError(f"{node['name']}のメッシュが存在しません")
+        if any(child >= len(gltf["nodes"]) for child in node.get("children",[])):
+            raise ValueError(f"{node['name']}の子ノードが存在しません")
+    return {"meshes":len(gltf["meshes"]),"nodes":len(gltf["nodes"]),"vertices":n_verts,"triangles":n_tris}
+
+def validate_ply(file):
+    """export_meshで出力したPLYファイル(バイナリ,三角形)の構造を検証する
+
+    Returns:
+        dict: 頂点数,三角形数
+    """
+    data = Path(file).read_bytes()
+    end = data.find(b"end_header\n")
+    if not data.startswith(b"ply\n") or end < 0:
+        raise ValueError("PLYファイルではありません")
+    header = data[:end].decode().splitlines()
+    counts = {line.split()[1]:int(line.split()[2]) for line in header if line.startswith("element")}
+    body = data[end+len(b"end_header\n"):]
+    vertex_size = 6*4+3
+    if len(body) != counts["vertex"]*vertex_size+counts["face"]*(1+3*4):
+        raise ValueError("要素数とファイルサイズが一致しません")
+    face = np.frombuffer(body,dtype=[("n","u1"),("v","<i4",(3,))],offset=counts["vertex"]*vertex_size)
+    if np.any(face["n"] != 3) or (len(face) and (face["v"].max() >= counts["vertex"] or face["v"].min() < 0)):
+        raise ValueError("面のインデックスが不正です")
+    return {"vertices":counts["vertex"],"triangles":counts["face"]}
+
+def benchmark(Styles,directory=".",repeat=3):
+    """メッシュの直接出力とスクリプトの作成の時間を比較する
+
+    | スクリプトの経路ではBlender内で原子・結合毎にオペレーターが呼ばれるので,その回数も返す.
+    | (Blender内での構築時間はこの関数では計測できない)
+
+    Returns:
+        dict: {"glb":秒,"glb_merged":秒,"ply":秒,"script":秒,"operator_calls":回数} (repeat回中の最小値)
+    """
+    from mk_blender_scr.blender.make_script import create
+    if type(Styles) != list:
+        Styles = [Styles]
+    directory = Path(directory)
+    tasks = {
+        "glb":lambda: export_mesh(directory/"benchmark.glb",Styles),
+        "glb_merged":lambda: export_mesh(directory/"benchmark_merged.glb",Styles,instancing=False),
+        "ply":lambda: export_mesh(directory/"benchmark.ply",Styles),
+        "script":lambda: create("-",Styles),
+    }
+    result = {}
+    for name,task in tasks.items():
+        times = []
+        for _ in range(repeat):
+            t = time.perf_counter()
+            task()
+            times.append(time.perf_counter()-t)
+        result[name] = min(times)
+    n_calls = 0
+    for style in Styles:
+        spheres,cylinders,_ = _style_geometry(style.todict())
+        n_calls += sum(len(c) for _,c,_ in spheres)+sum(len(s) for _,s,_,_ in cylinders)
+    result["operator_calls"] = n_calls
+    return result
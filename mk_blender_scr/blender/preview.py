@@ -0,0 +1,230 @@
+import zlib
+import struct
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from ase import Atoms
+from ase.io import read
+from ase.utils import rotate
+from ase.data import covalent_radii
+from ase.neighborlist import neighbor_list
+
+import mk_blender_scr.blender.default as default
+
+LIGHT = np.array([-0.3,0.4,0.85])/np.linalg.norm([-0.3,0.4,0.85])
+AMBIENT = 0.35
+
+def write_png(file,image):
+    """(高さ,幅,3)のuint8のRGB画像をPNGとして書き込む(zlibのみ使用)"""
+    image = np.ascontiguousarray(image,dtype=np.uint8)
+    height,width = image.shape[:2]
+    # 各行の先頭にフィルタの種類(0:なし)を付ける
+    raw = np.concatenate([np.zeros((height,1),dtype=np.uint8),image.reshape(height,-1)],axis=1).tobytes()
+    def chunk(tag,data):
+        return struct.pack(">I",len(data))+tag+data+struct.pack(">I",zlib.crc32(tag+data) & 0xffffffff)
+    png = (b"\x89PNG\r\n\x1a\n"
+           +chunk(b"IHDR",struct.pack(">IIBBBBB",width,height,8,2,0,0,0))
+           +chunk(b"IDAT",zlib.compress(raw,6))
+           +chunk(b"IEND",b""))
+    with open(file,"wb") as f:
+        f.write(png)
+
+def _find_bonds(atoms,skin=0.3):
+    """get_unique_bonds(natural_cutoffs,build_neighbor_list)と同じ基準の結合を近接リストで求める
+
+    | ase.geometry.analysis.Analysisは原子数の2乗のメモリを使うので,サムネイルでは使わない.
+    """
+    if len(atoms) < 2:
+        return np.zeros((0,2),dtype=int)
+    radii = covalent_radii[atoms.numbers]+skin
+    positions = atoms.get_positions()
+    lower = positions.min(axis=0)
+    sub = Atoms(atoms.numbers,positions=positions-lower,pbc=False)
+    # 近接リストのビンはセルに合わせて作られるので,原子の範囲をセルにする
+    sub.set_cell(np.diag(np.maximum(positions.max(axis=0)-lower,1.0)))
+    i,j = neighbor_list("ij",sub,radii.tolist(),self_interaction=False)
+    return np.stack([i[i < j],j[i < j]],axis=1)
+
+def _atoms_data(atoms,style):
+    """Atomsからデフォルトのパラメータ(default.color,default.sizes等)でtodict()と同じ形式の辞書を作る
+
+    | スタイルのオブジェクトを作ると結合の探索が重いので,Atomsの場合はこちらを使う.
+    """
+    styles = {"space_filling":default.space_filling_scale,"ball_and_stick":default.scale,"stick":default.scale}
+    if style not in styles:
+        raise ValueError(f"styleは{list(styles)}のいずれかです: {style}")
+    symbols = atoms.get_chemical_symbols()
+    unique = set(symbols)
+    data = {"style":style,"chemical_symbols":symbols,"positions":atoms.get_positions(),
+            "colors":{s:c for s,c in default.color.items() if s in unique},
+            "sizes":{s:size for s,size in default.sizes.items() if s in unique},
+            "scale":styles[style],"radius":default.radius,"bicolor":default.bicolor,
+            "stick_color":default.bond_color}
+    if style != "space_filling":
+        data["bonds"] = _find_bonds(atoms)
+    return data
+
+def _primitives(data):
+    """todict()から描写する球(中心,半径,色)と結合(両端,半径,両端の色)を作る"""
+    positions = np.array(data["positions"],dtype=float).reshape(-1,3)
+    symbols = data["chemical_symbols"]
+    colors = {symb:np.array(rgba[:3]) for symb,rgba in data["colors"].items()}
+    spheres = (np.zeros((0,3)),np.zeros(0),np.zeros((0,3)))
+    if data["style"] in ["space_filling","ball_and_stick"]:
+        radii = np.array([data["scale"]*data["sizes"][s] for s in symbols])
+        spheres = (positions,radii,np.array([colors[s] for s in symbols]).reshape(-1,3))
+    bonds = np.array(data.get("bonds",[]),dtype=int).reshape(-1,2)
+    if data["style"] == "space_filling":
+        bonds = bonds[:0]
+    if data.get("bicolor",False):
+        first = np.array([colors[symbols[i]] for i in bonds[:,0]]).reshape(-1,3)
+        second = np.array([colors[symbols[j]] for j in bonds[:,1]]).reshape(-1,3)
+    else:
+        first = second = np.tile(np.array(data.get("stick_color",default.bond_color)[:3]),(len(bonds),1))
+    sticks = (positions[bonds[:,0]],positions[bonds[:,1]],data.get("radius",default.radius),first,second)
+    return spheres,sticks
+
+def _sample_sticks(p1,p2,radius,first,second):
+    """結合(ピクセル単位)を半径radiusの球を並べて近似する.間隔は半径の半分(最低1px)"""
+    length = np.linalg.norm((p2-p1)[:,:2],axis=1)
+    n_samples = np.maximum(np.ceil(length/max(radius/2,1.0)).astype(int),1)+1
+    bond_ids = np.repeat(np.arange(len(p1)),n_samples)
+    first_sample = np.repeat(np.cumsum(n_samples)-n_samples,n_samples)
+    t = (np.arange(len(bond_ids))-first_sample)/(n_samples[bond_ids]-1)
+    centers = p1[bond_ids]+(p2-p1)[bond_ids]*t[:,None]
+    colors = np.where((t < 0.5)[:,None],first[bond_ids],second[bond_ids])
+    return centers,np.full(len(t),radius),colors
+
+def _rasterize(centers,radii,colors,width,height,zbuf,image,batch_pixels=4_000_000):
+    """ピクセル単位の球を陰影付きでzバッファに描写する(球をまとめて処理する)"""
+    order = np.argsort(radii)
+    centers,radii,colors = centers[order],radii[order],colors[order]
+    patch = (2*np.ceil(radii).astype(int)+1)**2
+    start = 0
+    while start < len(radii):
+        # 半径の近い球をまとめ,最大の球に合わせた同じ大きさのパッチで計算する
+        n = np.arange(1,len(radii)-start+1)
+        stop = start+max(int(np.searchsorted(n*patch[start:],batch_pixels,side="right")),1)
+        R = int(np.ceil(radii[stop-1]))
+        offsets = np.arange(-R,R+1)
+        c,r = centers[start:stop],radii[start:stop]
+        cx,cy = np.round(c[:,0]).astype(int),np.round(c[:,1]).astype(int)
+        # 球の内側のピクセルのみを取り出してから陰影と深さを計算する
+        dx = (cx[:,None]+offsets+0.5-c[:,0,None]).astype(np.float32)
+        dy = (cy[:,None]+offsets+0.5-c[:,1,None]).astype(np.float32)
+        d2 = dx[:,None,:]**2+dy[:,:,None]**2
+        k,iy,ix = np.nonzero(d2 <= (r**2)[:,None,None])
+        px,py = cx[k]+offsets[ix],cy[k]+offsets[iy]
+        visible = (px >= 0) & (px < width) & (py >= 0) & (py < height)
+        k,iy,ix,px,py = k[visible],iy[visible],ix[visible],px[visible],py[visible]
+        dz = np.sqrt(np.clip(r[k]**2-d2[k,iy,ix],0,None))
+        depth = c[k,2]+dz
+        # 画像のyは下向きなので法線のy成分は反転する
+        shade = AMBIENT+(1-AMBIENT)*np.clip((dx[k,ix]*LIGHT[0]-dy[k,iy]*LIGHT[1]+dz*LIGHT[2])/r[k],0,None)
+        pix = py*width+px
+        # 同じピクセルでは最も手前(depthが大きい)を残す
+        o = np.lexsort((-depth,pix))
+        pix,depth,k,shade = pix[o],depth[o],k[o],shade[o]
+        first = np.r_[True,pix[1:] != pix[:-1]]
+        pix,depth,k,shade = pix[first],depth[first],k[first],shade[first]
+        closer = depth > zbuf[pix]
+        zbuf[pix[closer]] = depth[closer]
+        image[pix[closer]] = colors[start+k[closer]]*shade[closer,None]
+        start = stop
+
+def render_preview(atoms,file=None,size=(256,256),style="space_filling",rotation="",
+                   background=(1.0,1.0,1.0),padding=0.05,supersample=2):
+    """Blenderやブラウザを使わずに,正投影のサムネイル画像をNumPyで描写する
+
+    | 原子(球)と結合をzバッファで描写し,ランバート反射で陰影を付ける.
+    | 結合は半径radiusの球をピクセル間隔で並べて円柱を近似する.
+    | 色と大きさはstyle(default.color,default.sizes)に従う.
+
+    Parameters:
+
+    atoms: Atoms or BaseStyle object
+        | Atomsの場合はstyleで指定したスタイルで,デフォルトのパラメータで描写する.
+        | SpaceFilling,BallAndStick,Stickのオブジェクトを与えた場合はそのパラメータで描写する.
+    file: str or Path
+        PNGのファイル名.Noneの場合は保存しない
+    size: tuple
+        (幅,高さ)(px単位)
+    style: str
+        'space_filling','ball_and_stick'または'stick'
+    rotation: str
+        視点の回転. '10x,-20y'のように指定する(ase.visualizeと同じ)
+    background: tuple
+        背景色(1で規格化したRGB)
+    padding: float
+        画像の縁の余白(幅に対する割合)
+    supersample: int
+        アンチエイリアスのために何倍の解像度で描写して縮小するか
+
+    Returns:
+        numpy.ndarray: (高さ,幅,3)のuint8の画像
+    """
+    data = _atoms_data(atoms,style) if isinstance(atoms,Atoms) else atoms.todict()
+    (centers,radii,colors),(p1,p2,radius,first,second) = _primitives(data)
+    width,height = size[0]*supersample,size[1]*supersample
+    image = np.tile(np.array(background,dtype=float),(width*height,1))
+    zbuf = np.full(width*height,-np.inf)
+    if len(centers) or len(p1):
+        R = rotate(rotation).T
+        centers,p1,p2 = centers@R,p1@R,p2@R
+        points = np.concatenate([centers,p1,p2])
+        extents = np.concatenate([radii,np.full(2*len(p1),radius)])[:,None]
+        lower = (points-extents).min(axis=0)
+        upper = (points+extents).max(axis=0)
+        extent = (upper-lower)[:2].max()*(1+2*padding)
+        scale = min(width,height)/max(extent,1e-8)
+        middle = (upper+lower)/2
+        def to_pixel(x):
+            px = np.empty_like(x)
+            px[:,0] = (x[:,0]-middle[0])*scale+width/2
+            px[:,1] = -(x[:,1]-middle[1])*scale+height/2
+            px[:,2] = x[:,2]*scale
+            return px
+        if len(p1):
+            c,r,col = _sample_sticks(to_pixel(p1),to_pixel(p2),radius*scale,first,second)
+            _rasterize(c,r,col,width,height,zbuf,image)
+        if len(centers):
+            _rasterize(to_pixel(centers),radii*scale,colors,width,height,zbuf,image)
+    image = image.reshape(height,width,3)
+    if supersample > 1:
+        image = image.reshape(size[1],supersample,size[0],supersample,3).mean(axis=(1,3))
+    image = np.round(np.clip(image,0,1)*255).astype(np.uint8)
+    if file is not None:
+        write_png(file,image)
+    return image
+
+def _render_file(args):
+    file,outfile,format,kwargs = args
+    render_preview(read(file,format=format),outfile,**kwargs)
+    return str(outfile)
+
+def render_previews(files,outdir=".",format=None,processes=None,**kwargs):
+    """複数の構造ファイルのサムネイルを並列(プロセス)に描写し,outdir/{ファイル名}.pngに保存する
+
+    Parameters:
+
+    files: list of str
+        構造ファイル(ase.io.readで読み込める)
+    outdir: str or Path
+        出力先のディレクトリ
+    format: str
+        ファイルフォーマット(ase.io.readのformat)
+    processes: int
+        プロセス数.Noneの場合はCPU数
+    kwargs:
+        render_previewの引数(size,style,rotation等)
+
+    Returns:
+        list of str: 保存したPNGファイル名
+    """
+    outdir = Path(outdir)
+    outdir.mkdir(parents=True,exist_ok=True)
+    tasks = [(file,outdir/(Path(file).stem+".png"),format,kwargs) for file in files]
+    if processes == 1:
+        return [_render_file(task) for task in tasks]
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        return list(executor.map(_render_file,tasks))
@@ -0,0 +1,152 @@
+import sys
+import json
+import time
+import threading
+import tracemalloc
+from datetime import datetime
+
+# 計測中のProfiler.Noneの場合,stageは何もしない
+_active = None
+
+class _NullStage():
+    """計測していない時のstage.何もしない"""
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*args):
+        return False
+
+    def add_items(self,n):
+        pass
+
+_NULL_STAGE = _NullStage()
+
+class _Stage():
+    def __init__(self,profiler,name,style,items):
+        self.profiler = profiler
+        self.record = {"stage":name,"style":style,"seconds":0.0,"peak_bytes":0,"items":items}
+
+    def add_items(self,n):
+        self.record["items"] = (self.record["items"] or 0)+n
+
+    def __enter__(self):
+        self.profiler._enter(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self,*args):
+        self.record["seconds"] = time.perf_counter()-self.start
+        self.profiler._exit(self)
+        return False
+
+def stage(name,style=None,items=None):
+    """処理の段階を計測するコンテキストマネージャー
+
+    | Profilerで計測していない場合は何もしない(ほぼコストがかからない).
+    | with stage("bonds",style="ball_and_stick",items=len(atoms)) as s: ... のように使い,
+    | 後から件数を数える場合はs.add_items(n)を呼ぶ.
+    """
+    if _active is None:
+        return _NULL_STAGE
+    return _Stage(_active,name,style,items)
+
+class Profiler():
+    """createやstyleの作成の段階ごとの時間,ピークメモリ,件数を記録する
+
+    | with Profiler() as prof: の中で作成したstyleとcreateの処理が記録される.
+    | createのprofile引数に与えることもできる.
+    | ピークメモリはtracemallocで計測する(計測中はPythonのメモリ確保が遅くなる).
+    | 段階の開始時からの増加分を記録する.スレッドで並列に実行された段階では,他の段階の確保したメモリも含まれる.
+
+    Parameters:
+
+    memory: bool
+        Falseの場合,ピークメモリを計測しない(tracemallocを使わない)
+    """
+    def __init__(self,memory=True):
+        self.memory = memory
+        self.records = []
+        self._open = []
+        self._lock = threading.Lock()
+        self._previous = []
+        self._tracing = False
+        self.start = None
+        self.seconds = 0.0
+
+    def __enter__(self):
+        global _active
+        self._previous.append(_active)
+        _active = self
+        # 入れ子で使われた場合(createのprofileに計測中のProfilerを与えた場合等)は外側のみで計測する
+        if len(self._previous) == 1:
+            if self.memory and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._tracing = True
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self,*args):
+        global _active
+        _active = self._previous.pop()
+        if not self._previous:
+            self.seconds += time.perf_counter()-self.start
+            if self._tracing:
+                tracemalloc.stop()
+                self._tracing = False
+        return False
+
+    def _update_peak(self):
+        """開いている全ての段階のピークを更新してからtracemallocのピークをリセットする"""
+        current,peak = tracemalloc.get_traced_memory()
+        for s in self._open:
+            s.peak = max(s.peak,peak)
+        tracemalloc.reset_peak()
+        return current
+
+    def _enter(self,s):
+        with self._lock:
+            if tracemalloc.is_tracing():
+                s.base = self._update_peak()
+                s.peak = s.base
+            self._open.append(s)
+
+    def _exit(self,s):
+        with self._lock:
+            if tracemalloc.is_tracing():
+                self._update_peak()
+                s.record["peak_bytes"] = s.peak-s.base
+            self._open.remove(s)
+            self.records.append(s.record)
+
+    def report(self):
+        """記録を辞書で返す
+
+        Returns:
+            dict: {"stages":[{"stage","style","seconds","peak_bytes","items"}],
+            "summary":{段階名:{"seconds","peak_bytes","items","calls"}},"total_seconds"}
+        """
+        summary = {}
+        for record in self.records:
+            s = summary.setdefault(record["stage"],{"seconds":0.0,"peak_bytes":0,"items":0,"calls":0})
+            s["seconds"] += record["seconds"]
+            s["peak_bytes"] = max(s["peak_bytes"],record["peak_bytes"])
+            s["items"] += record["items"] or 0
+            s["calls"] += 1
+        return {"stages":list(self.records),"summary":summary,"total_seconds":self.seconds}
+
+    def dump(self,file,**metadata):
+        """記録をJSONとして1行でfileに追記する(複数の実行の記録を集計できる)
+
+        | 日時,コマンドライン引数とmetadataも記録する.
+        """
+        record = {"datetime":datetime.now().isoformat(),"argv":sys.argv,**metadata,**self.report()}
+        with open(file,"a") as f:
+            f.write(json.dumps(record)+"\n")
+
+    def print_summary(self,file=None):
+        """段階ごとの合計を表にして表示する(デフォルトは標準エラー)"""
+        file = sys.stderr if file is None else file
+        print(f"{'stage':<20}{'calls':>6}{'seconds':>10}{'peak MB':>10}{'items':>12}",file=file)
+        for name,s in self.report()["summary"].items():
+            print(f"{name:<20}{s['calls']:>6}{s['seconds']:>10.3f}{s['peak_bytes']/1e6:>10.2f}{s['items']:>12}",file=file)
+        print(f"{'total':<20}{'':>6}{self.seconds:>10.3f}",file=file)
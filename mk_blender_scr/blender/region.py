@@ -0,0 +1,146 @@
+import numpy as np
+from ase.data import covalent_radii
+from ase.neighborlist import neighbor_list
+
+class GridIndex():
+    """原子を一様なグリッドに振り分けた空間インデックス
+
+    | 球内の原子の探索はその球に重なるグリッドのセルのみを調べる.
+
+    Parameters:
+
+    positions: numpy.ndarray
+        (原子数,3)の座標
+    cell_size: float
+        グリッドのセルの大きさ(Å).探索半径程度にすると速い
+    """
+    def __init__(self,positions,cell_size):
+        self.positions = np.asarray(positions,dtype=float)
+        self.cell_size = cell_size
+        self.origin = self.positions.min(axis=0) if len(self.positions) else np.zeros(3)
+        keys = self._keys(self.positions)
+        self.shape = keys.max(axis=0)+1 if len(keys) else np.ones(3,dtype=int)
+        flat = np.ravel_multi_index(keys.T,self.shape) if len(keys) else np.zeros(0,dtype=int)
+        # セル番号でソートし,各セルの原子をorder[start[c]:start[c+1]]で取り出せるようにする
+        self.order = np.argsort(flat,kind="stable")
+        self.start = np.searchsorted(flat[self.order],np.arange(np.prod(self.shape)+1))
+
+    def _keys(self,positions):
+        return np.floor((positions-self.origin)/self.cell_size).astype(int)
+
+    def query_box(self,lower,upper):
+        """lower~upperの直方体に重なるセルの原子のindex(候補)を返す"""
+        lo = np.clip(self._keys(np.asarray(lower,dtype=float)),0,self.shape-1)
+        hi = self._keys(np.asarray(upper,dtype=float))
+        if np.any(hi < 0) or np.any(lo > self.shape-1):
+            return np.zeros(0,dtype=int)
+        hi = np.clip(hi,0,self.shape-1)
+        grid = np.stack(np.meshgrid(*[np.arange(l,h+1) for l,h in zip(lo,hi)],indexing="ij"),axis=-1).reshape(-1,3)
+        cells = np.ravel_multi_index(grid.T,self.shape)
+        return np.concatenate([self.order[self.start[c]:self.start[c+1]] for c in cells])
+
+    def query_sphere(self,center,radius):
+        """centerから半径radius以内の原子のindexを返す"""
+        center = np.asarray(center,dtype=float)
+        candidates = self.query_box(center-radius,center+radius)
+        d = np.linalg.norm(self.positions[candidates]-center,axis=1)
+        return np.sort(candidates[d <= radius])
+
+def _bond_partners(atoms,selected,skin=0.3):
+    """selectedの原子と結合している選択外の原子のindexを返す
+    
+    | get_unique_bonds(natural_cutoffs,build_neighbor_list)と同じ基準(共有結合半径+skin)で判定する.
+    | selectedの周囲の原子のみで近接リストを作る.
+    """
+    radii = covalent_radii[atoms.numbers]+skin
+    positions = atoms.get_positions()
+    margin = 2*radii.max()
+    lower = positions[selected].min(axis=0)-margin
+    upper = positions[selected].max(axis=0)+margin
+    around = np.where(np.all((positions >= lower) & (positions <= upper),axis=1))[0]
+    is_selected = np.isin(around,selected)
+    # 選択内外の原子が隣接するセル(大きさmargin)の原子のみを残す.境界をまたぐ結合の両端は必ず残る
+    keys = np.floor((positions[around]-lower)/margin).astype(int)+1
+    shape = keys.max(axis=0)+2
+    has = np.zeros((2,)+tuple(shape),dtype=bool)
+    has[is_selected.astype(int),keys[:,0],keys[:,1],keys[:,2]] = True
+    near = np.zeros_like(has)
+    for offset in np.ndindex(3,3,3):
+        dx,dy,dz = np.array(offset)-1
+        near[:,1:-1,1:-1,1:-1] |= has[:,1+dx:shape[0]-1+dx,1+dy:shape[1]-1+dy,1+dz:shape[2]-1+dz]
+    boundary = (near[0] & near[1])[keys[:,0],keys[:,1],keys[:,2]]
+    around,is_selected = around[boundary],is_selected[boundary]
+    sub = atoms[around]
+    sub.set_pbc(False)
+    # 近接リストのビンはセルに合わせて作られるので,元のセルではなく切り出した範囲をセルにする
+    sub.set_cell(np.diag(upper-lower))
+    sub.positions -= lower
+    i,j = neighbor_list("ij",sub,radii[around].tolist(),self_interaction=False)
+    crossing = is_selected[i] & ~is_selected[j]
+    return np.unique(around[j[crossing]])
+
+def select_region(atoms,slab=None,sphere=None,near=None,cell=False,elements=None,indices=None,boundary="drop"):
+    """空間的な領域で原子を選択し,indexのリストを返す(全ての条件を満たす原子)
+
+    | 球や原子からの距離による選択はグリッドの空間インデックスで行うので,
+    | 100万原子程度の構造から一部を切り出す場合も速い.
+    | 返り値はBallAndStick等のindicesにそのまま与えられる.
+
+    Parameters:
+
+    atoms: Atoms
+        Atomsオブジェクト
+    slab: tuple
+        (zmin,zmax) z座標がこの範囲の原子
+    sphere: tuple
+        (center,radius) center(x,y,z)から半径radius(Å)以内の原子
+    near: tuple
+        (indices,distance) indicesのいずれかの原子からdistance(Å)以内の原子
+    cell: bool
+        Trueの場合,ユニットセル内(スケール座標が0以上1未満)の原子
+    elements: list of str
+        選択する元素
+    indices: list of int
+        この中から選択する
+    boundary: str
+        | 領域の境界をまたぐ結合の扱い.
+        | 'drop': 領域内の原子のみを選択する(境界をまたぐ結合は描写されない)
+        | 'extend': 領域内の原子と結合している領域外の原子も選択する(境界をまたぐ結合も描写される)
+
+    Returns:
+        list of int: 選択された原子のindex
+    """
+    if boundary not in ["drop","extend"]:
+        raise ValueError(f"boundaryは'drop'または'extend'です: {boundary}")
+    positions = atoms.get_positions()
+    mask = np.ones(len(atoms),dtype=bool)
+    if indices is not None:
+        mask[:] = False
+        mask[indices] = True
+    if slab is not None:
+        zmin,zmax = slab
+        mask &= (positions[:,2] >= zmin) & (positions[:,2] <= zmax)
+    if elements is not None:
+        mask &= np.isin(atoms.get_chemical_symbols(),elements)
+    if cell:
+        scaled = atoms.get_scaled_positions(wrap=False)
+        mask &= np.all((scaled >= 0) & (scaled < 1),axis=1)
+    grid = None
+    if sphere is not None or near is not None:
+        cell_size = max(2*covalent_radii[atoms.numbers].max(),1.0)
+        grid = GridIndex(positions,cell_size)
+    if sphere is not None:
+        center,radius = sphere
+        in_sphere = np.zeros(len(atoms),dtype=bool)
+        in_sphere[grid.query_sphere(center,radius)] = True
+        mask &= in_sphere
+    if near is not None:
+        near_indices,distance = near
+        in_range = np.zeros(len(atoms),dtype=bool)
+        for i in near_indices:
+            in_range[grid.query_sphere(positions[i],distance)] = True
+        mask &= in_range
+    selected = np.where(mask)[0]
+    if boundary == "extend" and len(selected):
+        selected = np.union1d(selected,_bond_partners(atoms,selected))
+    return selected.tolist()
@@ -4,10 +4,84 @@ from mathutils import Matrix
 import zipfile
 import pickle
 import json
+import zlib
+import lzma
+import struct
+import sys
+import time
 from pathlib import Path
 
 
 data_list = {{data_list}}
+# 全てのstyleで共有するマテリアル. {マテリアル名:{"rgba","cartoon"}}. 各styleはdata["materials"]の名前で参照する
+materials = {{materials}}
+# Animationで読み込むフレームの範囲. (500,600)または"500:600"のように指定するとその範囲のブロックのみを展開する
+# blender -b -P script.py -- --frame-range 500:600 のようにコマンドライン引数でも指定できる
+frame_range = None
+# 作成するチャンクの番号. "0-15"や"0,3,5-7"のように指定する.Noneの場合は全てのチャンク
+# blender -b -P script.py -- --chunks 0-15 --save part0.blend のようにコマンドライン引数でも指定できる
+chunks = None
+save_path = None
+if "--" in sys.argv:
+    argv = sys.argv[sys.argv.index("--")+1:]
+    if "--chunks" in argv:
+        chunks = argv[argv.index("--chunks")+1]
+    if "--save" in argv:
+        save_path = argv[argv.index("--save")+1]
+    if "--frame-range" in argv:
+        frame_range = argv[argv.index("--frame-range")+1]
+
+
+class BuildProgress():
+    """段階ごとの時間と作成したオブジェクト数を記録し,interval秒ごとに進捗を表示する
+
+    intervalがNoneの場合は表示もレポートの書き込みも行わない(記録のみ)
+    """
+    def __init__(self,interval=None):
+        self.interval = interval
+        self.phases = {}
+        self.start = self.last = time.perf_counter()
+
+    def begin(self,name,total,unit="objects"):
+        self.name,self.total,self.unit,self.done = name,total,unit,0
+        self.phase_start = time.perf_counter()
+        self.phases.setdefault(name,{"seconds":0.0,"count":0,"unit":unit})
+
+    def step(self,n=1):
+        self.done += n
+        if self.interval is None:
+            return
+        now = time.perf_counter()
+        if now-self.last >= self.interval:
+            self.last = now
+            rate = self.done/max(now-self.phase_start,1e-9)
+            print(f"{self.name}: {self.done}/{self.total} ({100*self.done/max(self.total,1):.0f}%), "
+                  f"{rate:.1f} {self.unit}/s, {now-self.start:.1f} s elapsed",flush=True)
+
+    def end(self):
+        seconds = time.perf_counter()-self.phase_start
+        phase = self.phases[self.name]
+        phase["seconds"] += seconds
+        phase["count"] += self.done
+        if self.interval is not None and self.done:
+            print(f"{self.name}: {self.done} {self.unit} in {seconds:.1f} s ({self.done/max(seconds,1e-9):.1f} {self.unit}/s)",flush=True)
+
+    def finish(self,blend_path):
+        """合計を表示し,.blendと同じ場所に{名前}_timing.jsonを書き込む(未保存の場合はカレントディレクトリ)"""
+        if self.interval is None:
+            return
+        total = time.perf_counter()-self.start
+        for phase in self.phases.values():
+            phase["per_second"] = phase["count"]/phase["seconds"] if phase["seconds"] > 0 else None
+        report = {"total_seconds":total,"phases":self.phases,"blend":blend_path or None,
+                  "blender_version":bpy.app.version_string}
+        p = Path(blend_path) if blend_path else Path.cwd()/"untitled.blend"
+        report_path = p.with_name(f"{p.stem}_timing.json")
+        with open(report_path,"w") as f:
+            json.dump(report,f,indent=2)
+        print(f"total: {total:.1f} s, report: {report_path}",flush=True)
+
+progress = BuildProgress(interval={{ progress|default(None) }})
 
 
 def delete_all_objects():
@@ -28,10 +102,10 @@ def delete_all_objects():
 {%- for data in data_list %}
 {%- if data.get("subdivision_surface",False) %}
 
-def apply_subdivision_surface(obj):
+def apply_subdivision_surface(obj, levels, render_levels):
     obj.modifiers.new("subd", type='SUBSURF')
-    obj.modifiers['subd'].levels = {{data["subdivision_surface"]["level"]}}
-    obj.modifiers['subd'].render_levels = {{data["subdivision_surface"]["render_levels"]}}
+    obj.modifiers['subd'].levels = levels
+    obj.modifiers['subd'].render_levels = render_levels
 {% break %}
 {%- endif %}
 {%- endfor %}
@@ -58,14 +132,21 @@ def rotate_object(obj,rot_mat):
 
 {%- for data in data_list %}
 {%- if not data["style"] in ["stick"] %}
-def draw_atoms(name, elements, positions, ball_sizes, subdivision_surface):
-    for i,(element, position) in enumerate(zip(elements, positions)):
-        bpy.ops.mesh.primitive_uv_sphere_add(radius=ball_sizes[element], location=position)
-        bpy.context.active_object.data.materials.append(bpy.data.materials[f"{name}{element}"])
+def draw_atoms(name, elements, positions, ball_sizes, spheres, materials, atom_ids=None):
+    """spheresは元素ごとの分割数とSubdivision Surface(data["tessellation"]["spheres"])"""
+    if atom_ids is None:
+        atom_ids = range(len(positions))
+    for i in atom_ids:
+        element, position = elements[i], positions[i]
+        sphere = spheres[element]
+        bpy.ops.mesh.primitive_uv_sphere_add(radius=ball_sizes[element], location=position,
+                                             segments=sphere["segments"], ring_count=sphere["rings"])
+        bpy.context.active_object.data.materials.append(materials[element])
         bpy.context.active_object.name = f"{name}Atom{i}{element}"
         bpy.ops.object.shade_smooth()
-        if subdivision_surface:
-            apply_subdivision_surface(bpy.context.active_object)
+        if sphere["subdivision"]:
+            apply_subdivision_surface(bpy.context.active_object, **sphere["subdivision"])
+        progress.step()
 {% break %}
 {%- endif %}
 {%- endfor %}
@@ -73,7 +154,7 @@ def draw_atoms(name, elements, positions, ball_sizes, subdivision_surface):
 {%- for data in data_list %}
 {%- if data["style"] in ["stick","ball_and_stick"]%}
 {%- if not data.get("bicolor",False)%}
-def draw_mono_color_bonds(name,bonds,positions,bond_radius):
+def draw_mono_color_bonds(name,bonds,positions,bond_radius,material,vertices):
     for atom_1, atom_2 in bonds:
         pos_1 = positions[atom_1]
         pos_2 = positions[atom_2]
@@ -89,11 +170,13 @@ def draw_mono_color_bonds(name,bonds,positions,bond_radius):
     
         bpy.ops.mesh.primitive_cylinder_add(radius=bond_radius, 
                                             depth=magnitude, 
-                                            location=center)
-        bpy.context.active_object.data.materials.append(bpy.data.materials[f'{name}bond'])
+                                            location=center,
+                                            vertices=vertices)
+        bpy.context.active_object.data.materials.append(material)
         bpy.context.active_object.name = f"{name}Bond({atom_1}-{atom_2}){i}"
         bpy.ops.object.shade_smooth()
         rotate_object(bpy.context.active_object, Matrix.Rotation(angle, 4, rotation_axis))
+        progress.step()
 {% break %}
 {%- endif %}
 {%- endif %}
@@ -102,53 +185,56 @@ def draw_mono_color_bonds(name,bonds,positions,bond_radius):
 {%- for data in data_list %}
 {%- if data["style"] in ["stick","ball_and_stick"]%}
 {%- if data.get("bicolor",False)%}
-def draw_bicolor_bonds(bonds,positions,elements,bond_radius,half):
+def split_cylinder(radius,length,ratio,direction,vertices=32):
+    """中心が原点でdirection方向の長さlengthの円柱の(頂点,面,面のマテリアル番号)
+
+    側面はratioの位置で分割し,始点側の面を0,終点側の面を1とする
+    """
+    u = np.cross(direction,(1.0,0.0,0.0) if abs(direction[0]) < 0.9 else (0.0,1.0,0.0))
+    u = u/np.linalg.norm(u)
+    v = np.cross(direction,u)
+    theta = 2*np.pi*np.arange(vertices)/vertices
+    ring = radius*(np.outer(np.cos(theta),u)+np.outer(np.sin(theta),v))
+    verts = np.concatenate([ring+direction*length*(t-0.5) for t in (0.0,ratio,1.0)])
+    k = np.arange(vertices)
+    side = np.stack([k,(k+1)%vertices,(k+1)%vertices+vertices,k+vertices],axis=1)
+    faces = np.concatenate([side,side+vertices]).tolist()+[k[::-1].tolist(),(k+2*vertices).tolist()]
+    material_index = [0]*vertices+[1]*vertices+[0,1]
+    return verts.tolist(),faces,material_index
+
+def draw_bicolor_bonds(name,bonds,positions,elements,bond_radius,ball_sizes,materials,vertices):
+    """1つの結合を2つのマテリアルを持つ1つのオブジェクトとして作成する
+
+    ball_sizesがNoneの場合は結合の中点で,それ以外は球の表面間の中点で色を分ける
+    """
+    collection = bpy.context.view_layer.active_layer_collection.collection
     for atom_1, atom_2 in bonds:
         pos_1 = positions[atom_1]
         pos_2 = positions[atom_2]
         elements_1 = elements[atom_1]
         elements_2 = elements[atom_2]
-        
-        if half:
-            difference = pos_2 - pos_1
-            position_1 = (pos_2*1 + pos_1*3) / 4
-            position_2 = (pos_2*3 + pos_1*1) / 4
-            magnitude1 = distance(pos_1, pos_2)/2
-            magnitude2 = magnitude1
+        d = distance(pos_1, pos_2)
+        if ball_sizes is None:
+            ratio = 0.5
         else:
             size_1 = ball_sizes[elements_1]
-            size_2 =  ball_sizes[elements_2]
-            difference = pos_2 - pos_1
-            d = distance(pos_1, pos_2)
-            l = (d- size_1 - size_2)/2
-            ratio_1 = (size_1+l)/d
-            ratio_2 = (size_2+l)/d
-            position_1 = (pos_2*(ratio_1*0.5) + pos_1*(1-(ratio_1*0.5)))
-            position_2 = (pos_2*(1-(ratio_2*0.5)) + pos_1*(ratio_2*0.5))
-            magnitude1 = d*ratio_1
-            magnitude2 = d*ratio_2
-
-                
-        bond_direction = normalize(difference)
-        vertical = np.array((0.0, 0.0, 1.0))
-        rotation_axis = np.cross(bond_direction, vertical)
-        angle = -np.arccos(np.dot(bond_direction, vertical))
-    
-        bpy.ops.mesh.primitive_cylinder_add(radius=bond_radius, 
-                                            depth=magnitude1, 
-                                            location=position_1)
-        bpy.context.active_object.data.materials.append(bpy.data.materials[f"{name}{elements_1}"])
-        bpy.context.active_object.name = f"{name}Bond({atom_1}-{atom_2}){i}"
-        bpy.ops.object.shade_smooth()
-        rotate_object(bpy.context.active_object, Matrix.Rotation(angle, 4, rotation_axis))
-        
-        bpy.ops.mesh.primitive_cylinder_add(radius=bond_radius, 
-                                            depth=magnitude2, 
-                                            location=position_2)                                            
-        bpy.context.active_object.data.materials.append(bpy.data.materials[f"{name}{elements_2}"])
-        bpy.context.active_object.name = f"{name}Bond({atom_2}-{atom_1}){i}"
-        bpy.ops.object.shade_smooth()
-        rotate_object(bpy.context.active_object, Matrix.Rotation(angle, 4, rotation_axis))
+            size_2 = ball_sizes[elements_2]
+            l = (d - size_1 - size_2)/2
+            ratio = (size_1+l)/d
+
+        verts,faces,material_index = split_cylinder(bond_radius,d,ratio,normalize(pos_2 - pos_1),vertices)
+        obj_name = f"{name}Bond({atom_1}-{atom_2})"
+        mesh = bpy.data.meshes.new(obj_name)
+        mesh.from_pydata(verts,[],faces)
+        mesh.materials.append(materials[elements_1])
+        mesh.materials.append(materials[elements_2])
+        mesh.polygons.foreach_set("material_index",material_index)
+        mesh.polygons.foreach_set("use_smooth",[True]*len(faces))
+        mesh.update()
+        obj = bpy.data.objects.new(obj_name,mesh)
+        obj.location = (pos_1 + pos_2) / 2.0
+        collection.objects.link(obj)
+        progress.step()
 {% break %}
 {%- endif %}
 {%- endif %}
@@ -162,12 +248,103 @@ def add_keyflame(name,frame_num,step,positions,chemical_symbols):
         obj = bpy.data.objects[f"{name}Atom{i}{element}"]
         obj.location = position
         obj.keyframe_insert(data_path = 'location',index = -1)
+    progress.step()
     frame_num += step
     return frame_num
 {% break %}
 {%- endif %}
 {%- endfor %}
 
+{%- for data in data_list %}
+{%- if data["style"] =="animation" and data["playback"] == "handler" %}
+# 再生時に座標を読み込むハンドラー.Textデータブロックに書き込みuse_moduleにすることで,.blendを開いた時にも登録される
+PLAYBACK_HANDLER = """import bpy
+import numpy as np
+from bpy.app.handlers import persistent
+
+def register_playback_handler(name,path,dtype,n_atoms,columns,chemical_symbols,start,step,interpolate):
+    positions = np.memmap(path,dtype=dtype,mode="r").reshape(-1,n_atoms,3)
+    names = [f"{name}Atom{i}{element}" for i,element in enumerate(chemical_symbols)]
+    handler_name = f"mk_blender_scr_playback_{name}"
+    def get_frame(k):
+        return positions[k] if columns is None else positions[k][columns]
+    def update_positions(scene,depsgraph=None):
+        t = min(max((scene.frame_current-start)/step,0),len(positions)-1)
+        k = int(t)
+        if interpolate and k+1 < len(positions):
+            frame_positions = (1-(t-k))*get_frame(k)+(t-k)*get_frame(k+1)
+        else:
+            frame_positions = get_frame(k)
+        for obj_name,position in zip(names,frame_positions):
+            obj = bpy.data.objects.get(obj_name)
+            if obj is not None:
+                obj.location = position
+    update_positions.__name__ = handler_name
+    handlers = bpy.app.handlers.frame_change_pre
+    for handler in [h for h in handlers if getattr(h,"__name__","") == handler_name]:
+        handlers.remove(handler)
+    handlers.append(persistent(update_positions))
+"""
+
+def add_playback_handler(name,path,dtype,n_atoms,columns,chemical_symbols,start,step,interpolate):
+    text_name = "mk_blender_scr_playback.py"
+    text = bpy.data.texts.get(text_name)
+    if text is None:
+        text = bpy.data.texts.new(text_name)
+        text.write(PLAYBACK_HANDLER)
+    call = (f"register_playback_handler({name!r},{path!r},{dtype!r},{n_atoms},{columns!r},{chemical_symbols!r},"
+            f"{start},{step},{interpolate})\n")
+    if call not in text.as_string():
+        text.write(call)
+    text.use_module = True
+    exec(PLAYBACK_HANDLER+call,{})
+{% break %}
+{%- endif %}
+{%- endfor %}
+
+{%- for data in data_list %}
+{%- if data.get("repeat") %}
+def add_collection_instances(col,cell,repeat):
+    """colをセルベクトルずつずらしたコレクションインスタンスとして並べる.(0,0,0)はcol自身"""
+    cell = np.array(cell)
+    for a in range(repeat[0]):
+        for b in range(repeat[1]):
+            for c in range(repeat[2]):
+                if a == b == c == 0:
+                    continue
+                inst = bpy.data.objects.new(f"{col.name}({a},{b},{c})",None)
+                inst.instance_type = 'COLLECTION'
+                inst.instance_collection = col
+                inst.location = np.dot((a,b,c),cell)
+                bpy.context.view_layer.active_layer_collection.collection.objects.link(inst)
+                progress.step()
+{% break %}
+{%- endif %}
+{%- endfor %}
+
+def parse_chunks(text):
+    selected = set()
+    for part in str(text).split(","):
+        if "-" in part:
+            first,last = part.split("-")
+            selected.update(range(int(first),int(last)+1))
+        else:
+            selected.add(int(part))
+    return selected
+
+def use_collection(name):
+    """コレクションを作成(既にあれば再利用)し,以降に追加するオブジェクトの追加先にする.Noneの場合はシーンのコレクション"""
+    view_layer = bpy.context.view_layer
+    if name is None:
+        view_layer.active_layer_collection = view_layer.layer_collection
+        return
+    col = bpy.data.collections.get(name)
+    if col is None:
+        col = bpy.data.collections.new(name)
+    if col.name not in bpy.context.scene.collection.children:
+        bpy.context.scene.collection.children.link(col)
+    view_layer.active_layer_collection = view_layer.layer_collection.children[col.name]
+
 def register_materials(name,rgba,cartoon):
     mat = bpy.data.materials.new(name=name)
     mat.use_nodes = True
@@ -185,52 +362,145 @@ def register_materials(name,rgba,cartoon):
         mat.node_tree.links.new(snmr.outputs[0], bsdf.inputs[0])
     else:
         bsdf.inputs[0].default_value = rgba
+    return mat
+
+def decode_positions(path,frame_range=None):
+    """mk_blender_scr.blender.encodingでエンコードした座標を(フレーム数,原子数,3)の配列に戻す
+    
+    frame_rangeを含むブロックのみを展開する.(座標,開始フレーム)を返す.
+    frame_rangeは(first,last)または"first:last"(省略した側は先頭/末尾)で,0 <= first < last <= フレーム数.
+    """
+    with open(path,"rb") as f:
+        f.read(8) # MAGIC
+        # ヘッダー(ブロック表)はファイルの末尾.最後の4バイトがヘッダーのバイト数
+        f.seek(-4,2)
+        n = struct.unpack("<I",f.read(4))[0]
+        f.seek(-4-n,2)
+        header = json.loads(f.read(n))
+        data_start = 8
+        n_frames = header["n_frames"]
+        if frame_range is None:
+            first,last = 0,n_frames
+        elif isinstance(frame_range,str):
+            first,_,last = frame_range.partition(":")
+            first,last = int(first or 0),int(last or n_frames)
+        else:
+            first,last = frame_range
+        if not 0 <= first < last <= n_frames:
+            raise ValueError(f"frame_range({frame_range})は0 <= first < last <= {n_frames}の範囲で指定してください")
+        positions = []
+        for block in header["blocks"]:
+            if block["frame"]+block["n_frames"] <= first or block["frame"] >= last:
+                continue
+            f.seek(data_start+block["byte_offset"])
+            data = f.read(block["nbytes"])
+            if header["compression"] == "zlib":
+                data = zlib.decompress(data)
+            elif header["compression"] == "lzma":
+                data = lzma.decompress(data)
+            q = np.frombuffer(data,dtype=header["dtype"]).reshape(block["n_frames"],header["n_atoms"],3)
+            if header["delta"]:
+                q = np.cumsum(q,axis=0,dtype=header["dtype"])
+            if header["dtype"] in ["int16","int32"]:
+                q = (q.astype(np.float64)-block["offset"])*np.array(block["scale"])+np.array(block["origin"])
+            positions.append(q[max(first-block["frame"],0):last-block["frame"]])
+    return np.concatenate(positions).astype(np.float64),first
 
 delete_all_objects()
+progress.begin("materials",len(materials),unit="materials")
+for mat_name,params in materials.items():
+    materials[mat_name] = register_materials(mat_name,params["rgba"],cartoon=params["cartoon"])
+    progress.step()
+progress.end()
 for i,data in enumerate(data_list):
     name = "" if len(data_list)==1 else f"{i}_"
-    for symb,rgba in data["colors"].items():
-        register_materials(f"{name}{symb}",rgba,cartoon=data["cartoon"])
+    style_materials = {symb:materials[mat_name] for symb,mat_name in data["materials"].items()}
+    # 球と円柱の分割数(createのpolygon_budgetで選ばれたもの)
+    tessellation = data["tessellation"]
         
     if data["style"] == "animation":
         ball_sizes = {symb:data["scale"]*size for symb,size in data["sizes"].items()}
         step = data["step"]
         start = data["start"]
-        frame_num = start
         p = Path(bpy.data.filepath)
-        pkl_path = str(p.with_name(data["file"]).resolve())
-        with open(pkl_path,"rb") as f:
-            positions = pickle.load(f)
-            ball_sizes = {symb:data["scale"]*size for symb,size in data["sizes"].items()}
-            subdivision_surface = data["subdivision_surface"]["apply"]
-            draw_atoms(name,data["chemical_symbols"],np.array(positions),ball_sizes,subdivision_surface)
-            frame_num = add_keyflame(name,frame_num,step,positions,data["chemical_symbols"])
-            while True:
-                try:
-                    positions = pickle.load(f)
-                    frame_num = add_keyflame(name,frame_num,step,positions,data["chemical_symbols"])
-                except EOFError:
-                    break
+        # 座標ファイルは同じトラジェクトリの他のAnimationと共有している場合がある.columnsは自分の原子の列
+        columns = data["columns"]
+        if data["playback"] == "handler":
+            raw_path = str(p.with_name(data["file"]).resolve())
+            # 座標ファイルの原子数(共有している場合は全てのAnimationの原子の数)
+            n_atoms = data["n_file_atoms"]
+            positions = np.memmap(raw_path,dtype=data["dtype"],mode="r").reshape(-1,n_atoms,3)
+            first_positions = positions[0] if columns is None else positions[0][columns]
+            progress.begin("atoms",len(data["chemical_symbols"]))
+            draw_atoms(name,data["chemical_symbols"],first_positions,ball_sizes,tessellation["spheres"],style_materials)
+            progress.end()
+            add_playback_handler(name,raw_path,data["dtype"],n_atoms,columns,data["chemical_symbols"],
+                                 start,step,data["interpolate"])
+            continue
+        bin_path = str(p.with_name(data["file"]).resolve())
+        positions,first_frame = decode_positions(bin_path,frame_range)
+        if columns is not None:
+            positions = positions[:,columns]
+        frame_num = start+first_frame*step
+        progress.begin("atoms",len(data["chemical_symbols"]))
+        draw_atoms(name,data["chemical_symbols"],positions[0],ball_sizes,tessellation["spheres"],style_materials)
+        progress.end()
+        progress.begin("keyframes",len(positions),unit="frames")
+        for frame_positions in positions:
+            frame_num = add_keyflame(name,frame_num,step,frame_positions,data["chemical_symbols"])
+        progress.end()
         continue
     
-    if "stick_color" in data.keys():
-        register_materials(f"{name}bond",rgba=data["stick_color"],cartoon=data["cartoon"])
-    
     positions = np.array(data["positions"])
-    if data["style"] in ["ball_and_stick","space_filling","animation"]:
-        ball_sizes = {symb:data["scale"]*size for symb,size in data["sizes"].items()}
-        subdivision_surface = data["subdivision_surface"]["apply"]
-        draw_atoms(name,data["chemical_symbols"],positions,ball_sizes,subdivision_surface)
-    if data["style"] in ["stick","ball_and_stick"]:
-        if data["bicolor"]:
-            half = True if data["style"] == "stick" else False
-            draw_bicolor_bonds(data["bonds"],positions,data["chemical_symbols"],data["radius"],half=half)
-        else:
-            draw_mono_color_bonds(name,data["bonds"],positions,data["radius"])
-
-        
-
-        
-    
-
+    symbols = data["chemical_symbols"]
+    atom_chunks = np.array(data.get("chunks") or [0]*len(positions),dtype=int)
+    if data.get("repeat"):
+        # 周期境界をまたぐ結合の相手(隣のセルの原子).球は作らず結合の端点にのみ使う
+        positions = np.concatenate([positions,np.array(data["image_positions"]).reshape(-1,3)])
+        symbols = symbols+[symbols[j] for j in data["image_atoms"]]
+        use_collection(f"{name}unit_cell")
+    bonds = np.array(data.get("bonds",[]),dtype=int).reshape(-1,2)
+    # 境界をまたぐ結合はindexの小さい原子のチャンクで作成する
+    bond_chunks = atom_chunks[bonds.min(axis=1)] if len(bonds) else np.zeros(0,dtype=int)
+    chunk_ids = [c for c in np.unique(atom_chunks) if chunks is None or c in parse_chunks(chunks)]
+    for k,c in enumerate(chunk_ids):
+        t = time.perf_counter()
+        if data.get("chunks") is not None:
+            use_collection(f"{name}chunk{c}")
+        atom_ids = np.where(atom_chunks == c)[0]
+        chunk_bonds = [tuple(bond) for bond in bonds[bond_chunks == c]]
+        n_drawn_atoms = 0
+        if data["style"] in ["ball_and_stick","space_filling","animation"]:
+            ball_sizes = {symb:data["scale"]*size for symb,size in data["sizes"].items()}
+            progress.begin("atoms",len(atom_ids))
+            draw_atoms(name,data["chemical_symbols"],positions,ball_sizes,tessellation["spheres"],style_materials,atom_ids)
+            progress.end()
+            n_drawn_atoms = len(atom_ids)
+        if data["style"] in ["stick","ball_and_stick"]:
+            progress.begin("bonds",len(chunk_bonds))
+            if data["bicolor"]:
+                # stickは結合の中点で色を分ける
+                bond_ball_sizes = None if data["style"] == "stick" else ball_sizes
+                draw_bicolor_bonds(name,chunk_bonds,positions,symbols,data["radius"],
+                                   bond_ball_sizes,style_materials,tessellation["cylinder_vertices"])
+            else:
+                draw_mono_color_bonds(name,chunk_bonds,positions,data["radius"],style_materials["bond"],
+                                      tessellation["cylinder_vertices"])
+            progress.end()
+        # チャンクに分けた場合または進捗を表示する場合のみ,チャンク毎に作成した球と結合の数を表示する
+        if len(chunk_ids) > 1 or progress.interval is not None:
+            print(f"{name}chunk{c} ({k+1}/{len(chunk_ids)}): {n_drawn_atoms} atoms, {len(chunk_bonds)} bonds, "
+                  f"{time.perf_counter()-t:.1f} s",flush=True)
+    use_collection(None)
+    if data.get("repeat"):
+        a,b,c = data["repeat"]
+        progress.begin("instances",a*b*c-1)
+        add_collection_instances(bpy.data.collections[f"{name}unit_cell"],data["cell"],data["repeat"])
+        progress.end()
 
+if save_path is not None:
+    progress.begin("save",1,unit="files")
+    bpy.ops.wm.save_as_mainfile(filepath=save_path)
+    progress.step()
+    progress.end()
+progress.finish(save_path or bpy.data.filepath)
@@ -0,0 +1,180 @@
+import warnings
+from collections import Counter
+import numpy as np
+
+from mk_blender_scr.blender import default
+
+# polygon_budgetで選ぶ分割数の範囲
+MIN_SEGMENTS = 8
+MAX_SEGMENTS = 64
+MIN_CYLINDER_VERTICES = 8
+SIZE_KEYS = ["vertices","faces","render_vertices","render_faces"]
+
+def uv_sphere_size(segments=default.sphere_segments,rings=default.sphere_rings):
+    """primitive_uv_sphere_addのメッシュの(頂点数,面の辺数毎の面数({辺数:面数}))"""
+    return segments*(rings-1)+2,{3:2*segments,4:segments*(rings-2)}
+
+def cylinder_size(vertices=default.cylinder_vertices):
+    """primitive_cylinder_addのメッシュの(頂点数,面の辺数毎の面数({辺数:面数}))"""
+    return 2*vertices,{4:vertices,vertices:2}
+
+def split_cylinder_size(vertices=default.cylinder_vertices):
+    """bicolorの結合(側面を2色に分けた円柱,テンプレートのsplit_cylinder)の(頂点数,面の辺数毎の面数)"""
+    return 3*vertices,{4:2*vertices,vertices:2}
+
+def subdivided_size(n_vertices,faces,level):
+    """Subdivision Surface(Catmull-Clark)をlevel回適用した後の(頂点数,面数)
+
+    | 1回目でn角形はn個の四角形になり,以降は4倍になる.
+    | 閉じた球面と同相のメッシュでは四角形のみの場合,頂点数=面数+2となる.
+    """
+    if level <= 0:
+        return n_vertices,sum(faces.values())
+    n_faces = sum(sides*count for sides,count in faces.items())*4**(level-1)
+    return n_faces+2,n_faces
+
+def default_tessellation(data):
+    """polygon_budgetを指定しない場合の分割数(Blenderのデフォルトとstyleのsubdivision_surface)"""
+    subdivision_surface = data.get("subdivision_surface",default.subdivision_surface)
+    subdivision = None
+    if subdivision_surface["apply"]:
+        subdivision = {"levels":subdivision_surface["level"],"render_levels":subdivision_surface["render_levels"]}
+    spheres = {symb:{"segments":default.sphere_segments,"rings":default.sphere_rings,"subdivision":subdivision}
+               for symb in _sphere_radii(data)}
+    return {"spheres":spheres,"cylinder_vertices":default.cylinder_vertices}
+
+def _sphere_radii(data):
+    if data["style"] == "stick":
+        return {}
+    return {symb:data["scale"]*data["sizes"][symb] for symb in sorted(set(data["chemical_symbols"]))}
+
+def _divisions(detail,radius,minimum,maximum=MAX_SEGMENTS):
+    """輪郭の誤差(r(1-cos(π/n)))がほぼ一定になるように,分割数を半径の平方根に比例させる(偶数)"""
+    return int(min(max(2*round(detail*np.sqrt(radius)/2),minimum),maximum))
+
+def _max_level(data):
+    subdivision_surface = data.get("subdivision_surface",default.subdivision_surface)
+    return subdivision_surface["level"] if subdivision_surface["apply"] else 0
+
+def _sphere(segments,subdivision_surface):
+    """segments相当(Subdivision Surface適用後)の細かさの球
+
+    | Subdivision Surfaceを適用するstyleでは,1レベル毎に元の球の分割数を半分にし,
+    | 元の分割数がMIN_SEGMENTSを下回る場合はlevelを下げる(render_levelsも同じだけ下げる).
+    | 元の球の分割数の上限はMAX_SEGMENTSなので,segmentsはMAX_SEGMENTS*2**levelまで選べる.
+    """
+    if not subdivision_surface["apply"]:
+        return {"segments":segments,"rings":segments//2,"subdivision":None}
+    level = subdivision_surface["level"]
+    while level > 0 and segments/2**level < MIN_SEGMENTS:
+        level -= 1
+    base = min(max(2*round(segments/2**level/2),MIN_SEGMENTS),MAX_SEGMENTS)
+    render_levels = max(subdivision_surface["render_levels"]-(subdivision_surface["level"]-level),level)
+    return {"segments":base,"rings":base//2,"subdivision":{"levels":level,"render_levels":render_levels}}
+
+def _at_least(sphere,floor):
+    """球の分割数とSubdivision Surfaceのlevelをfloor(デフォルトの分割数)以上にする"""
+    subdivision = sphere["subdivision"]
+    if floor["subdivision"] is not None:
+        subdivision = {key:max(subdivision[key],floor["subdivision"][key]) for key in ["levels","render_levels"]}
+    return {"segments":max(sphere["segments"],floor["segments"]),"rings":max(sphere["rings"],floor["rings"]),
+            "subdivision":subdivision}
+
+def _tessellation(data,detail,floor=None):
+    subdivision_surface = data.get("subdivision_surface",default.subdivision_surface)
+    maximum = MAX_SEGMENTS*2**_max_level(data)
+    spheres = {symb:_sphere(_divisions(detail,radius,MIN_SEGMENTS,maximum),subdivision_surface)
+               for symb,radius in _sphere_radii(data).items()}
+    cylinder_vertices = _divisions(detail,data.get("radius",default.radius),MIN_CYLINDER_VERTICES)
+    if floor is not None:
+        spheres = {symb:_at_least(sphere,floor["spheres"][symb]) for symb,sphere in spheres.items()}
+        cylinder_vertices = max(cylinder_vertices,floor["cylinder_vertices"])
+    return {"spheres":spheres,"cylinder_vertices":cylinder_vertices}
+
+def count_elements(data):
+    """styleで作成する球の元素ごとの数と結合の数"""
+    symbols = {} if data["style"] == "stick" else Counter(data["chemical_symbols"])
+    n_bonds = len(data.get("bonds",[])) if data["style"] in ["stick","ball_and_stick"] else 0
+    return symbols,n_bonds
+
+def style_size(data,counts=None):
+    """styleのdata["tessellation"]の分割数でのメッシュの頂点数と面数(Subdivision Surfaceのlevels,render_levelsを含む)
+
+    | repeatを指定したstyleでは,コレクションインスタンスも含めた表示される合計.
+
+    Returns:
+        dict: {"vertices","faces","render_vertices","render_faces"}
+    """
+    symbols,n_bonds = count_elements(data) if counts is None else counts
+    tessellation = data.get("tessellation") or default_tessellation(data)
+    size = dict.fromkeys(SIZE_KEYS,0)
+    for symb,n in symbols.items():
+        sphere = tessellation["spheres"][symb]
+        mesh = uv_sphere_size(sphere["segments"],sphere["rings"])
+        subdivision = sphere["subdivision"] or {"levels":0,"render_levels":0}
+        vertices,faces = subdivided_size(*mesh,subdivision["levels"])
+        render_vertices,render_faces = subdivided_size(*mesh,subdivision["render_levels"])
+        for key,value in zip(SIZE_KEYS,[vertices,faces,render_vertices,render_faces]):
+            size[key] += n*value
+    if n_bonds:
+        cylinder = split_cylinder_size if data.get("bicolor",False) else cylinder_size
+        vertices,faces = subdivided_size(*cylinder(tessellation["cylinder_vertices"]),0)
+        for key,value in zip(SIZE_KEYS,[vertices,faces,vertices,faces]):
+            size[key] += n_bonds*value
+    n_cells = int(np.prod(data.get("repeat",[1,1,1])))
+    return {key:n_cells*value for key,value in size.items()}
+
+def set_tessellation(data_list,polygon_budget=None):
+    """各styleの辞書に球と円柱の分割数を'tessellation'として追加する
+
+    | polygon_budgetを与えた場合,全てのstyleの合計の面数(viewport,Subdivision Surfaceのlevelsを含む)が
+    | polygon_budget以下で最も細かくなる分割数を選ぶ.
+    | 分割数は元素(球の半径)毎に,半径の平方根に比例させ,MIN_SEGMENTSからMAX_SEGMENTSの範囲で選ぶ.
+    | Subdivision Surfaceを適用するstyleでは,細かさを保ったまま球の分割数とlevelを下げる
+    | (元の球の分割数がMAX_SEGMENTSまでなので,適用後の細かさはMAX_SEGMENTS*2**levelまで).
+    | デフォルトの分割数(polygon_budget=None)で上限に収まる場合は,それより粗くはしない.
+    | 原子数が少ない場合は最大の分割数,多い場合は粗くなる.最小の分割数でも上限を超える場合は警告を出す.
+
+    Parameters:
+
+    data_list: list of dict
+        styleのtodictの結果のリスト
+    polygon_budget: int
+        面数の上限.Noneの場合はBlenderのデフォルトの分割数(球32x16,円柱32)とstyleのsubdivision_surface
+
+    Returns:
+        list of dict: styleごとの分割数. {"spheres":{元素:{"segments","rings","subdivision"}},"cylinder_vertices"}
+    """
+    if polygon_budget is None:
+        for data in data_list:
+            data["tessellation"] = default_tessellation(data)
+        return [data["tessellation"] for data in data_list]
+    counts = [count_elements(data) for data in data_list]
+    floors = [default_tessellation(data) for data in data_list]
+    def faces():
+        return sum(style_size(data,c)["faces"] for data,c in zip(data_list,counts))
+    for data,floor in zip(data_list,floors):
+        data["tessellation"] = floor
+    if faces() > polygon_budget:
+        # デフォルトの分割数で上限を超える場合のみ,デフォルトより粗くできる
+        floors = [None]*len(data_list)
+    def total_faces(detail):
+        for data,floor in zip(data_list,floors):
+            data["tessellation"] = _tessellation(data,detail,floor)
+        return faces()
+    radii = [radius for data in data_list for radius in _sphere_radii(data).values()]
+    radii += [data.get("radius",default.radius) for data,(_,n_bonds) in zip(data_list,counts) if n_bonds]
+    max_level = max((_max_level(data) for data in data_list),default=0)
+    low,high = 0.0,MAX_SEGMENTS*2**max_level/np.sqrt(min(radii,default=1.0))
+    if total_faces(high) > polygon_budget:
+        if total_faces(low) > polygon_budget:
+            warnings.warn(f"最小の分割数でも面数({total_faces(low)})がpolygon_budget({polygon_budget})を超えています")
+        else:
+            for _ in range(30):
+                middle = (low+high)/2
+                if total_faces(middle) <= polygon_budget:
+                    low = middle
+                else:
+                    high = middle
+        total_faces(low)
+    return [data["tessellation"] for data in data_list]
@@ -1,10 +1,79 @@
 import click
+import sys
+import functools
 from ase.io import read,Trajectory,iread
 from pathlib import Path
 
 from mk_blender_scr.blender.make_script import create, BallAndStick, Stick, SpaceFilling, Animation
+from mk_blender_scr.blender.region import select_region
+from mk_blender_scr.blender.functions import parsestr2list
+from mk_blender_scr.blender.profiling import Profiler
 import mk_blender_scr.blender.default as default
 
+def region_options(func):
+    """原子の選択(indicesと空間的な領域)のオプション"""
+    options = [
+        click.option('-i','--indices',default=None,help="表示する原子のindex. '0-10,23,25-26'のように指定"),
+        click.option('--slab',default=None,help="z座標の範囲. 'zmin,zmax'のように指定"),
+        click.option('--sphere',default=None,help="球の中心と半径. 'x,y,z,r'のように指定"),
+        click.option('--near',default=None,help="指定した原子からの距離. '0-10:3.0'のように'index:距離'で指定"),
+        click.option('--cell',is_flag=True,default=False,help="ユニットセル内の原子のみ"),
+        click.option('--elements',default=None,help="表示する元素. 'C,H'のように指定"),
+        click.option('--boundary',type=click.Choice(["drop","extend"]),default="drop",
+                     help="extendの場合,領域内の原子と結合している領域外の原子も表示する"),
+    ]
+    for option in reversed(options):
+        func = option(func)
+    return func
+
+def profile_options(func):
+    """--profile,--profile-jsonのオプション.指定した場合,styleの作成からスクリプトの書き込みまでを計測する"""
+    @click.option('--profile',is_flag=True,default=False,help="段階ごとの時間,ピークメモリ,件数を標準エラーに表示する")
+    @click.option('--profile-json',default=None,help="計測結果を1行のJSONとして追記するファイル")
+    @functools.wraps(func)
+    def wrapper(*args,profile,profile_json,**kwargs):
+        if not profile and profile_json is None:
+            return func(*args,**kwargs)
+        with Profiler() as profiler:
+            result = func(*args,**kwargs)
+        if profile:
+            profiler.print_summary()
+        if profile_json is not None:
+            profiler.dump(profile_json,command=click.get_current_context().info_name)
+        return result
+    return wrapper
+
+def write_output(outfile,style,progress=None,polygon_budget=None):
+    """outfileの拡張子が.glb,.plyの場合はメッシュを直接出力し,それ以外はスクリプトを作成する"""
+    if Path(outfile).suffix.lower() in [".glb",".ply"]:
+        from mk_blender_scr.blender.mesh_export import export_mesh
+        report = export_mesh(outfile,style)
+        click.echo(", ".join(f"{k}={v}" for k,v in report.items()))
+        return
+    return create(outfile,style,progress=progress,polygon_budget=polygon_budget)
+
+def has_region(slab,sphere,near,cell,elements):
+    """空間的な領域または元素のオプションが指定されているか(指定されている場合のみ原子の座標が必要)"""
+    return slab is not None or sphere is not None or near is not None or cell or elements is not None
+
+def get_indices(atoms,indices,slab,sphere,near,cell,elements,boundary):
+    """オプションから表示する原子のindexを得る.何も指定されていない場合はNone"""
+    indices = parsestr2list(indices) if indices else None
+    if not has_region(slab,sphere,near,cell,elements):
+        return indices
+    if slab is not None:
+        slab = [float(v) for v in slab.split(",")]
+    if sphere is not None:
+        *center,radius = [float(v) for v in sphere.split(",")]
+        sphere = (center,radius)
+    if near is not None:
+        near_indices,distance = near.split(":")
+        near = (parsestr2list(near_indices),float(distance))
+    if elements is not None:
+        elements = elements.split(",")
+    return select_region(atoms,slab=slab,sphere=sphere,near=near,cell=cell,elements=elements,
+                         indices=indices,boundary=boundary)
+
 @click.group()
 def main():
     pass
@@ -23,14 +92,21 @@ def document():
 @click.option('-b','--bicolor',type=bool,default=default.bicolor)
 @click.option('-c','--cartoon',type=bool,default=False)
 @click.option('-r','--radius',type=float,default=default.radius)
-@click.option('-i','--indices',type=int,default=None)
+@region_options
+@profile_options
+@click.option('--progress',type=float,default=None,help="Blenderでの実行中にこの間隔(秒)で進捗を表示し,.blendの横に時間のレポート(JSON)を書き込む")
+@click.option('--polygon-budget',type=int,default=None,help="合計の面数の目安.与えた場合,球と円柱の分割数を面数に合わせて選ぶ")
+@click.option('--repeat',default=None,help="ユニットセルを並べる数. '3,3,2'のように指定(コレクションインスタンスで並べる)")
 @click.option('-s','--scale',type=float,default=default.scale)
 @click.option('-ss','--subdivision_surface',type=bool,default=False)
-def ball_and_stick(file,format,outfile,bicolor,cartoon,radius,indices,scale,):
+def ball_and_stick(file,format,outfile,bicolor,cartoon,radius,scale,subdivision_surface,progress,polygon_budget,repeat,
+                   indices,slab,sphere,near,cell,elements,boundary):
     atoms = read(file,format=format)
+    indices = get_indices(atoms,indices,slab,sphere,near,cell,elements,boundary)
     cartoon = {"apply":cartoon}
     subdivision_surface = {"apply":subdivision_surface}
-    pyscript = create(
+    repeat = [int(n) for n in repeat.split(",")] if repeat else None
+    pyscript = write_output(
         outfile,
         BallAndStick(
             atoms,
@@ -39,7 +115,10 @@ def ball_and_stick(file,format,outfile,bicolor,cartoon,radius,indices,scale,):
             radius=radius,
             indices=indices,
             scale=scale,
-            subdivision_surface=subdivision_surface))
+            subdivision_surface=subdivision_surface,
+            repeat=repeat),
+        progress=progress,
+        polygon_budget=polygon_budget)
     if outfile == "-":
         print(pyscript)
 
@@ -50,13 +129,20 @@ def ball_and_stick(file,format,outfile,bicolor,cartoon,radius,indices,scale,):
 @click.option('-b','--bicolor',type=bool,default=default.bicolor)
 @click.option('-c','--cartoon',type=bool,default=False)
 @click.option('-r','--radius',type=float,default=default.radius)
-@click.option('-i','--indices',type=int,default=None)
+@region_options
+@profile_options
+@click.option('--progress',type=float,default=None,help="Blenderでの実行中にこの間隔(秒)で進捗を表示し,.blendの横に時間のレポート(JSON)を書き込む")
+@click.option('--polygon-budget',type=int,default=None,help="合計の面数の目安.与えた場合,球と円柱の分割数を面数に合わせて選ぶ")
+@click.option('--repeat',default=None,help="ユニットセルを並べる数. '3,3,2'のように指定(コレクションインスタンスで並べる)")
 @click.option('-ss','--subdivision_surface',type=bool,default=False)
-def stick(file,format,outfile,bicolor,cartoon,radius,indices,subdivision_surface):
+def stick(file,format,outfile,bicolor,cartoon,radius,subdivision_surface,progress,polygon_budget,repeat,
+          indices,slab,sphere,near,cell,elements,boundary):
     atoms = read(file,format=format)
+    indices = get_indices(atoms,indices,slab,sphere,near,cell,elements,boundary)
     cartoon = {"apply":cartoon}
     subdivision_surface = {"apply":subdivision_surface}
-    pyscript = create(
+    repeat = [int(n) for n in repeat.split(",")] if repeat else None
+    pyscript = write_output(
         outfile,
         Stick(
             atoms,
@@ -64,7 +150,10 @@ def stick(file,format,outfile,bicolor,cartoon,radius,indices,subdivision_surface
             cartoon=cartoon,
             radius=radius,
             subdivision_surface=subdivision_surface,
-            indices=indices))
+            indices=indices,
+            repeat=repeat),
+        progress=progress,
+        polygon_budget=polygon_budget)
     if outfile == "-":
         print(pyscript)
     
@@ -73,14 +162,21 @@ def stick(file,format,outfile,bicolor,cartoon,radius,indices,subdivision_surface
 @click.option('-f','--format',default=None)
 @click.option('-o','--outfile',default="-")
 @click.option('-c','--cartoon',type=bool,default=False)
-@click.option('-i','--indices',type=int,default=None)
+@region_options
+@profile_options
+@click.option('--progress',type=float,default=None,help="Blenderでの実行中にこの間隔(秒)で進捗を表示し,.blendの横に時間のレポート(JSON)を書き込む")
+@click.option('--polygon-budget',type=int,default=None,help="合計の面数の目安.与えた場合,球と円柱の分割数を面数に合わせて選ぶ")
+@click.option('--repeat',default=None,help="ユニットセルを並べる数. '3,3,2'のように指定(コレクションインスタンスで並べる)")
 @click.option('-s','--scale',type=float,default=default.space_filling_scale)
 @click.option('-ss','--subdivision_surface',type=bool,default=False)
-def spacefilling(file,format,outfile,cartoon,indices,scale,subdivision_surface):
+def spacefilling(file,format,outfile,cartoon,scale,subdivision_surface,progress,polygon_budget,repeat,
+                 indices,slab,sphere,near,cell,elements,boundary):
     atoms = read(file,format=format)
+    indices = get_indices(atoms,indices,slab,sphere,near,cell,elements,boundary)
     cartoon = {"apply":cartoon}
     subdivision_surface = {"apply":subdivision_surface}
-    pyscript = create(
+    repeat = [int(n) for n in repeat.split(",")] if repeat else None
+    pyscript = write_output(
         outfile,
         SpaceFilling(
             atoms,
@@ -88,7 +184,10 @@ def spacefilling(file,format,outfile,cartoon,indices,scale,subdivision_surface):
             indices=indices,
             scale=scale,
             subdivision_surface=subdivision_surface,
-            ))
+            repeat=repeat,
+            ),
+        progress=progress,
+        polygon_budget=polygon_budget)
     if outfile == "-":
         print(pyscript)
     
@@ -97,28 +196,177 @@ def spacefilling(file,format,outfile,cartoon,indices,scale,subdivision_surface):
 @click.option('-f','--format',default=None)
 @click.option('-o','--outfile',default="Animations.zip")
 @click.option('-c','--cartoon',type=bool,default=False)
-@click.option('-i','--indices',type=int,default=None)
+@region_options
+@profile_options
+@click.option('--progress',type=float,default=None,help="Blenderでの実行中にこの間隔(秒)で進捗を表示し,.blendの横に時間のレポート(JSON)を書き込む")
+@click.option('--polygon-budget',type=int,default=None,help="合計の面数の目安.与えた場合,球と円柱の分割数を面数に合わせて選ぶ")
 @click.option('-s','--scale',type=float,default=default.space_filling_scale)
 @click.option('-ss','--subdivision_surface',type=bool,default=False)
 @click.option('-step',type=int,default=default.step)
 @click.option('-start',type=int,default=default.start)
-def animation(file,format,outfile,cartoon,indices,scale,subdivision_surface,step,start):
-    if Path(outfile).suffix == ".traj":
-        images = Trajectory(file)
-    else:
-        images = list(iread(file))
+@click.option('--frames',default=None,help="読み込むフレーム.'::10','1000:5000'のようにASE形式で指定")
+@click.option('--max-frames',type=int,default=None,help="読み込む最大フレーム数")
+@click.option('--time-budget',type=float,default=None,help="読み込みにかける最大時間(秒)")
+@click.option('--dtype',type=click.Choice(["float64","float32","int16","int32"]),default=default.encoding["dtype"],
+              help="座標の保存形式.int16,int32はバウンディングボックスに対する固定小数点")
+@click.option('--delta/--no-delta',default=default.encoding["delta"],help="前フレームとの差分を保存する(int16,int32のみ)")
+@click.option('--compression',type=click.Choice(["zlib","lzma","none"]),default=default.encoding["compression"])
+@click.option('--level',type=int,default=default.encoding["level"],help="圧縮レベル")
+@click.option('--playback',type=click.Choice(["keyframe","handler"]),default=default.playback,
+              help="handlerの場合,キーフレームを打たずに再生時に座標を読み込む")
+@click.option('--interpolate/--no-interpolate',default=default.interpolate,help="playback=handlerの時,フレーム間を線形補間する")
+def animation(file,format,outfile,cartoon,scale,subdivision_surface,progress,polygon_budget,step,start,frames,max_frames,time_budget,
+              dtype,delta,compression,level,playback,interpolate,
+              indices,slab,sphere,near,cell,elements,boundary):
+    # ファイル名のまま渡す(xyz,trajはAtomsを作らずに座標のみ読み込まれる)
+    images = file
+    # 領域は1フレーム目の座標で判定する.領域を指定しない場合はAtomsを読み込まない
+    first_atoms = read(file,index=0,format=format) if has_region(slab,sphere,near,cell,elements) else None
+    indices = get_indices(first_atoms,indices,slab,sphere,near,cell,elements,boundary)
     cartoon = {"apply":cartoon}
     subdivision_surface = {"apply":subdivision_surface}
-    create(outfile,
+    encoding = {"dtype":dtype,"delta":delta,"compression":None if compression == "none" else compression,"level":level}
+    # -o - の場合は標準出力(バイナリ)にzipを書き込む
+    report = create(sys.stdout.buffer if outfile == "-" else outfile,
            Animation(
                images,
+               format=format,
+               frames=frames,
+               max_frames=max_frames,
+               time_budget=time_budget,
                cartoon=cartoon,
                indices=indices,
                scale=scale,
                subdivision_surface=subdivision_surface,
                step=step,
-               start=start
-               ))
+               start=start,
+               encoding=encoding,
+               playback=playback,
+               interpolate=interpolate,
+               ),
+           progress=progress,
+           polygon_budget=polygon_budget)
+    # -o - の場合は標準出力にzipを書き込むので,レポートは標準エラーに出力する
+    for name,r in report.items():
+        click.echo(f"{name}: {r['nbytes']/1e6:.2f} MB (float64: {r['raw_nbytes']/1e6:.2f} MB, "
+                   f"{r['raw_nbytes']/max(r['nbytes'],1):.1f}x), max error {r['max_error']:.2e} Å",err=outfile == "-")
     
+@main.command('inspect')
+@click.argument('file')
+@click.option('-n','--name',default=None,help="座標ファイル名(positions0.bin等).指定しない場合は全て")
+@click.option('--blocks',is_flag=True,default=False,help="ブロック表も表示する")
+def inspect(file,name,blocks):
+    """Animationのzipファイルの座標ファイルのヘッダーを表示する(座標は展開しない)"""
+    from mk_blender_scr.io.animation_archive import read_index
+    for member,header in read_index(file,name).items():
+        print(f"{member}: n_frames={header['n_frames']} n_atoms={header['n_atoms']} dtype={header['dtype']} "
+              f"delta={header['delta']} compression={header['compression']} "
+              f"start={header['start']} step={header['step']} blocks={len(header['blocks'])}")
+        if blocks:
+            for block in header["blocks"]:
+                print(f"    frames {block['frame']}-{block['frame']+block['n_frames']-1}: "
+                      f"offset={block['byte_offset']} nbytes={block['nbytes']}")
+
+@main.command('estimate')
+@click.argument('file')
+@click.option('-f','--format',default=None)
+@click.option('--style',type=click.Choice(["BallAndStick","Stick","SpaceFilling","Animation"]),default="BallAndStick")
+@click.option('-b','--bicolor',type=bool,default=default.bicolor)
+@click.option('-s','--scale',type=float,default=None)
+@click.option('-ss','--subdivision_surface',type=bool,default=False)
+@click.option('--subdivision-level',type=int,default=default.subdivision_surface["level"],help="Subdivision Surfaceのviewポートでのレベル")
+@click.option('--render-levels',type=int,default=default.subdivision_surface["render_levels"],help="Subdivision SurfaceのRenderレベル")
+@region_options
+@click.option('--frames',default=None,help="Animationで読み込むフレーム.'::10','1000:5000'のようにASE形式で指定")
+@click.option('--max-frames',type=int,default=None,help="Animationで読み込む最大フレーム数")
+@click.option('--playback',type=click.Choice(["keyframe","handler"]),default=default.playback)
+@click.option('--dtype',type=click.Choice(["float64","float32","int16","int32"]),default=default.encoding["dtype"])
+@click.option('--compression',type=click.Choice(["zlib","lzma","none"]),default=default.encoding["compression"])
+@click.option('--polygon-budget',type=int,default=None,help="createのpolygon_budget(分割数を面数に合わせて選ぶ)")
+@click.option('--budget',multiple=True,help="上限. 'objects=100000'のように指定(複数指定可).指定しない場合はdefault.budgets")
+@click.option('--refuse',is_flag=True,default=False,help="上限を超えた場合,終了コード1で終了する")
+@click.option('--json','as_json',is_flag=True,default=False,help="JSONで出力する")
+def estimate_command(file,format,style,bicolor,scale,subdivision_surface,subdivision_level,render_levels,
+                     indices,slab,sphere,near,cell,elements,boundary,
+                     frames,max_frames,playback,dtype,compression,polygon_budget,budget,refuse,as_json):
+    """スクリプトを作成せずに,シーンの規模(オブジェクト数,面数,キーフレーム数等)を見積もる"""
+    import json
+    from mk_blender_scr.blender.estimate import estimate
+    first_atoms = read(file,index=0,format=format)
+    indices = get_indices(first_atoms,indices,slab,sphere,near,cell,elements,boundary)
+    kwargs = {"subdivision_surface":{"apply":subdivision_surface,"level":subdivision_level,"render_levels":render_levels}}
+    if scale is not None:
+        kwargs["scale"] = scale
+    if style == "Animation":
+        encoding = {"dtype":dtype,"compression":None if compression == "none" else compression}
+        target = Animation(file,format=format,frames=frames,max_frames=max_frames,indices=indices,
+                           playback=playback,encoding=encoding,**kwargs)
+    elif style == "SpaceFilling":
+        target = SpaceFilling(first_atoms,indices=indices,**kwargs)
+    else:
+        target = {"BallAndStick":BallAndStick,"Stick":Stick}[style](first_atoms,indices=indices,bicolor=bicolor,**kwargs)
+    budgets = dict(default.budgets)
+    for item in budget:
+        key,value = item.split("=")
+        budgets[key] = None if value.lower() == "none" else int(float(value))
+    report = estimate(target,budgets=budgets,action="ignore",polygon_budget=polygon_budget)
+    if as_json:
+        click.echo(json.dumps(report,indent=2))
+    else:
+        for key,value in report["total"].items():
+            click.echo(f"{key}: {value:,}")
+        for key,v in report["exceeded"].items():
+            click.echo(f"上限を超えています: {key}={v['value']:,} (上限{v['budget']:,})",err=True)
+    if refuse and report["exceeded"]:
+        raise SystemExit(1)
+
+@main.command('preview')
+@click.argument('files',nargs=-1,required=True)
+@click.option('-f','--format',default=None)
+@click.option('-o','--outdir',default=".",help="PNGの出力先ディレクトリ")
+@click.option('--size',default="256x256",help="画像の大きさ. '幅x高さ'のように指定")
+@click.option('--style',type=click.Choice(["space_filling","ball_and_stick","stick"]),default="space_filling")
+@click.option('-r','--rotation',default="",help="視点の回転. '10x,-20y'のように指定")
+@click.option('-j','--processes',type=int,default=None,help="並列に処理するプロセス数.指定しない場合はCPU数")
+def preview(files,format,outdir,size,style,rotation,processes):
+    """Blenderを使わずに,構造ファイルのサムネイル(PNG)を作成する"""
+    from mk_blender_scr.blender.preview import render_previews
+    width,height = [int(v) for v in size.lower().split("x")]
+    for outfile in render_previews(files,outdir,format=format,processes=processes,
+                                   size=(width,height),style=style,rotation=rotation):
+        click.echo(outfile)
+
+@main.command('dry-run')
+@click.argument('file')
+@click.option('--chunks',default=None,help="作成するチャンク. '0-15'のように指定")
+@click.option('--baseline',default=None,help="比較する以前の結果(JSON).増加が許容範囲を超えた場合,終了コード1で終了する")
+@click.option('--save-baseline',default=None,help="結果をJSONで保存するファイル")
+@click.option('--tolerance',type=float,default=0.0,help="許容する増加の割合(python_seconds以外)")
+@click.option('--time-tolerance',type=float,default=0.5,help="python_secondsで許容する増加の割合")
+@click.option('--json','as_json',is_flag=True,default=False,help="JSONで出力する")
+def dry_run_command(file,chunks,baseline,save_baseline,tolerance,time_tolerance,as_json):
+    """作成したスクリプト(.pyまたは.zip)をBlenderを使わずに実行し,操作の回数と実行時間を表示する"""
+    import json
+    from mk_blender_scr.blender.dry_run import dry_run,compare_reports
+    report = dry_run(file,argv=None if chunks is None else ["--chunks",chunks])
+    if save_baseline is not None:
+        with open(save_baseline,"w") as f:
+            json.dump(report,f,indent=2)
+    if as_json:
+        click.echo(json.dumps(report,indent=2))
+    else:
+        for key,value in report.items():
+            if key != "operators":
+                click.echo(f"{key}: {value:,.3f}" if key == "python_seconds" else f"{key}: {value:,}")
+        for key,value in report["operators"].items():
+            click.echo(f"  {key}: {value:,}")
+    if baseline is not None:
+        with open(baseline) as f:
+            regressions = compare_reports(report,json.load(f),tolerance,time_tolerance)
+        for key,v in regressions.items():
+            click.echo(f"増加しています: {key}={v['value']:,} (基準{v['baseline']:,})",err=True)
+        if regressions:
+            raise SystemExit(1)
+
 if __name__ == '__main__':
     main()
\ No newline at end of file
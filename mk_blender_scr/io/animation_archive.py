@@ -0,0 +1,55 @@
+import zipfile
+
+from mk_blender_scr.blender.encoding import read_header,decode_positions
+
+def _members(zf,name=None):
+    if name is not None:
+        return [name]
+    return [info.filename for info in zf.infolist() if info.filename.endswith(".bin")]
+
+def read_index(zipname,name=None):
+    """Animationのzipファイルから座標ファイルのヘッダー(フレーム数,原子数,dtype,start,step,ブロック表)を読み込む
+
+    | 座標は展開しない.
+
+    Parameters:
+
+    zipname: str or Path
+        createで作成したzipファイル
+    name: str
+        座標ファイル名(positions0.bin等).Noneの場合は全ての座標ファイル
+
+    Returns:
+        dict: {"座標ファイル名":ヘッダー(dict)}
+    """
+    index = {}
+    with zipfile.ZipFile(zipname) as zf:
+        for member in _members(zf,name):
+            with zf.open(member) as f:
+                index[member] = read_header(f)[0]
+    return index
+
+def load_frames(zipname,name=None,frames=None):
+    """Animationのzipファイルから指定したフレームの座標を読み込む
+
+    | 座標ファイルはZIP_STOREDで保存されているので,必要なブロックまでシークして展開する.
+
+    Parameters:
+
+    zipname: str or Path
+        createで作成したzipファイル
+    name: str
+        座標ファイル名(positions0.bin等).Noneの場合はzip内の最初の座標ファイル
+    frames: tuple or slice
+        | 読み込むフレームの範囲. (500,600)のように(開始,終了)で指定する.
+        | Noneの場合は全フレーム
+
+    Returns:
+        numpy.ndarray: (フレーム数,原子数,3)の座標
+    """
+    with zipfile.ZipFile(zipname) as zf:
+        members = _members(zf,name)
+        if not members:
+            raise ValueError(f"{zipname}にAnimationの座標ファイルがありません")
+        with zf.open(members[0]) as f:
+            return decode_positions(f,frames)
@@ -0,0 +1,327 @@
+import os
+import time
+import warnings
+from itertools import islice
+from pathlib import Path
+import numpy as np
+from ase.io import iread
+from ase.io.formats import string2index
+
+XYZ_FORMATS = ["xyz","extxyz"]
+TRAJ_FORMATS = ["traj"]
+
+def guess_format(file,format=None):
+    """高速読み込みに対応したフォーマット('xyz','traj')またはNone(ASEで読み込む)を返す"""
+    if format is None:
+        format = Path(file).suffix.lstrip(".")
+    if format in XYZ_FORMATS:
+        return "xyz"
+    elif format in TRAJ_FORMATS:
+        return "traj"
+    return None
+
+def _parse_properties(comment):
+    """extxyzのコメント行から元素と座標の列番号を得る.Propertiesが無い場合は通常のxyz"""
+    species_col,pos_col = 0,1
+    for token in comment.split():
+        if token.lower().startswith("properties="):
+            fields = token.split("=",1)[1].strip("\"").split(":")
+            col = 0
+            species_col = pos_col = None
+            for name,_,ncols in zip(fields[0::3],fields[1::3],fields[2::3]):
+                if name == "species":
+                    species_col = col
+                elif name == "pos":
+                    pos_col = col
+                col += int(ncols)
+            if species_col is None or pos_col is None:
+                raise ValueError("Propertiesにspeciesまたはposがありません")
+    return species_col,pos_col
+
+def parse_frames(frames):
+    """'::10','1000:5000'のようなASE形式の文字列,int,sliceをsliceに変換する(Noneは全フレーム)"""
+    if frames is None:
+        return slice(None)
+    if isinstance(frames,str):
+        frames = string2index(frames)
+    if isinstance(frames,int):
+        return slice(frames,frames+1) if frames != -1 else slice(-1,None)
+    if frames.step is not None and frames.step <= 0:
+        raise ValueError("framesのstepは正の整数のみサポートしています")
+    return frames
+
+def count_frames(file,format=None):
+    """座標を読み込まずにフレーム数を数える(xyzは行をスキップ,trajはヘッダーのみ)"""
+    fast_format = guess_format(file,format)
+    if fast_format == "xyz":
+        n_frames = 0
+        with open(file) as f:
+            while True:
+                line = f.readline()
+                if not line.strip():
+                    break
+                for _ in islice(f,int(line)+1):
+                    pass
+                n_frames += 1
+        return n_frames
+    elif fast_format == "traj":
+        from ase.io import ulm
+        with ulm.open(file,"r") as backend:
+            return len(backend)
+    return sum(1 for _ in iread(file,format=format))
+
+class _FrameLimit():
+    """max_frames(最大フレーム数)とtime_budget(秒)による読み込みの打ち切り"""
+    def __init__(self,max_frames=None,time_budget=None):
+        self.max_frames = max_frames
+        self.time_budget = time_budget
+        self.start = time.perf_counter()
+
+    def reached(self,n_frames):
+        if self.max_frames is not None and n_frames >= self.max_frames:
+            return True
+        if self.time_budget is not None and time.perf_counter()-self.start > self.time_budget:
+            warnings.warn(f"time_budget({self.time_budget}秒)を超えたため{n_frames}フレームで読み込みを打ち切りました")
+            return True
+        return False
+
+class _PositionsBuffer():
+    """(フレーム数,原子数,3)の配列を事前に確保し,足りなくなった場合のみ拡張する"""
+    def __init__(self,n_frames,n_atoms,dtype):
+        self.array = np.empty((max(n_frames,1),n_atoms,3),dtype=dtype)
+        self.n_frames = 0
+
+    def next(self):
+        if self.n_frames == len(self.array):
+            new = np.empty((2*len(self.array),)+self.array.shape[1:],dtype=self.array.dtype)
+            new[:self.n_frames] = self.array
+            self.array = new
+        self.n_frames += 1
+        return self.array[self.n_frames-1]
+
+    def get(self):
+        return self.array[:self.n_frames]
+
+def _iter_xyz(file,indices,dtype,validate,frames,limit,info):
+    size = os.path.getsize(file)
+    if (frames.start or 0) < 0 or (frames.stop or 0) < 0:
+        frames = slice(*frames.indices(count_frames(file,"xyz")))
+    start,stop,step = frames.start or 0,frames.stop,frames.step or 1
+    n_read = 0
+    with open(file) as f:
+        first_symbols = None
+        frame = -1
+        while stop is None or frame+1 < stop:
+            line = f.readline()
+            if not line.strip():
+                break
+            frame += 1
+            n_atoms = int(line)
+            if frame < start or (frame-start) % step != 0:
+                # 選択されていないフレームは解析せずにスキップする
+                for _ in range(n_atoms+1):
+                    f.readline()
+                continue
+            frame_start = f.tell()
+            comment = f.readline()
+            lines = [f.readline() for _ in range(n_atoms)]
+            if first_symbols is None:
+                species_col,pos_col = _parse_properties(comment)
+                first_symbols = [l.split()[species_col] for l in lines]
+                if indices is None:
+                    indices = list(range(n_atoms))
+                # 1フレーム目のバイト数から読み込むフレーム数を見積もる
+                n_estimate = size//max(f.tell()-frame_start,1)//step+1
+                if limit.max_frames is not None:
+                    n_estimate = min(n_estimate,limit.max_frames)
+                info.update(symbols=first_symbols,n_frames=n_estimate)
+            elif n_atoms != len(first_symbols):
+                raise ValueError(f"{frame}フレーム目で原子数が変化しています")
+            elif validate and [l.split()[species_col] for l in lines] != first_symbols:
+                raise ValueError(f"{frame}フレーム目で元素が変化しています")
+            yield np.loadtxt([lines[i] for i in indices],
+                             usecols=(pos_col,pos_col+1,pos_col+2),dtype=dtype,ndmin=2)
+            n_read += 1
+            if limit.reached(n_read):
+                break
+    if first_symbols is None:
+        raise ValueError(f"{file}に選択されたフレームがありません")
+
+def _iter_traj(file,indices,dtype,validate,frames,limit,info):
+    from ase.io import ulm
+    from ase.data import chemical_symbols
+    backend = ulm.open(file,"r")
+    try:
+        if len(backend) == 0:
+            raise ValueError(f"{file}にフレームがありません")
+        numbers = backend[0].numbers
+        if indices is None:
+            indices = list(range(len(numbers)))
+        selected = range(len(backend))[frames]
+        if len(selected) == 0:
+            raise ValueError(f"{file}に選択されたフレームがありません")
+        info.update(symbols=[chemical_symbols[n] for n in numbers],n_frames=len(selected))
+        for n_read,i in enumerate(selected,1):
+            b = backend[i]
+            # numbersは変化した場合のみ書き込まれている
+            if "numbers" in b and validate and not np.array_equal(b.numbers,numbers):
+                raise ValueError(f"{i}フレーム目で原子数または元素が変化しています")
+            yield np.asarray(b.positions[indices],dtype=dtype)
+            if limit.reached(n_read):
+                break
+    finally:
+        backend.close()
+
+def _iter_images(images,indices,dtype,frames,limit,info):
+    selected = range(len(images))[frames]
+    if len(selected) == 0:
+        raise ValueError("選択されたフレームがありません")
+    if indices is None:
+        indices = list(range(len(images[selected[0]])))
+    info.update(n_frames=len(selected) if limit.max_frames is None else min(len(selected),limit.max_frames))
+    for n_read,i in enumerate(selected,1):
+        yield np.asarray(images[i].positions[indices],dtype=dtype)
+        if limit.reached(n_read):
+            break
+
+def _iter_ase(file,indices,dtype,format,frames,limit,info):
+    first_symbols = None
+    n_read = 0
+    for atoms in iread(file,index=frames,format=format):
+        if first_symbols is None:
+            first_symbols = atoms.get_chemical_symbols()
+            if indices is None:
+                indices = list(range(len(atoms)))
+            info.update(symbols=first_symbols,n_frames=1)
+        elif atoms.get_chemical_symbols() != first_symbols:
+            raise ValueError(f"{n_read}フレーム目で原子数または元素が変化しています")
+        yield np.asarray(atoms.positions[indices],dtype=dtype)
+        n_read += 1
+        if limit.reached(n_read):
+            break
+    if first_symbols is None:
+        raise ValueError(f"{file}に選択されたフレームがありません")
+
+def _iter_frames(file,indices,format,dtype,validate,frames,limit,info):
+    """ファイルのフォーマットに応じてフレーム毎の座標(len(indices),3)を返すイテレーター
+
+    | infoに1フレーム目の元素のリスト('symbols')と見積もったフレーム数('n_frames')を書き込む.
+    """
+    fast_format = guess_format(file,format)
+    if fast_format == "xyz":
+        return _iter_xyz(file,indices,dtype,validate,frames,limit,info)
+    elif fast_format == "traj":
+        return _iter_traj(file,indices,dtype,validate,frames,limit,info)
+    return _iter_ase(file,indices,dtype,format,frames,limit,info)
+
+def _collect(frame_iter,info,dtype):
+    """フレーム毎の座標を事前に確保した(フレーム数,原子数,3)の配列に書き込む"""
+    buffer = None
+    for frame_positions in frame_iter:
+        if buffer is None:
+            buffer = _PositionsBuffer(info["n_frames"],len(frame_positions),dtype)
+        buffer.next()[:] = frame_positions
+    return buffer.get()
+
+def _blocks(frame_iter,block_size,dtype):
+    """フレーム毎の座標をblock_sizeフレームずつの配列にまとめる"""
+    block = None
+    for frame_positions in frame_iter:
+        if block is None:
+            block = np.empty((block_size,)+frame_positions.shape,dtype=dtype)
+            n = 0
+        block[n] = frame_positions
+        n += 1
+        if n == block_size:
+            yield block
+            block = None
+    if block is not None:
+        yield block[:n]
+
+def read_positions_from_images(images,indices=None,frames=None,max_frames=None,time_budget=None,dtype=np.float64):
+    """Atomsのリスト,Trajectory等から座標のみを(フレーム数,len(indices),3)の配列に読み込む
+
+    | Atomsはスライスせず,positionsの配列のみをスライスする.
+    | framesで選択されなかったフレームは参照しない.
+    """
+    info = {}
+    limit = _FrameLimit(max_frames,time_budget)
+    return _collect(_iter_images(images,indices,dtype,parse_frames(frames),limit,info),info,dtype)
+
+def iter_positions_from_images(images,indices=None,frames=None,max_frames=None,time_budget=None,
+                               dtype=np.float64,block_size=100):
+    """read_positions_from_imagesと同じだが,block_sizeフレームずつの配列を順に返す(全フレームを保持しない)"""
+    limit = _FrameLimit(max_frames,time_budget)
+    yield from _blocks(_iter_images(images,indices,dtype,parse_frames(frames),limit,{}),block_size,dtype)
+
+def read_positions(file,indices=None,format=None,dtype=np.float64,validate=True,
+                   frames=None,max_frames=None,time_budget=None):
+    """トラジェクトリファイルから座標のみを読み込む
+
+    | xyz(extxyz),ASEのtrajはAtomsを作らずに座標のみを読み込み,事前に確保した配列に書き込む.
+    | その他のフォーマットはASE(iread)で読み込む.
+
+    Parameters:
+
+    file: str or Path
+        トラジェクトリファイル
+    indices: list of int
+        読み込む原子のindex.Noneの場合全原子
+    format: str
+        ファイルフォーマット(ase.io.readのformat).Noneの場合拡張子から判断する
+    dtype:
+        座標の型(float32またはfloat64)
+    validate: bool
+        Trueの場合,全フレームで元素が同じであることを確認する(原子数は常に確認する)
+    frames: str or slice
+        | 読み込むフレーム.'::10','1000:5000'のようにASE形式の文字列で指定する.
+        | 選択されなかったフレームは座標を解析しない.
+    max_frames: int
+        読み込む最大フレーム数
+    time_budget: float
+        読み込みにかける最大時間(秒).超えた場合はそれまでに読み込んだフレームのみを返す.
+
+    Returns:
+        tuple: (座標(フレーム数,len(indices),3), 1フレーム目の全原子の元素のリスト)
+    """
+    info = {}
+    limit = _FrameLimit(max_frames,time_budget)
+    frame_iter = _iter_frames(file,indices,format,dtype,validate,parse_frames(frames),limit,info)
+    positions = _collect(frame_iter,info,dtype)
+    return positions,info["symbols"]
+
+def iter_positions(file,indices=None,format=None,dtype=np.float64,validate=True,
+                   frames=None,max_frames=None,time_budget=None,block_size=100):
+    """read_positionsと同じだが,block_sizeフレームずつの(フレーム数,len(indices),3)の配列を順に返す
+
+    | 全フレームの座標を保持しないので,読み込みながらエンコードや書き込みができる.
+    | time_budgetは読み込み開始からの経過時間なので,返したブロックの処理にかかった時間も含む.
+    """
+    limit = _FrameLimit(max_frames,time_budget)
+    frame_iter = _iter_frames(file,indices,format,dtype,validate,parse_frames(frames),limit,{})
+    yield from _blocks(frame_iter,block_size,dtype)
+
+def benchmark(file,indices=None,format=None,repeat=3):
+    """read_positionsと従来の方法(AtomsをスライスしてからPositionsを得る)の読み込み時間を比較する
+
+    Returns:
+        dict: {"fast":秒,"ase":秒,"speedup":倍率} (repeat回中の最小値)
+    """
+    def ase_path():
+        positions = []
+        for atoms in iread(file,format=format):
+            idx = list(range(len(atoms))) if indices is None else indices
+            positions.append(atoms[idx].get_positions())
+        return np.array(positions)
+    def fast_path():
+        return read_positions(file,indices=indices,format=format)[0]
+    result = {}
+    for name,func in [("fast",fast_path),("ase",ase_path)]:
+        times = []
+        for _ in range(repeat):
+            t = time.perf_counter()
+            func()
+            times.append(time.perf_counter()-t)
+        result[name] = min(times)
+    result["speedup"] = result["ase"]/result["fast"]
+    return result
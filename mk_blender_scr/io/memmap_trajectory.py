@@ -0,0 +1,129 @@
+import json
+from pathlib import Path
+import numpy as np
+from ase import Atoms
+from ase.io import iread
+from ase.constraints import FixAtoms
+
+class MemmapTrajectory():
+    """メモリマップされた座標配列と共通のトポロジー(元素,pbc,FixAtoms)からAtomsを作成するフレームソース
+
+    | Trajectoryと同様に ``len()`` ,インデックス,スライス,イテレーションが使える.
+    | 参照したフレームのみがメモリに読み込まれるので,巨大なトラジェクトリでもViewで閲覧できる.
+    | 作成は :meth:`convert` で行う(一度だけ変換すればよい).
+
+    Parameters:
+
+    filename: str or Path
+        :meth:`convert` で作成したメタデータファイル(.mmap)
+    """
+    def __init__(self,filename,_frames=None):
+        self.filename = Path(filename)
+        with open(self.filename) as f:
+            meta = json.load(f)
+        self.meta = meta
+        self.numbers = np.array(meta["numbers"],dtype=int)
+        self.pbc = np.array(meta["pbc"],dtype=bool)
+        self.fixed = meta.get("fixed",[])
+        n_frames,n_atoms = meta["n_frames"],meta["n_atoms"]
+        shape = (n_frames,n_atoms,3)
+        self.positions = np.memmap(self.filename.with_name(meta["positions"]),
+                                   dtype=meta["dtype"],mode="r",shape=shape)
+        self.cells = np.memmap(self.filename.with_name(meta["cells"]),
+                               dtype=meta["dtype"],mode="r",shape=(n_frames,3,3))
+        self._frames = np.arange(n_frames) if _frames is None else _frames
+
+    def __len__(self):
+        return len(self._frames)
+
+    def __getitem__(self,i):
+        if isinstance(i,slice):
+            return MemmapTrajectory(self.filename,_frames=self._frames[i])
+        frame = self._frames[i]
+        atoms = Atoms(numbers=self.numbers,
+                      positions=np.array(self.positions[frame],dtype=float),
+                      cell=np.array(self.cells[frame],dtype=float),
+                      pbc=self.pbc)
+        if self.fixed:
+            atoms.set_constraint(FixAtoms(indices=self.fixed))
+        return atoms
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def get_positions(self,indices=None):
+        """(フレーム数,原子数,3)の座標を返す.indicesを与えた場合はその原子のみ
+
+        | スライスしていない場合,indicesがNoneならmemmapをそのまま返す.
+        """
+        positions = self.positions
+        if len(self._frames) != len(positions) or np.any(self._frames != np.arange(len(positions))):
+            positions = positions[self._frames]
+        if indices is None:
+            return positions
+        return positions[:,indices]
+
+    def iter_positions(self,indices=None,block_size=100):
+        """get_positionsと同じだが,block_sizeフレームずつの配列を順に返す(参照したブロックのみ読み込む)"""
+        for start in range(0,len(self._frames),block_size):
+            block = np.asarray(self.positions[self._frames[start:start+block_size]],dtype=np.float64)
+            yield block if indices is None else block[:,indices]
+
+    @classmethod
+    def convert(cls,file,outfile=None,format=None,index=":",dtype=np.float32):
+        """ASEで読み込めるトラジェクトリファイルをMemmapTrajectory用のファイルに変換する
+
+        | 1フレームずつ読み込んで書き込むので,メモリには1フレーム分しか保持しない.
+        | outfile(メタデータ),outfile.positions,outfile.cellsの3つのファイルが作成される.
+
+        Parameters:
+
+        file: str or Path
+            ASEで読み込めるファイル(extxyz,traj等)
+        outfile: str or Path
+            メタデータファイル名. Noneの場合は"{file}.mmap"
+        format: str
+            ファイルフォーマット(ase.io.readのformat)
+        index: str
+            読み込むフレーム(ase.io.readのindex)
+        dtype:
+            座標の型.デフォルトはfloat32
+
+        Returns:
+            MemmapTrajectory
+        """
+        outfile = Path(f"{file}.mmap") if outfile is None else Path(outfile)
+        positions_file = outfile.with_name(outfile.name+".positions")
+        cells_file = outfile.with_name(outfile.name+".cells")
+        dtype = np.dtype(dtype)
+        n_frames = 0
+        first = None
+        with open(positions_file,"wb") as fp, open(cells_file,"wb") as fc:
+            for atoms in iread(file,index=index,format=format):
+                if first is None:
+                    first = atoms
+                elif len(atoms) != len(first) or not np.array_equal(atoms.numbers,first.numbers):
+                    raise ValueError(f"{n_frames}フレーム目で原子数または元素が変化しています")
+                fp.write(atoms.get_positions().astype(dtype).tobytes())
+                fc.write(np.asarray(atoms.get_cell()).astype(dtype).tobytes())
+                n_frames += 1
+        if first is None:
+            raise ValueError(f"{file}にフレームがありません")
+        fixed = []
+        for constraint in first.constraints:
+            if isinstance(constraint,FixAtoms):
+                fixed.extend(constraint.index.tolist())
+        meta = {
+            "n_frames":n_frames,
+            "n_atoms":len(first),
+            "dtype":dtype.str,
+            "numbers":first.numbers.tolist(),
+            "pbc":first.pbc.tolist(),
+            "fixed":fixed,
+            "positions":positions_file.name,
+            "cells":cells_file.name,
+        }
+        with open(outfile,"w") as f:
+            json.dump(meta,f)
+        return cls(outfile)
@@ -1,7 +1,9 @@
 from mk_blender_scr.visualize.custum_viewer import View
 from mk_blender_scr.visualize.by_nglview import view_with_coordinate,view_with_index
+from mk_blender_scr.visualize.trajectory_html import write_trajectory_html
 
 __all__ = [
     "View",
     "view_with_index","view_with_coordinate",
+    "write_trajectory_html",
 ]
\ No newline at end of file
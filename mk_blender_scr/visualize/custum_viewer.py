@@ -1,8 +1,9 @@
 import sys
+import json
+import base64
 import traceback
+from collections import deque
 from typing import Any,Dict,List,Optional,Union
-import threading
-import time
 import numpy as np
 from ase import Atoms
 from ase.constraints import FixAtoms
@@ -11,7 +12,7 @@ from ase.io.vasp import write_vasp
 from ase.io import Trajectory, write
 from ase.visualize.ngl import NGLDisplay
 from ipywidgets import (Button, Checkbox, Output,
-                        Text, BoundedFloatText,RadioButtons,Image,ColorPicker,BoundedIntText,FloatSlider,
+                        Text, BoundedFloatText,RadioButtons,Image,ColorPicker,BoundedIntText,FloatSlider,IntSlider,
                         HBox,VBox,Tab,Dropdown,Layout)
 from traitlets import Bunch
 
@@ -21,28 +22,39 @@ from nglview.component import ComponentViewer
 from nglview.color import ColormakerRegistry
 
 # USER
-from mk_blender_scr.visualize.functions import (update_tooltip_atoms,generate_js_code,
+from mk_blender_scr.visualize.functions import (update_tooltip_atoms,generate_js_code,register_partial_charge_handler,
                                         get_struct,add_force_shape,rotate_view,spin_view)
 from mk_blender_scr.visualize.color import default,vesta,jmol
+from mk_blender_scr.visualize.trajectory_html import write_trajectory_html
+from mk_blender_scr.blender.functions import parsestr2list
+from mk_blender_scr.blender import default as blender_default
+from mk_blender_scr.io.memmap_trajectory import MemmapTrajectory
 
 class View(NGLDisplay):
     """
     Parameters:
     
     atoms:
-        | AtomsまたはAtomsのリストまたはTrajectoryクラス
+        | AtomsまたはAtomsのリストまたはTrajectoryクラスまたはMemmapTrajectory
+        | MemmapTrajectoryの場合,表示中のフレームのみがメモリに読み込まれる.
     xsize: 
         | 横幅(px単位)
     ysize:
         | 縦幅(px単位)
+    lod_thresholds:
+        | 軽量表示に切り替える原子数. {"reduced":20000,"line":200000}のように指定する.
+        | reduced: 球,円柱のポリゴン数を減らす(impostorを使う)
+        | line: 球棒モデルはline,空間充填モデルはpointで表示する
     """
     def __init__(
         self,
-        atoms: Union[Atoms, Trajectory, List[Atoms]],
+        atoms: Union[Atoms, Trajectory, List[Atoms], MemmapTrajectory],
         xsize: int = 400,
         ysize: int = 500,
+        lod_thresholds: Optional[Dict[str,int]] = None,
         ):
-        super().__init__(atoms, xsize=xsize, ysize=ysize)
+        # NGLDisplay.__init__は全原子のspacefillを作成するため使わず,Representationは_update_reprでLODに従って作成する
+        self._init_display(atoms, xsize=xsize, ysize=ysize)
         self.v = self.gui.view  # For backward compatibility...
         # del self.gui # デフォルトのGUIを削除
         # self.gui = HBox([self.view, VBox()]) # GUIを再設定
@@ -59,10 +71,17 @@ class View(NGLDisplay):
         self._force_components = []
         self.force_color = [1, 0, 0]  # Red vector for force color.
         self.pre_label = False
+        self.label_indices = None # ラベルを表示する原子(Noneの場合は全原子)
+        self._index_text_cache = None # インデックスのラベルはフレーム間で変化しないのでキャッシュする
+        self._symbol_text_cache = (None,None) # (numbers,元素のラベル)
+        self._sent_label_text = None # フロントエンドに送信済みのラベル
+        self._label_repr_added = False # ラベルのRepresentationはラベル表示時に初めて作成する
+        self.lod_thresholds = dict(blender_default.lod_thresholds, **(lod_thresholds or {}))
+        self._repr_state = None # (モデル,LOD) 現在作成されているRepresentation
         if isinstance(atoms, Atoms):
             self._struct_cache = [None]
         else:
-            # atoms is Trajectory or List[Atoms]
+            # atoms is Trajectory or List[Atoms] or MemmapTrajectory
             self._struct_cache = [None for _ in range(len(atoms))]
         #色の設定
         self.cm = ColormakerRegistry
@@ -76,22 +95,15 @@ class View(NGLDisplay):
 
         # ---原子上にマウスを置いたときに,原子のindexと位置を表示する
         update_tooltip_atoms(self.view, self._get_current_atoms())
+        # ---電荷をバイナリ(float32)で受け取るハンドラ
+        register_partial_charge_handler(self.view)
         
         # GUI作成&表示
         self.build_gui()
         
         # 初期表示
         self.view.camera = "orthographic" if self.camera_style=='平行投影' else "perspective"
-        self.view.add_spacefill()
-        self.view.add_ball_and_stick()
-        self.view.add_label(
-            color="black",
-            labelType="text",
-            labelText=["" for _ in range(len(self._get_current_atoms()))],
-            zOffset=2.0,
-            attachment="middle_center",
-            radius=1,
-        )
+        # モデルのRepresentationは選択中のもののみ作成する.ラベルは表示時に作成する.
         self._update_repr()
         
         self.view.unobserve(NGLWidget._on_frame_changed)
@@ -130,6 +142,9 @@ class View(NGLDisplay):
             value='なし',
             description='ラベル')
         self.gui.label_radio_btn.observe(self.change_label)
+        self.gui.label_indices_text = Text(value="", description="ラベル対象:",placeholder="0-10,23 (空欄で全原子)",
+                                           layout = Layout(width='200px'),style = {'description_width': 'initial'})
+        self.gui.label_indices_text.observe(self._change_label_indices,names="value")
         ###セル(CheckBox)####
         self.gui.cell_check_box = Checkbox(value=True,description="セルユニット",)
         self.gui.cell_check_box.observe(self.show_unitcell)
@@ -143,6 +158,11 @@ class View(NGLDisplay):
             value='球棒モデル',
             description='モデル')
         self.gui.model_radio_btn.observe(self._update_repr)
+        ###詳細度(LOD)###
+        self.gui.full_detail_checkbox = Checkbox(
+            value=False,
+            description="フル詳細(拡大時)")
+        self.gui.full_detail_checkbox.observe(self._update_repr,names="value")
         ###再配置(チェックボックス)###
         self.gui.replace_structure_checkbox = Checkbox(
             value=self.replace_structure,
@@ -177,7 +197,7 @@ class View(NGLDisplay):
             self.gui.file_extention = Dropdown(options=[(val,key) for key,val in self.extention_dict.items()],value=1,layout = Layout(width='70px'))
         else:# list of Atoms or Traj
             self.gui.filename_text = Text(value="Images", description="ファイル名: ",layout = Layout(width='200px'))
-            self.extention_dict = {0:'traj',1:'traj+',2:'cif',3:'cif+',4:'xyz',5:'xyz+',6:'html+',7:"vasp",8:'png'}
+            self.extention_dict = {0:'traj',1:'traj+',2:'cif',3:'cif+',4:'xyz',5:'xyz+',6:'html+',7:"vasp",8:'png',9:'png+'}
             self.gui.file_extention = Dropdown(options=[(val,key) for key,val in self.extention_dict.items()],value=1,layout = Layout(width='70px'))
         ##ダウンロード##
         self.gui.download = Button(description='PNGをダウンロード',
@@ -210,6 +230,8 @@ class View(NGLDisplay):
         self.gui.charge_round.observe(self.change_label)
         self.gui.factor = BoundedIntText(value=4,min=0,max=30,step=1,description='PIGの解像度:',
                                                layout = Layout(width='200px'),style = {'description_width': 'initial'})
+        self.gui.html_stride = BoundedIntText(value=1,min=1,max=1000,step=1,description='HTMLのストライド:',
+                                               layout = Layout(width='200px'),style = {'description_width': 'initial'})
         ###表示####
         # r = list(self.gui.control_box.children)
         img1 = HBox([
@@ -234,6 +256,7 @@ class View(NGLDisplay):
             HBox([self.gui.filename_text,self.gui.file_extention]),
             HBox([self.gui.download,self.gui.save]),
             self.gui.label_radio_btn,
+            self.gui.label_indices_text,
             self.gui.show_charge_checkbox,
             self.gui.charge_scale_slider,
             self.gui.show_force_checkbox,
@@ -243,6 +266,7 @@ class View(NGLDisplay):
             self.csel,
             self.rad,
             self.gui.model_radio_btn,
+            self.gui.full_detail_checkbox,
             self.gui.camera_radio_btn,
             self.gui.cell_check_box,
         ])
@@ -251,6 +275,7 @@ class View(NGLDisplay):
             self.gui.label_size,
             self.gui.charge_round,
             self.gui.factor,
+            self.gui.html_stride,
         ])
         
         self.tab = Tab([general,other,detail],_titles={0:"プロパティなど", 1:"スタイル",2:"その他"})
@@ -276,12 +301,16 @@ class View(NGLDisplay):
         elif self.extention_dict[self.gui.file_extention.value] == "html":
             nv.write_html(f"{name}.html",self.view)
         elif self.extention_dict[self.gui.file_extention.value] == "html+":
-            nv.write_html(f"{name}.html",self.view,(0,len(self.atoms)-1))
+            report = write_trajectory_html(f"{name}.html",self.atoms,stride=self.gui.html_stride.value)
+            with self.gui.out_widget:
+                print(f"{report['n_frames']}フレーム, {report['html_bytes']/1e6:.2f} MB "
+                      f"(JSON比 1/{report['ratio']:.1f})")
         elif self.extention_dict[self.gui.file_extention.value] == "vasp":
             write_vasp(f"{name}",atoms,sort=True,wrap=True,direct=True)
         elif self.extention_dict[self.gui.file_extention.value] == "png":
-            thread = threading.Thread(target=self._save_image_png, args=(f"{name}.png", self.view), daemon=True)
-            thread.start()
+            self._save_image_png(f"{name}.png", self.view)
+        elif self.extention_dict[self.gui.file_extention.value] == "png+":
+            self.export_frames(pattern=f"{name}_{{:04d}}.png")
         
     def download_image(self,e=None):
         try:
@@ -297,10 +326,75 @@ class View(NGLDisplay):
         except Exception as e:
             with self.gui.out_widget:
                 print(traceback.format_exc(), file=sys.stderr)
-        while not image.value:
-            time.sleep(0.1)
-        with open(filename, "wb") as fh:
-            fh.write(image.value)
+            return
+        # 画像データがフロントエンドから届いた時点で書き込む
+        def write_png(change):
+            with open(filename, "wb") as fh:
+                fh.write(change["new"])
+            image.unobserve(write_png, names="value")
+        image.observe(write_png, names="value")
+        
+    def export_frames(self, frames=None, pattern="frame_{:04d}.png"):
+        """複数フレームの画像(PNG)を書き出す
+        
+        | 非同期で実行される(すぐに戻る).画像はフロントエンドから届いた順にファイルへ書き込まれ,
+        | 進捗はout_widgetに表示される.
+        | NGLのレンダリング(TiledRenderer)は非同期で,レンダリング中に座標を変えると別のフレームが混ざるため,
+        | 1フレームの画像が届いてから次のフレームの座標を送る.
+        
+        Parameters:
+        
+        frames: range or list of int
+            書き出すフレーム番号.Noneの場合全フレーム
+        pattern: str
+            ファイル名.フレーム番号でformatされる. ex) "frame_{:04d}.png"
+        """
+        if isinstance(self.atoms, Atoms):
+            self._save_image_png(pattern.format(0), self.view)
+            return
+        frames = deque(range(len(self.atoms)) if frames is None else frames)
+        n_frames = len(frames)
+        n_done = 0
+        frame = None # レンダリング中のフレーム
+        render_params = dict(factor=self.factor, antialias=True, trim=False, transparent=self.transparent)
+        current_frame = self.view.frame
+        self.gui.out_widget.clear_output()
+        
+        def submit():
+            nonlocal frame
+            frame = frames.popleft()
+            self.view._set_coordinates(frame, movie_making=True, render_params=render_params)
+                
+        def on_msg(widget, msg, buffers):
+            nonlocal n_done
+            if msg.get("type") != "movie_image_data":
+                return
+            finished = True
+            try:
+                filename = pattern.format(frame)
+                with open(filename, "wb") as fh:
+                    fh.write(base64.b64decode(msg["data"]))
+                n_done += 1
+                with self.gui.out_widget:
+                    self.gui.out_widget.clear_output(wait=True)
+                    print(f"{n_done}/{n_frames} フレーム書き出し済み ({filename})")
+                if frames:
+                    submit()
+                    finished = False
+            finally:
+                # 全フレーム終了時または例外時はハンドラを外し,表示中のフレームに戻す
+                if finished:
+                    self.view.on_msg(on_msg, remove=True)
+                    self.view._set_coordinates(current_frame)
+                
+        if not frames:
+            return
+        self.view.on_msg(on_msg)
+        try:
+            submit()
+        except Exception:
+            self.view.on_msg(on_msg, remove=True)
+            raise
         
     def rotate_view(self,e,x,y,z):
         rotate_view(self.view,x=x,y=y,z=z)
@@ -314,42 +408,135 @@ class View(NGLDisplay):
         self.view.center()
         
     def update_label(self,e=None):
+        """ラベルを全て送信し直す(色,サイズの変更時など)"""
+        if not self._label_repr_added:
+            return
+        label_indices = self._get_label_indices(len(self._get_current_atoms()))
+        self.labelText = self._get_label_text_array(label_indices)
         self.view.update_label(
             color=self.gui.color_picker.value,
             labelType="text",
-            labelText=self.labelText,
+            labelText=dict(zip(label_indices.tolist(),self.labelText.tolist())),
             zOffset=2.0,
             attachment="middle_center",
             radius=self.gui.label_size.value,
         )
+        self._sent_label_text = self.labelText
         
-    def _change_label(self,atoms,option):
+    def set_label_indices(self,indices=None):
+        """ラベルを表示する原子を指定する
+        
+        Parameters:
+        
+        indices: list of int or str
+            | index番号のリストまたは'0-10,23'のような文字列.
+            | Noneの場合,全原子にラベルを表示する.
+        """
+        if isinstance(indices,str):
+            indices = parsestr2list(indices) if indices.strip() else None
+        self.label_indices = None if indices is None else np.unique(np.asarray(indices,dtype=int))
+        if self._label_repr_added:
+            self._rebuild_label_repr()
+        
+    def _change_label_indices(self,e=None):
+        self.gui.out_widget.clear_output()
+        try:
+            self.set_label_indices(self.gui.label_indices_text.value)
+        except ValueError:
+            with self.gui.out_widget:
+                print(traceback.format_exc(), file=sys.stderr)
+        
+    def _rebuild_label_repr(self):
+        """ラベル対象が変わった場合はselectionごとラベルのRepresentationを作り直す"""
+        label_indices = self._get_label_indices(len(self._get_current_atoms()))
+        self.labelText = self._get_label_text_array(label_indices)
+        if self._label_repr_added:
+            self.view.remove_label()
+        self.view.add_label(
+            selection="@"+",".join(map(str,label_indices.tolist())) if self.label_indices is not None else "all",
+            color=self.gui.color_picker.value,
+            labelType="text",
+            labelText=dict(zip(label_indices.tolist(),self.labelText.tolist())),
+            zOffset=2.0,
+            attachment="middle_center",
+            radius=self.gui.label_size.value,
+        )
+        self._label_repr_added = True
+        self._sent_label_text = self.labelText
+        
+    def _get_label_indices(self,n_atoms) -> np.ndarray:
+        if self.label_indices is None:
+            return np.arange(n_atoms)
+        return self.label_indices[self.label_indices < n_atoms]
+        
+    def _get_label_text_array(self,label_indices):
+        """現在のフレーム,ラベルオプションでのラベル(label_indicesの原子のみ)をnumpy配列で返す"""
+        atoms = self._get_current_atoms()
+        option = self.gui.label_radio_btn.value
         if option == "インデックス":
-            self.labelText=[str(i) for i in range(len(atoms))]
+            if self._index_text_cache is None or len(self._index_text_cache) != len(atoms):
+                self._index_text_cache = np.arange(len(atoms)).astype(str)
+            return self._index_text_cache[label_indices]
         elif option == "元素":
-            self.labelText=[i for i in atoms.get_chemical_symbols()]
+            numbers, symbol_text = self._symbol_text_cache
+            if numbers is None or not np.array_equal(numbers, atoms.numbers):
+                symbol_text = np.array(atoms.get_chemical_symbols())
+                self._symbol_text_cache = (atoms.numbers.copy(), symbol_text)
+            return symbol_text[label_indices]
         elif option == "電荷":
             try:
-                self.labelText = np.round(atoms.get_charges().ravel(), self.gui.charge_round.value).astype("str").tolist()
+                charges = atoms.get_charges().ravel()[label_indices]
             except:
-                self.labelText=["" for _ in range(len(atoms))]
                 with self.gui.out_widget:
-                    raise Exception("Calculatorを設定してください")    
+                    print("Calculatorを設定してください", file=sys.stderr)
+                return np.full(len(label_indices), "")
+            return np.round(charges, self.gui.charge_round.value).astype(str)
         elif option == "FixAtoms":
-            self.labelText = self._get_fix_atoms_label_text(atoms)
-        self.update_label()
+            return self._get_fix_atoms_label_text(atoms)[label_indices]
+        return np.full(len(label_indices), "")
+        
+    def _push_label_text(self,label_text,label_indices):
+        """前回送信したラベルから変化したものだけをフロントエンドへ送る"""
+        if not self._label_repr_added:
+            self._rebuild_label_repr()
+            return
+        sent = self._sent_label_text
+        if sent is None or sent.shape != label_text.shape:
+            self.update_label()
+            return
+        changed = np.flatnonzero(sent != label_text)
+        self.labelText = label_text
+        self._sent_label_text = label_text
+        if changed.size == 0:
+            return
+        diff = dict(zip(label_indices[changed].tolist(),label_text[changed].tolist()))
+        js_code = """
+        var component = this.stage.compList[0]
+        component.eachRepresentation(function (repr) {
+          if (repr.repr.type === 'label') {
+            Object.assign(repr.repr.labelText, labelDiff)
+            repr.build()
+          }
+        })
+        """
+        self.view._execute_js_code(f"var labelDiff = {json.dumps(diff)}" + js_code)
+        
+    def _change_label(self,atoms,option):
+        label_indices = self._get_label_indices(len(atoms))
+        self._push_label_text(self._get_label_text_array(label_indices),label_indices)
         
     def change_label(self,e=None):
         self.gui.out_widget.clear_output()
         option = self.gui.label_radio_btn.value
-        atoms = self._get_current_atoms()
         if option == "なし":
-            self.labelText=["" for _ in range(len(atoms))]
-            self.update_label()
-            return 
-        else:
-            self._change_label(atoms,option)
-            return 
+            # ラベルを使わない場合はRepresentationごと削除する
+            if self._label_repr_added:
+                self.view.remove_label()
+                self._label_repr_added = False
+                self._sent_label_text = None
+            return
+        atoms = self._get_current_atoms()
+        self._change_label(atoms,option)
            
     def change_camera(self,e=None):
         option = self.gui.camera_radio_btn.value
@@ -358,16 +545,81 @@ class View(NGLDisplay):
         elif option == "透視投影":
             self.view.camera = 'perspective'
             
+    def _init_display(self, atoms, xsize, ysize):
+        """NGLDisplay.__init__からRepresentation(spacefill)の作成を除いたもの"""
+        if isinstance(atoms, Atoms):
+            self.view = nv.show_ase(atoms, default=False)
+            self.struct = atoms
+            self.frm = None
+        else:
+            self.view = nv.show_asetraj(atoms, default=False)
+            self.frm = IntSlider(value=0, min=0, max=len(atoms) - 1)
+            self.frm.observe(self._update_frame)
+            self.struct = atoms[0]
+        self.atoms = atoms
+        self.colors = {}
+        self.view._remote_call('setSize', target='Widget',
+                               args=['%dpx' % (xsize,), '%dpx' % (ysize,)])
+        self.view.add_unitcell()
+        self.view.camera = 'orthographic'
+        self.view.parameters = {"clipDist": 0}
+        self.view.center()
+
+        self.asel = Dropdown(options=['All'] + list(set(self.struct.get_chemical_symbols())),
+                             value='All', description='Show')
+        self.csel = Dropdown(options=nv.color.COLOR_SCHEMES, value='element', description='Color scheme')
+        self.rad = FloatSlider(value=0.5, min=0.0, max=1.5, step=0.01, description='Ball size')
+        self.asel.observe(self._select_atom)
+        self.csel.observe(self._update_repr)
+        self.rad.observe(self._update_repr)
+
+        wdg = [self.asel, self.csel, self.rad]
+        if self.frm:
+            wdg.append(self.frm)
+        self.gui = HBox([self.view, VBox(wdg)])
+        self.gui.view = self.view
+
+    def get_lod(self):
+        """原子数から表示の詳細度('full','reduced','line')を決める"""
+        if self.gui.full_detail_checkbox.value:
+            return "full"
+        n_atoms = len(self._get_current_atoms())
+        if n_atoms >= self.lod_thresholds["line"]:
+            return "line"
+        elif n_atoms >= self.lod_thresholds["reduced"]:
+            return "reduced"
+        return "full"
+        
     def _update_repr(self,e=None):
         option = self.gui.model_radio_btn.value
-        if option == "球棒モデル":
+        lod = self.get_lod()
+        lod_params = blender_default.lod_params[lod]
+        if self._repr_state != (option,lod):
+            # モデルまたはLODが変わった場合のみRepresentationを作り直す
+            if self._repr_state is not None:
+                for repr_name in ["spacefill","ball_and_stick","line","point"]:
+                    self.view._remove_representations_by_name(repr_name)
+            if lod == "line":
+                if option == "球棒モデル":
+                    self.view.add_line(color_scheme=self.csel.value)
+                elif option == "空間充填モデル":
+                    self.view.add_point(color_scheme=self.csel.value)
+            else:
+                if option == "球棒モデル":
+                    self.view.add_spacefill(**lod_params)
+                    self.view.add_ball_and_stick(**lod_params)
+                elif option == "空間充填モデル":
+                    self.view.add_spacefill(**lod_params)
+            self._repr_state = (option,lod)
+        if lod == "line":
+            self.view._update_representations_by_name("line" if option == "球棒モデル" else "point",
+                                                      color_scheme=self.csel.value)
+        elif option == "球棒モデル":
             self.view.update_spacefill(radiusType='covalent',
                                     radiusScale=self.rad.value,
                                     color_scheme=self.csel.value)#color_scale='rainbow')
             self.view.update_ball_and_stick(color_scheme=self.csel.value)
         elif option == "空間充填モデル":
-            self.view.remove_spacefill()
-            self.view.add_spacefill()
             self.view.update_spacefill(radiusType="vwf",color_scheme=self.csel.value)
                 
     def show_unitcell(self,e=None):
@@ -383,17 +635,11 @@ class View(NGLDisplay):
             return self.atoms[self.view.frame]
         
     def _get_fix_atoms_label_text(self,atoms):
-        indices_list = []
+        fix_mask = np.zeros(len(atoms),dtype=bool)
         for constraint in atoms.constraints:
             if isinstance(constraint, FixAtoms):
-                indices_list.extend(constraint.index.tolist())
-        label_text = []
-        for i in range(len(atoms)):
-            if i in indices_list:
-                label_text.append("Fix")
-            else:
-                label_text.append("")
-        return label_text
+                fix_mask[constraint.index] = True
+        return np.where(fix_mask,"Fix","")
         
     def change_replace_structure(self,event: Optional[Bunch] = None):
         if self.gui.replace_structure_checkbox.value:
@@ -446,57 +692,25 @@ class View(NGLDisplay):
         """viewプロパティを書かなくてもjupyter上で勝手に表示してくれる"""
         return self.gui._ipython_display_(**kwargs)
         
-    def show_charge_event(self, event: Optional[Bunch] = None, refresh: bool = True):
+    def show_charge_event(self, event: Optional[Bunch] = None):
         self.gui.out_widget.clear_output()
         if self.show_charge:
             atoms = self._get_current_atoms()
             # TODO: How to change `scale` and `radiusScale` by user?
-            # Register "atomStore.partialCharge" attribute inside javascript
             charge_scale: float = self.gui.charge_scale_slider.value
             # Note that Calculator must be set here!
             try:
-                charge_str = str((atoms.get_charges().ravel() * charge_scale).tolist())
+                charges = (atoms.get_charges().ravel() * charge_scale).astype(np.float32)
             except Exception as e:
                 with self.gui.out_widget:
                     print(traceback.format_exc(), file=sys.stderr)
                 # `append_stderr` method shows same text twice somehow...
                 # self.gui.out_widget.append_stderr(str(e))
                 return
-
-            var_code = f"var chargeArray = {charge_str}"
-            js_code = """
-            var component = this.stage.compList[0]
-            var atomStore = component.structure.atomStore
-            if (atomStore.partialCharge === undefined) {
-                atomStore.addField('partialCharge', 1, 'float32')
-            }
-
-            for (let i = 0; i < chargeArray.length; ++i) {
-              atomStore.partialCharge[i] = chargeArray[i];
-            }
-            """
-            self.view._execute_js_code(var_code + js_code)
-
-            # Show charge color
-            # TODO: More efficient way:
-            #  We must set other "color_scheme" at first, to update "partialcharge" color scheme...
-            # color_schme="element" is chosen here, but any color_scheme except "partialcharge" is ok.
-            # Skip this procedure to avoid heavy process, user must turn on and off "show charge" now.
-            if refresh:
-                self.view._update_representations_by_name(
-                    "spacefill",
-                    radiusType="covalent",
-                    radiusScale=self.rad.value,
-                    color_scheme="element",
-                    color_scale="rwb",
-                )
-            self.view._update_representations_by_name(
-                "spacefill",
-                radiusType="covalent",
-                radiusScale=self.rad.value,
-                color_scheme="partialcharge",
-                color_scale="rwb",
-            )
+            # float32のバッファのまま送信し,JS側で"atomStore.partialCharge"に一括コピーする
+            # (register_partial_charge_handlerを参照). Representationの更新も1回のみ.
+            params = {"radiusType":"covalent","radiusScale":self.rad.value,"colorScale":"rwb"}
+            self.view.send({"type":"partial_charge","data":params},buffers=[charges.tobytes()])
         else:
             # Revert to original color scheme.
             self._update_repr()
@@ -83,6 +83,45 @@ def update_tooltip_atoms(view: NGLWidget, atoms: Atoms):
     # https://github.com/nglviewer/ngl/blob/bd4a31c72e007d170b6bae298a5f7c976070e173/src/stage/mouse-behavior.ts#L31-L33
     view._execute_js_code(var_str + script_str)
     
+def register_partial_charge_handler(view: NGLWidget):
+    """電荷(float32のバイナリ)を受け取りatomStore.partialChargeに書き込むハンドラをJS側に登録する.
+    
+    | 電荷は ``view.send({"type": "partial_charge", "data": params}, buffers=[float32のbytes])`` で送る.
+    | paramsはspacefillのradiusType,radiusScale,colorScale.
+    | Representationの更新は1回のみ行う.
+    """
+    script_str = """
+    var that = this;
+    if (this._partialChargeHandler === undefined) {
+      this._partialChargeHandler = function (msg, buffers) {
+        if (msg.type !== 'partial_charge') { return }
+        var buffer = buffers[0]
+        var charges = new Float32Array(buffer.buffer, buffer.byteOffset, buffer.byteLength / 4)
+        var component = that.stage.compList[0]
+        var atomStore = component.structure.atomStore
+        if (atomStore.partialCharge === undefined) {
+          atomStore.addField('partialCharge', 1, 'float32')
+        }
+        atomStore.partialCharge.set(charges.subarray(0, atomStore.count))
+        var p = msg.data
+        component.eachRepresentation(function (repr) {
+          if (repr.repr.type !== 'spacefill') { return }
+          var r = repr.repr
+          if (r.colorScheme !== 'partialcharge' || r.colorScale !== p.colorScale ||
+              r.radiusType !== p.radiusType || r.radiusScale !== p.radiusScale) {
+            repr.setParameters({colorScheme: 'partialcharge', colorScale: p.colorScale,
+                                radiusType: p.radiusType, radiusScale: p.radiusScale})
+          } else {
+            // colorSchemeが同じ場合は色のみ更新する
+            r.update({color: true})
+          }
+        })
+      }
+      this.model.on('msg:custom', this._partialChargeHandler)
+    }
+    """
+    view._execute_js_code(script_str)
+    
 def get_struct(atoms: Atoms, ext="pdb", replace_resseq: bool = False) -> List[Dict]:
     """Convert from ase `atoms` to `struct` object for nglviewer"""
     if ext == "pdb":
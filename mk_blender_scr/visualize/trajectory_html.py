@@ -0,0 +1,177 @@
+import json
+import base64
+import numpy as np
+
+# USER
+from mk_blender_scr.visualize.functions import get_struct
+from mk_blender_scr.visualize.by_nglview import _get_standard_pos
+
+NGL_URL = "https://unpkg.com/ngl@2.0.0-dev.37/dist/ngl.js"
+
+HTML_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<script src="{ngl_url}"></script>
+</head>
+<body>
+<div id="viewport" style="width:{width}px; height:{height}px;"></div>
+<div>
+  <button id="play">&#9654;</button>
+  <input id="frame" type="range" min="0" max="{max_frame}" value="0" style="width:{slider_width}px;">
+  <span id="label">0</span>
+</div>
+<script>
+var PDB = {pdb};
+var META = {meta};
+var FRAMES = {frames};
+var TYPES = {{i1: Int8Array, i2: Int16Array, i4: Int32Array}};
+
+function decode(f) {{
+  var bin = atob(f.d);
+  var bytes = new Uint8Array(bin.length);
+  for (var i = 0; i < bin.length; ++i) {{ bytes[i] = bin.charCodeAt(i); }}
+  return new TYPES[f.t](bytes.buffer);
+}}
+
+// 直前に復元したフレームを保持し,キーフレームからの差分を必要な分だけ足す
+var current = null;
+var currentIndex = -1;
+function getFrame(k) {{
+  var start = k - (k % META.keyframe_interval);
+  var from = currentIndex + 1;
+  if (!(currentIndex >= start && currentIndex <= k)) {{
+    current = Int32Array.from(decode(FRAMES[start]));
+    from = start + 1;
+  }}
+  for (var i = from; i <= k; ++i) {{
+    var d = decode(FRAMES[i]);
+    for (var j = 0; j < d.length; ++j) {{ current[j] += d[j]; }}
+  }}
+  currentIndex = k;
+  var out = new Float32Array(current.length);
+  for (var j = 0; j < current.length; ++j) {{ out[j] = current[j] * META.precision; }}
+  return out;
+}}
+
+var stage = new NGL.Stage("viewport", {{backgroundColor: "white"}});
+stage.loadFile(new Blob([PDB], {{type: "text/plain"}}), {{ext: "pdb"}}).then(function (comp) {{
+  comp.addRepresentation("ball+stick");
+  comp.autoView();
+  var slider = document.getElementById("frame");
+  var label = document.getElementById("label");
+  function show(k) {{
+    comp.structure.updatePosition(getFrame(k));
+    comp.updateRepresentations({{position: true}});
+    label.textContent = k;
+  }}
+  slider.oninput = function () {{ show(parseInt(slider.value)); }};
+  var timer = null;
+  document.getElementById("play").onclick = function () {{
+    if (timer !== null) {{ clearInterval(timer); timer = null; return; }}
+    timer = setInterval(function () {{
+      slider.value = (parseInt(slider.value) + 1) % META.n_frames;
+      show(parseInt(slider.value));
+    }}, META.interval);
+  }};
+}});
+</script>
+</body>
+</html>
+"""
+
+def _b64(a):
+    return base64.b64encode(np.ascontiguousarray(a).tobytes()).decode()
+
+def _smallest_int_type(a):
+    if a.size == 0 or (a.min() >= -128 and a.max() <= 127):
+        return "i1",np.int8
+    elif a.min() >= -32768 and a.max() <= 32767:
+        return "i2",np.int16
+    return "i4",np.int32
+
+def write_trajectory_html(filename,images,stride=1,precision=1e-3,keyframe_interval=50,
+                          width=600,height=600,interval=100):
+    """トラジェクトリを軽量なHTMLとして保存する
+
+    | 座標をprecision単位で量子化し,キーフレーム以外は前フレームとの差分を
+    | 最小の整数型(int8/int16/int32)のbase64として埋め込む.
+    | 各フレームはページ内のJSで必要になった時に復元される.
+
+    Parameters:
+
+    filename: str
+        HTMLファイル名
+    images: Trajectory or list of Atoms or MemmapTrajectory
+        トラジェクトリ
+    stride: int
+        何フレーム毎に保存するか
+    precision: float
+        座標の量子化幅(Å)
+    keyframe_interval: int
+        | 何フレーム毎に差分でない座標を保存するか.
+        | 大きいほど小さくなるが,フレームを飛ばした時の復元に時間がかかる.
+    width: int
+        横幅(px単位)
+    height: int
+        縦幅(px単位)
+    interval: int
+        再生時のフレーム間隔(ms)
+
+    Returns:
+        dict: フレーム数,原子数,ファイルサイズ,float32の生データ及びJSONでのサイズ(見積もり)と圧縮率
+    """
+    frames = []
+    previous = None
+    json_bytes = 0
+    if stride < 1:
+        raise ValueError(f"strideは1以上の整数です: {stride}")
+    indices = range(0,len(images),stride)
+    if len(indices) == 0:
+        raise ValueError("保存するフレームがありません(imagesが空です)")
+    for i,index in enumerate(indices):
+        atoms = images[index]
+        pos = _get_standard_pos(atoms)
+        if i == 0:
+            pdb = get_struct(atoms)[0]["data"]
+            n_atoms = len(atoms)
+            # 座標をJSONで埋め込んだ場合のサイズの見積もり(1フレーム分×フレーム数)
+            json_bytes = len(json.dumps(np.round(pos,3).ravel().tolist()))*len(indices)
+        q = np.round(pos/precision).astype(np.int32).ravel()
+        if i % keyframe_interval == 0:
+            frames.append({"t":"i4","d":_b64(q)})
+        else:
+            delta = q-previous
+            t,dtype = _smallest_int_type(delta)
+            frames.append({"t":t,"d":_b64(delta.astype(dtype))})
+        previous = q
+    meta = {
+        "n_frames":len(frames),
+        "n_atoms":n_atoms,
+        "precision":precision,
+        "keyframe_interval":keyframe_interval,
+        "interval":interval,
+    }
+    html = HTML_TEMPLATE.format(
+        title=filename,
+        ngl_url=NGL_URL,
+        width=width,
+        height=height,
+        slider_width=width-80,
+        max_frame=len(frames)-1,
+        pdb=json.dumps(pdb),
+        meta=json.dumps(meta),
+        frames=json.dumps(frames,separators=(",",":")),
+    )
+    with open(filename,"w",encoding="utf-8") as f:
+        f.write(html)
+    html_bytes = len(html.encode("utf-8"))
+    return {
+        "n_frames":len(frames),
+        "n_atoms":n_atoms,
+        "html_bytes":html_bytes,
+        "raw_float32_bytes":len(frames)*n_atoms*3*4,
+        "json_estimate_bytes":json_bytes,
+        "ratio":json_bytes/html_bytes,
+    }
@@ -0,0 +1,76 @@
+import json
+from pathlib import Path
+
+import numpy as np
+import pytest
+from ase.build import molecule
+from ase.io import write
+
+from mk_blender_scr.blender import BallAndStick,Stick,SpaceFilling,Animation,create,dry_run
+
+# 作成したスクリプトの結果(オブジェクト,メッシュ,マテリアル,キーフレーム等の数)の基準
+# テンプレートを意図して変更した場合は python tests/test_dry_run.py で作り直す
+BASELINE = Path(__file__).with_name("data")/"dry_run_baseline.json"
+EXACT_KEYS = ["objects","meshes","materials","collections","keyframes","handlers","vertices","faces"]
+# オペレーターの呼び出し回数は,テンプレートの細かな変更で多少変わってもよい
+OPERATOR_TOLERANCE = 0.1
+N_FRAMES = 30
+
+def write_trajectory(file):
+    """ベンゼンを決まった乱数で揺らしたN_FRAMESフレームのトラジェクトリ"""
+    rng = np.random.default_rng(0)
+    atoms = molecule("C6H6")
+    images = []
+    for _ in range(N_FRAMES):
+        image = atoms.copy()
+        image.positions += rng.normal(scale=0.05,size=image.positions.shape)
+        images.append(image)
+    write(file,images)
+
+def make_script(name,directory):
+    """ケース毎にスクリプト(.pyまたは.zip)を作成し,そのパスを返す"""
+    ethanol = molecule("CH3CH2OH")
+    directory = Path(directory)
+    if name == "ball_and_stick":
+        style = BallAndStick(ethanol)
+    elif name == "stick_bicolor":
+        style = Stick(ethanol,bicolor=True)
+    elif name == "space_filling_subdivision":
+        style = SpaceFilling(ethanol,subdivision_surface={"apply":True,"level":2,"render_levels":3})
+    else:
+        trajectory = directory/"benzene.xyz"
+        write_trajectory(trajectory)
+        playback = "handler" if name == "animation_handler" else "keyframe"
+        file = directory/f"{name}.zip"
+        create(file,Animation(str(trajectory),playback=playback))
+        return file
+    file = directory/f"{name}.py"
+    create(file,style)
+    return file
+
+CASES = ["ball_and_stick","stick_bicolor","space_filling_subdivision","animation_keyframe","animation_handler"]
+
+@pytest.fixture(scope="module")
+def baseline():
+    with open(BASELINE) as f:
+        return json.load(f)
+
+@pytest.mark.parametrize("name",CASES)
+def test_dry_run_matches_baseline(tmp_path,baseline,name):
+    report = dry_run(make_script(name,tmp_path))
+    expected = baseline[name]
+    assert {key:report[key] for key in EXACT_KEYS} == {key:expected[key] for key in EXACT_KEYS}
+    assert report["operator_calls"] == pytest.approx(expected["operator_calls"],rel=OPERATOR_TOLERANCE)
+
+if __name__ == "__main__":
+    import tempfile
+    reports = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for name in CASES:
+            report = dry_run(make_script(name,tmpdir))
+            reports[name] = {key:report[key] for key in EXACT_KEYS+["operator_calls"]}
+    BASELINE.parent.mkdir(exist_ok=True)
+    with open(BASELINE,"w") as f:
+        json.dump(reports,f,indent=2)
+        f.write("\n")
+    print(json.dumps(reports,indent=2))
@@ -0,0 +1,138 @@
+import json
+import struct
+from collections import Counter
+
+import numpy as np
+import pytest
+from ase.build import molecule
+
+from mk_blender_scr.blender import BallAndStick,Stick,SpaceFilling,export_mesh
+from mk_blender_scr.blender.mesh_export import validate_glb,validate_ply
+
+# エタノール(C2H6O): 9原子,8結合(C-C,C-O,O-H,C-H x5)
+# UV球(32x16): 482頂点,960三角形 / 円柱(32): 130頂点,128三角形
+SPHERE_VERTICES,SPHERE_TRIANGLES = 482,960
+CYLINDER_VERTICES,CYLINDER_TRIANGLES = 130,128
+
+@pytest.fixture
+def ethanol():
+    return molecule("CH3CH2OH")
+
+def read_gltf(file):
+    """glbのJSONチャンク"""
+    data = file.read_bytes()
+    json_length = struct.unpack_from("<I",data,12)[0]
+    return json.loads(data[20:20+json_length])
+
+def read_ply_colors(file):
+    """PLYの頂点色(r,g,b)の出現回数"""
+    data = file.read_bytes()
+    end = data.find(b"end_header\n")+len(b"end_header\n")
+    n_vertices = int(next(line.split()[2] for line in data[:end].decode().splitlines()
+                          if line.startswith("element vertex")))
+    vertex = np.frombuffer(data,dtype=[("pos","<f4",(6,)),("rgb","u1",(3,))],count=n_vertices,offset=end)
+    return Counter(map(tuple,vertex["rgb"].tolist()))
+
+def to_rgb255(rgba):
+    return tuple(int(v) for v in np.round(np.array(rgba[:3])*255))
+
+# (style,glbのメッシュ数,ノード数(ルートを含む),頂点数,三角形数)
+GLB_CASES = [
+    # 球は元素毎(C,H,O),bicolorの円柱は端の元素毎(C,H,O)のメッシュ.ノードは9原子+16半結合
+    ("ball_and_stick_bicolor",6,1+9+16,3*SPHERE_VERTICES+3*CYLINDER_VERTICES,3*SPHERE_TRIANGLES+3*CYLINDER_TRIANGLES),
+    ("ball_and_stick",4,1+9+8,3*SPHERE_VERTICES+CYLINDER_VERTICES,3*SPHERE_TRIANGLES+CYLINDER_TRIANGLES),
+    ("stick_bicolor",3,1+16,3*CYLINDER_VERTICES,3*CYLINDER_TRIANGLES),
+    ("stick",1,1+8,CYLINDER_VERTICES,CYLINDER_TRIANGLES),
+    ("space_filling",3,1+9,3*SPHERE_VERTICES,3*SPHERE_TRIANGLES),
+]
+
+# (style,PLYの頂点数,三角形数) PLYは全ての原子・結合を1つのメッシュにまとめる
+PLY_CASES = [
+    ("ball_and_stick_bicolor",9*SPHERE_VERTICES+16*CYLINDER_VERTICES,9*SPHERE_TRIANGLES+16*CYLINDER_TRIANGLES),
+    ("ball_and_stick",9*SPHERE_VERTICES+8*CYLINDER_VERTICES,9*SPHERE_TRIANGLES+8*CYLINDER_TRIANGLES),
+    ("stick_bicolor",16*CYLINDER_VERTICES,16*CYLINDER_TRIANGLES),
+    ("stick",8*CYLINDER_VERTICES,8*CYLINDER_TRIANGLES),
+    ("space_filling",9*SPHERE_VERTICES,9*SPHERE_TRIANGLES),
+]
+
+def make_style(name,atoms):
+    if name == "ball_and_stick_bicolor":
+        return BallAndStick(atoms,bicolor=True)
+    elif name == "ball_and_stick":
+        return BallAndStick(atoms)
+    elif name == "stick_bicolor":
+        return Stick(atoms,bicolor=True)
+    elif name == "stick":
+        return Stick(atoms)
+    return SpaceFilling(atoms)
+
+@pytest.mark.parametrize("name,meshes,nodes,vertices,triangles",GLB_CASES)
+def test_glb_counts(tmp_path,ethanol,name,meshes,nodes,vertices,triangles):
+    file = tmp_path/"out.glb"
+    report = export_mesh(file,make_style(name,ethanol))
+    assert report["meshes"] == meshes
+    assert report["nodes"] == nodes-1
+    assert validate_glb(file) == {"meshes":meshes,"nodes":nodes,"vertices":vertices,"triangles":triangles}
+
+@pytest.mark.parametrize("name,vertices,triangles",PLY_CASES)
+def test_ply_counts(tmp_path,ethanol,name,vertices,triangles):
+    file = tmp_path/"out.ply"
+    report = export_mesh(file,make_style(name,ethanol))
+    assert (report["vertices"],report["faces"]) == (vertices,triangles)
+    assert validate_ply(file) == {"vertices":vertices,"triangles":triangles}
+
+def test_glb_merged_counts(tmp_path,ethanol):
+    # instancing=Falseでは材質毎に1つのメッシュ(C,H,O)にまとめる
+    file = tmp_path/"out.glb"
+    export_mesh(file,BallAndStick(ethanol,bicolor=True),instancing=False)
+    assert validate_glb(file) == {"meshes":3,"nodes":1+3,
+                                  "vertices":9*SPHERE_VERTICES+16*CYLINDER_VERTICES,
+                                  "triangles":9*SPHERE_TRIANGLES+16*CYLINDER_TRIANGLES}
+
+def test_space_filling_merged_counts(tmp_path,ethanol):
+    # 結合の無いSpaceFillingでも,instancing=Falseでは元素毎(C,H,O)に1つのメッシュ
+    file = tmp_path/"out.glb"
+    report = export_mesh(file,SpaceFilling(ethanol),instancing=False)
+    assert (report["meshes"],report["nodes"]) == (3,3)
+    assert validate_glb(file) == {"meshes":3,"nodes":1+3,
+                                  "vertices":9*SPHERE_VERTICES,"triangles":9*SPHERE_TRIANGLES}
+
+@pytest.mark.parametrize("name",[case[0] for case in GLB_CASES])
+def test_glb_materials_round_trip(tmp_path,ethanol,name):
+    style = make_style(name,ethanol)
+    data = style.todict()
+    bicolor = data.get("bicolor",False)
+    expected = {}
+    # 球と,bicolorの結合は元素の色.単色の結合は'bond'(stick_color)
+    if data["style"] in ["ball_and_stick","space_filling"] or bicolor:
+        expected.update({symb:list(rgba) for symb,rgba in data["colors"].items()})
+    if data["style"] in ["ball_and_stick","stick"] and not bicolor:
+        expected["bond"] = list(data["stick_color"])
+    file = tmp_path/"out.glb"
+    export_mesh(file,style)
+    gltf = read_gltf(file)
+    materials = {m["name"]:m["pbrMetallicRoughness"]["baseColorFactor"] for m in gltf["materials"]}
+    assert set(materials) == set(expected)
+    for material,rgba in materials.items():
+        assert rgba == pytest.approx(expected[material])
+
+@pytest.mark.parametrize("name",[case[0] for case in PLY_CASES])
+def test_ply_colors_round_trip(tmp_path,ethanol,name):
+    # PLYは材質の色を頂点色として書き込む.色毎の頂点数が形状の数と一致する
+    style = make_style(name,ethanol)
+    data = style.todict()
+    symbols = np.array(data["chemical_symbols"])
+    bonds = np.array(data.get("bonds",[]),dtype=int).reshape(-1,2)
+    expected = Counter()
+    if data["style"] in ["ball_and_stick","space_filling"]:
+        for symb in symbols:
+            expected[to_rgb255(data["colors"][symb])] += SPHERE_VERTICES
+    if data["style"] in ["ball_and_stick","stick"]:
+        if data["bicolor"]:
+            for symb in symbols[bonds].ravel():
+                expected[to_rgb255(data["colors"][symb])] += CYLINDER_VERTICES
+        else:
+            expected[to_rgb255(data["stick_color"])] += len(bonds)*CYLINDER_VERTICES
+    file = tmp_path/"out.ply"
+    export_mesh(file,style)
+    assert read_ply_colors(file) == expected
@@ -0,0 +1,53 @@
+import pytest
+from ase.build import bulk,molecule
+
+from mk_blender_scr.blender import BallAndStick,Stick,SpaceFilling,estimate
+from mk_blender_scr.blender.make_script import get_data_list
+
+HUGE_BUDGET = 10**12
+
+def ethanol():
+    return molecule("CH3CH2OH")
+
+def copper():
+    return bulk("Cu","fcc",a=3.6,cubic=True).repeat((4,4,4))
+
+SCENES = {
+    "space_filling_subdivision":lambda:[SpaceFilling(ethanol(),subdivision_surface={"apply":True,"level":2,"render_levels":3})],
+    "ball_and_stick":lambda:[BallAndStick(ethanol())],
+    "stick_bicolor":lambda:[Stick(ethanol(),bicolor=True)],
+    "copper_and_ethanol":lambda:[SpaceFilling(copper()),BallAndStick(ethanol(),bicolor=True)],
+}
+
+def total_faces(styles,polygon_budget):
+    return estimate(styles,polygon_budget=polygon_budget,action="ignore")["total"]["faces"]
+
+def tessellations(styles,polygon_budget):
+    data_list,_ = get_data_list(styles,polygon_budget=polygon_budget)
+    return [data["tessellation"] for data in data_list]
+
+@pytest.mark.parametrize("name",SCENES)
+def test_huge_budget_is_not_coarser_than_default(name):
+    styles = SCENES[name]()
+    assert total_faces(styles,HUGE_BUDGET) >= total_faces(styles,None)
+    for chosen,default in zip(tessellations(styles,HUGE_BUDGET),tessellations(styles,None)):
+        assert chosen["cylinder_vertices"] >= default["cylinder_vertices"]
+        for symb,sphere in chosen["spheres"].items():
+            assert sphere["segments"] >= default["spheres"][symb]["segments"]
+            assert sphere["rings"] >= default["spheres"][symb]["rings"]
+            if default["spheres"][symb]["subdivision"] is not None:
+                for key in ["levels","render_levels"]:
+                    assert sphere["subdivision"][key] >= default["spheres"][symb]["subdivision"][key]
+
+@pytest.mark.parametrize("name",SCENES)
+def test_budget_between_default_and_maximum(name):
+    # デフォルトの面数ちょうどの上限では,デフォルト以上かつ上限以下
+    styles = SCENES[name]()
+    budget = total_faces(styles,None)
+    assert budget <= total_faces(styles,budget) <= budget
+
+@pytest.mark.parametrize("name",SCENES)
+def test_small_budget_is_respected(name):
+    styles = SCENES[name]()
+    budget = total_faces(styles,None)//2
+    assert total_faces(styles,budget) <= budget